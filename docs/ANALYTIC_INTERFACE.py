@@ -9,6 +9,7 @@
 
 #must include these relative imports
 from bedrock.analytics.utils import Algorithm 
+import numpy as np
 
 #must return the same nme as the class listed below
 def get_classname():
@@ -16,6 +17,18 @@ def get_classname():
 
 #must inherit from Algorithm
 class Kmeans(Algorithm):
+    #optional: set to True when classify maps a list of rows to a list with one result per row.
+    #concurrent classify requests to the model are then answered by one classify call over
+    #all of their rows (MODEL_BATCHING in CONSTANTS.py turns this off)
+    batchable = True
+
+    #optional: attributes holding the fitted state of a Model. after compute they are saved as an
+    #artifact beside the results (save_model), publishing pins that artifact and every instance
+    #serving the model restores them before classify (load_model). numeric arrays are stored as
+    #.npy files and memory mapped when large, anything else is pickled. override model_state and
+    #restore_state when the state is not kept in plain attributes
+    model_attributes = ['centroids']
+
     def __init__(self):
         super(Kmeans, self).__init__()
 
@@ -31,8 +44,9 @@ class Kmeans(Algorithm):
         #name used in the UI for display
         self.name ='KMeans'
 
-        #type of algorithm: {Dimension Reduction, Clustering, Statistics}
-        self.type = 'Clustering'
+        #type of algorithm: {Dimension Reduction, Clustering, Statistics, Classification, Model}
+        #a Model can be published and then classifies new data with the state fitted by compute
+        self.type = 'Model'
 
         #description used in the UI for display
         self.description = 'Performs K-means clustering on the input dataset.'
@@ -46,8 +60,16 @@ class Kmeans(Algorithm):
     # for example: {'assignments.csv': {'rootdir': 'path/to/dir/containing/assignments.csv'}}
     # access like: assignments_path = inputs['assignments.csv'] ['rootdir'] + 'assignments.csv'
     def compute(self, filepath, **kwargs):
+        #set the attributes listed in model_attributes, e.g. self.centroids as a numpy array
+
         #if output files are not written during the compute function, add them to the results dictionary
         #and the framework will write them to the appropriate location
         self.results = {'assignments.csv': self.clusters}
 
         #no return objects permitted
+
+    #required by Classification and Model analytics: return the results for the rows in inputs.
+    #the instance is kept warm between requests, it is built once per set of parameters
+    def classify(self, inputs):
+        rows = np.asarray(inputs, dtype=float)
+        return [int(np.argmin(((self.centroids - row) ** 2).sum(axis=1))) for row in rows]
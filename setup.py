@@ -63,7 +63,7 @@ setup(
     # requirements files see:
     # https://packaging.python.org/en/latest/requirements.html
     install_requires=[
-        'pymongo>=3.2.2',
+        'pymongo>=3.7',
         'Flask',
         'flask-restplus==0.4.0',
         'flask-restful',
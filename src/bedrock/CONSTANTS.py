@@ -1,6 +1,13 @@
 #CONSTANTS
+import sys
+
 MONGO_HOST = 'localhost'
 MONGO_PORT = 27017
+MONGO_POOL_SIZE = 100
+COUNTER_FLUSH_COUNT = 1000
+COUNTER_FLUSH_INTERVAL = 1.0
+OPALS_VERSION_CHECK_INTERVAL = 10
+PREWARM_OPALS = False
 VIS_DB_NAME = 'visualization'
 VIS_COL_NAME = 'visualizations'
 MYSQL_HOST = ''
@@ -11,10 +18,80 @@ DATALOADER_DB_NAME = 'dataloader'
 DATALOADER_COL_NAME = 'sources'
 INGEST_COL_NAME = 'ingest'
 FILTERS_COL_NAME = 'filters'
+MATRICES_COL_NAME = 'matrices'
 DATALOADER_PATH = '/opt/bedrock/dataloader/data/'
+MATRIX_BINARY = True
+MATRIX_WRITE_BLOCK = 100000
+MATRIX_CACHE_BYTES = 2 * 1024 ** 3
+CSV_PARALLEL_BYTES = 64 * 1024 ** 2
+CSV_CHUNK_BYTES = 32 * 1024 ** 2
+CSV_WORKERS = 0
+MATRIX_SEGMENTS = True
+SEGMENT_COMPACT_ROWS = 10000
+SEGMENT_COMPACT_COUNT = 8
+SEGMENT_MAX_ROWS = 1000000
+# merged segments stay on disk this long for readers of the manifest that still lists them
+SEGMENT_RETIRE_SECONDS = 300
+DATALOADER_WORKERS = 4
+DATALOADER_QUEUE_DEPTH = 100
+FILTER_WORKERS = 4
+EXPLORE_SAMPLE_ROWS = 1000
+EXPLORE_EXAMPLES = 10
+EXPLORE_CACHE = True
+STREAMS_COL_NAME = 'streams'
+# private (0700) directory holding the supervisor socket and the authkey generated on first use
+STREAM_SUPERVISOR_DIR = DATALOADER_PATH + '.streams/'
+# interpreter that runs the supervisor, the one of the server that spawns it. set it to the python
+# of the bedrock environment when sys.executable is not a python binary (e.g. under mod_wsgi)
+STREAM_PYTHON = sys.executable or 'python'
+STREAM_MAX_CONCURRENT = 8
+STREAM_MAX_RESTARTS = 5
+STREAM_STOP_TIMEOUT = 10
+STREAM_CHECK_INTERVAL = 1.0
 
 ANALYTICS_OPALS = '/opt/bedrock/analytics/opals/'
 ANALYTICS_DB_NAME = 'analytics'
 ANALYTICS_COL_NAME = 'analytics'
 RESULTS_COL_NAME = 'results'
+RESULT_ITEMS_COL_NAME = 'result_items'
 RESULTS_PATH = '/opt/bedrock/analytics/data/'
+ANALYTICS_WORKERS = 4
+ANALYTICS_QUEUE_DEPTH = 100
+SWEEP_RUNNERS = 2
+SWEEP_MAX_RUNS = 256
+# runs of a sweep queued at once, the rest wait so other analytics requests still get workers
+SWEEP_MAX_PARALLEL = ANALYTICS_WORKERS
+BATCHES_COL_NAME = 'batches'
+BATCH_RUNNERS = 2
+BATCH_MAX_PARALLEL = 4
+BATCH_MAX_MATRICES = 10000
+RESULTS_CACHE = True
+RESULT_CACHE_COL_NAME = 'result_cache'
+RESULTS_CACHE_PATH = '/opt/bedrock/analytics/cache/'
+RESULTS_CACHE_MAX_BYTES = 10 * 1024 ** 3
+RESULTS_CACHE_MAX_ENTRIES = 10000
+MODEL_POOL_BYTES = 1024 ** 3
+MODEL_BATCHING = True
+MODEL_BATCH_WAIT = 0.003
+MODEL_BATCH_MAX_ROWS = 512
+MODEL_MMAP_BYTES = 16 * 1024 ** 2
+
+JOBS_DB_NAME = 'jobs'
+JOBS_COL_NAME = 'jobs'
+JOB_POLL_INTERVAL = 0.5
+# running jobs refresh their heartbeat this often, and are reaped once it is older than the lease
+JOB_HEARTBEAT_INTERVAL = 10
+JOB_LEASE = 60
+JOB_REAP_INTERVAL = 30
+JOB_MAX_ATTEMPTS = 2
+# coordinator jobs give up on the jobs they wait for after this many seconds
+JOB_WAIT_TIMEOUT = 24 * 3600
+
+WORKFLOW_DB_NAME = 'flows'
+WORKFLOW_COL_NAME = 'flows'
+WORKFLOW_RUNS_COL_NAME = 'runs'
+WORKFLOW_OUTPUTS_COL_NAME = 'node_outputs'
+WORKFLOW_RUNNERS = 2
+WORKFLOW_WORKERS = 4
+WORKFLOW_MAX_PARALLEL = 4
+WORKFLOW_QUEUE_DEPTH = 20
@@ -12,10 +12,7 @@ import subprocess
 import sys
 import traceback
 from datetime import datetime
-from multiprocessing import Process, Queue
 
-import pymongo
-from pymongo import MongoClient
 from flask import (Flask, Response, abort, g, jsonify, redirect, request,
                    send_from_directory, stream_with_context, url_for)
 import flask_restful as restful
@@ -24,9 +21,14 @@ from werkzeug import secure_filename
 import logging
 
 import utils
-from bedrock.CONSTANTS import MONGO_HOST, MONGO_PORT, ANALYTICS_DB_NAME, ANALYTICS_COL_NAME, ANALYTICS_OPALS
-from bedrock.core.db import drop_id_key
-from bedrock.CONSTANTS import RESULTS_COL_NAME, RESULTS_PATH
+from bedrock.CONSTANTS import ANALYTICS_DB_NAME, ANALYTICS_COL_NAME, ANALYTICS_OPALS
+from bedrock.core.db import db_client, drop_id_key, attach_results, find_result, \
+    delete_result, delete_results, result_items_collection, find_matrix, matrices_collection
+from bedrock.core.jobs import submit_job, start_workers, public_job, QueueFull, QUEUED
+from bedrock.core.resources import job_routes
+from bedrock.CONSTANTS import RESULTS_COL_NAME, RESULTS_PATH, ANALYTICS_WORKERS, ANALYTICS_QUEUE_DEPTH, \
+    SWEEP_RUNNERS, SWEEP_MAX_RUNS, BATCH_RUNNERS, BATCH_MAX_PARALLEL, BATCH_MAX_MATRICES, \
+    DATALOADER_DB_NAME, DATALOADER_COL_NAME
 from bedrock.core.exceptions import asserttype, InvalidUsage
 
 ALLOWED_EXTENSIONS = ['py']
@@ -49,6 +51,7 @@ api = Api(
 
 ns_a = api.namespace('analytics')
 ns_r = api.namespace('results')
+ns_j = api.namespace('jobs')
 
 
 def analytics_oftype(typename):
@@ -79,33 +82,48 @@ def analytics_list(col):
 
 
 def analytics_collection():
-    """connect to the database if necessary and return the analytics collection"""
-    db = getattr(g, '_mongodb', None)
-    if db is None:
-        db = g._mongodb = MongoClient(MONGO_HOST, MONGO_PORT)
+    """return the pooled client and the analytics collection"""
+    db = db_client()
     return db, db[ANALYTICS_DB_NAME][ANALYTICS_COL_NAME]
 
 def results_collection():
-    """connect to the database if necessary and return the analytics collection"""
-    db = getattr(g, '_mongodb', None)
-    if db is None:
-        db = g._mongodb = MongoClient(MONGO_HOST, MONGO_PORT)
+    """return the pooled client and the results collection"""
+    db = db_client()
     return db, db[ANALYTICS_DB_NAME][RESULTS_COL_NAME]
 
-def get_results_source(src_id):
+def get_results_source(src_id, results=False):
+    """find the results tree of a matrix by matrix id or name, optionally with its results"""
     _, col = results_collection()
-    res = col.find_one({'src_id': src_id}, {"_id":0})
+    res = col.find_one({'src_id': src_id}, {"_id":0, "results":0})
     if not res:
-        res = col.find_one({'src.name': src_id}, {"_id":0})
+        res = col.find_one({'src.name': src_id}, {"_id":0, "results":0})
+    if res and results:
+        attach_results(col, [res])
 
     return res
 
-@app.teardown_appcontext
-def teardown_db(exception):
-    """closes the database connection"""
-    db = getattr(g, '_mongodb', None)
-    if db is not None:
-        db.close()
+def batch_matrices(data):
+    """the matrix records a batch payload names, from an explicit list, one or more sources or a group"""
+    col = db_client()[DATALOADER_DB_NAME][DATALOADER_COL_NAME]
+    if data.get('matrices'):
+        matrices = []
+        for spec in data['matrices']:
+            matrix = find_matrix(col, spec['src_id'], spec['id'])
+            if matrix is None:
+                raise KeyError('no matrix %s in source %s' % (spec['id'], spec['src_id']))
+            matrices.append(matrix)
+        return matrices
+    if data.get('src_id'):
+        src_ids = data['src_id'] if isinstance(data['src_id'], list) else [data['src_id']]
+    elif data.get('group'):
+        src_ids = [src['src_id'] for src in col.find({'group_name': data['group']}, {'src_id': 1})]
+    else:
+        raise KeyError('one of matrices, src_id or group is required')
+    if not src_ids:
+        return []
+    cur = matrices_collection(col).find({'src_id': {'$in': src_ids}}, {'_id': 0})
+    return list(cur.sort('_id', 1))
+
 ###################################################################################################
 
 
@@ -462,6 +480,7 @@ class Analytics(Resource):
             '''
             Publish/unpublish a model.
             This request is only applicable to analytics that are of type 'Model'.
+            Publishing pins the fitted state of the result given by the res_id query argument, or of the newest result of the model that has one, until the model is published again.
             '''
             # get the analytic
             _, col = analytics_collection()
@@ -476,20 +495,35 @@ class Analytics(Resource):
                     "analytic_id": analytic['analytic_id'],
                     "_id": analytic['_id']
                 }, {'$set': {
-                    "published": False
+                    "published": False,
+                    "published_at": None
                 }})
                 if result:
+                    utils.unload_model(model_id)
                     return "Succesfully unpublished model " + model_id, 200
 
             # publish the model
             else:
+                # every worker rebuilds its instance of the model for a new stamp
+                update = {"published": True, "published_at": utils.getCurrentTime()}
+                res_id = request.args.get('res_id')
+                fitted = utils.find_artifact(model_id, res_id)
+                if fitted is not None:
+                    update['artifact'] = fitted['artifact']
+                    update['artifact_res_id'] = fitted['id']
+                    analytic['artifact'] = fitted['artifact']
+                elif res_id is not None:
+                    return 'Result %s of %s has no model artifact.' % (res_id, model_id), 404
                 result = col.update_one({
                     "analytic_id": analytic['analytic_id'],
                     "_id": analytic['_id']
-                }, {'$set': {
-                    "published": True
-                }})
+                }, {'$set': update})
                 if result:
+                    try:
+                        utils.preload_model(model_id, analytic.get('artifact'), update['published_at'])
+                    except Exception as ex:
+                        # the model is still loaded by its first classify request
+                        logging.warning('could not preload model %s: %s', model_id, ex)
                     # still need to add appropriate host/IP
                     return "Analytic available from /analytics/models/" + analytic[
                         'analytic_id'] + '/', 200
@@ -522,15 +556,16 @@ class Analytics(Resource):
                 return "This analytic is not of type 'Model'", 406
 
             if 'published' not in analytic or not analytic['published']:
+                # it may have been unpublished through another worker
+                utils.unload_model(model_id)
                 return "No resource at that URL", 404
 
             #get the input data
-            print("hi25")
             data = request.get_json()
-            print(data)
-            parameters = data['parameters']
+            parameters = data.get('parameters', [])
             inputs = data['inputs']
-            result = utils.classify(model_id, parameters, inputs)
+            result = utils.classify(model_id, parameters, inputs, analytic.get('artifact'),
+                                    analytic.get('published_at'))
             return result, 200
 
     # @app.route('/analytics/<analytic_id>/', methods=['DELETE'])
@@ -581,7 +616,7 @@ class Analytics(Resource):
                     for key, value in analytic.items() if key != '_id'
                 }
 
-        @api.doc(responses={201: 'Success', 406: 'Error'})
+        @api.doc(responses={202: 'Queued', 503: 'Analytics queue is full'})
         @api.doc(params={
             'payload': 'Must be a list of the model defined to the right.'
         },
@@ -591,6 +626,8 @@ class Analytics(Resource):
             Apply a certain analytic to the provided input data.
             The input must be a list of datasets, which can be matrices and/or results.
 
+            Identical runs (same analytic, parameters and input files) are served from the result cache unless the payload sets "cache": false.
+            The analysis runs in a worker process. The response carries the job_id to poll at /jobs/<job_id>/, the result metadata is available from /jobs/<job_id>/result/ once the job is done.
             '''
             #get the analytic
             _, col = analytics_collection()
@@ -622,71 +659,28 @@ class Analytics(Resource):
             storepath = os.path.join(RESULTS_PATH, mat_id, res_id) + "/"
             os.makedirs(storepath)
 
-            # print("Extracted info for analytic:%s\n %s"%(analytic_id, {
-            #     'src_id': src_id,
-            #     'sub_id': sub_id,
-            #     'parameters': parameters,
-            #     'inputs': inputs,
-            #     'name': name,
-            #     'res_id': res_id
-            # }))
-            #run analysis
-            queue = Queue()
+            #queue the analysis, a worker runs it and stores the result
             try:
-                #single process for now
-                utils.run_analysis(queue, analytic_id, parameters, inputs,
-                                   storepath, name)
-
-                #multiprocess solution from before
-                # p = Process(target=utils.run_analysis, args=(queue, analytic_id, parameters, inputs, storepath, name))
-                # p.start()
-                # p.join() # this blocks until the process terminates
-                outputs = queue.get()
-            except:
-                tb = traceback.format_exc()
-                logging.error(tb)
-                return tb, 406
-
-            if outputs != None:
-                #store metadata
-                _, res_col = results_collection()
-                try:
-                    src = res_col.find({'src_id': mat_id})[0]
-                except IndexError:
-                    src = {}
-                    src['rootdir'] = os.path.join(RESULTS_PATH, mat_id) + '/'
-                    src['src'] = data['src'][0]
-                    src['src_id'] = data['src'][0]['id']
-                    src['results'] = []
-                    res_col.insert(src)
-                    src = res_col.find({'src_id': mat_id})[0]
-
-                res = {}
-                res['id'] = res_id
-                res['rootdir'] = storepath
-                res['name'] = name
-                res['src_id'] = mat_id
-                res['created'] = utils.getCurrentTime()
-                res['analytic_id'] = analytic_id
-                res['parameters'] = parameters
-                res['outputs'] = outputs
-                if isResultSource:
-                    res['res_id'] = [el['id'] for el in data['src']]
-                results = []
-                for each in src['results']:
-                    results.append(each)
-                results.append(res)
-                res_col.update({
-                    'src_id': mat_id
-                }, {'$set': {
-                    'results': results
-                }})
-
-                return res, 201
-            else:
-                tb = traceback.format_exc()
-                logging.error(tb)
-                return tb, 406
+                job = submit_job('analytics', 'bedrock.analytics.utils.analysis_job', {
+                    'analytic_id': analytic_id,
+                    'parameters': parameters,
+                    'inputs': inputs,
+                    'storepath': storepath,
+                    'name': name,
+                    'res_id': res_id,
+                    'mat_id': mat_id,
+                    'src': data['src'][0],
+                    'res_src': [el['id'] for el in data['src']] if isResultSource else None,
+                    'use_cache': data.get('cache', True)
+                }, max_depth=ANALYTICS_QUEUE_DEPTH, meta={'analytic_id': analytic_id, 'res_id': res_id, 'src_id': mat_id})
+            except QueueFull as ex:
+                shutil.rmtree(storepath)
+                return str(ex), 503
+            start_workers('analytics', ANALYTICS_WORKERS)
+
+            resp = public_job(job)
+            resp['res_id'] = res_id
+            return resp, 202, {'Location': '%s/jobs/%s/' % (request.script_root, job['job_id'])}
 
         @api.doc(
             params={'payload': 'Must be list of data to have classified.'},
@@ -698,7 +692,7 @@ class Analytics(Resource):
         def patch(self, analytic_id):
             '''
             Apply a certain analytic to the provided input data and return the classification label(s).
-            This request is only applicable to analytics that are of type 'Classificaiton'.
+            This request is only applicable to analytics that are of type 'Classification' or 'Model', models use the fitted state they were published with.
             '''
             #get the analytic
             _, col = analytics_collection()
@@ -710,17 +704,165 @@ class Analytics(Resource):
             classname = analytic['classname']
             alg_type = analytic['type']
 
-            #make sure it is of type 'Classification'
-            if alg_type == 'Classification':
+            #make sure it classifies
+            if alg_type not in ('Classification', 'Model'):
                 return "This analytic is not of type 'Classification'", 406
 
             #get the input data
             data = request.get_json()
-            parameters = data['parameters']
+            parameters = data.get('parameters', [])
             inputs = data['inputs']
-            result = analytics.classify(analytic_id, parameters, inputs)
+            result = utils.classify(analytic_id, parameters, inputs, analytic.get('artifact'),
+                                    analytic.get('published_at'))
             return result, 200
 
+    @ns_a.route('/<analytic_id>/sweep/')
+    @api.doc(params={'analytic_id': 'The ID assigned to a particular analtyic'})
+    class Sweep(Resource):
+        @api.doc(responses={202: 'Queued', 400: 'Bad Request', 404: 'No resource at that URL',
+                            503: 'Analytics queue is full'})
+        @api.doc(params={
+            'payload': 'The payload of a POST to /analytics/<analytic_id>/ plus "grid", a map of attrname to a list of values, or "runs", a list of {attrname: value} maps, and optionally "metrics", a list of "output" or "output.json:key" to summarize.'
+        })
+        def post(self, analytic_id):
+            '''
+            Run an analytic once per parameter set on one input.
+            Every combination of the grid values (or every entry of runs) overrides the posted parameters and runs as its own analytics job, stored as a normal result.
+            The response carries the job_id of the sweep, /jobs/<job_id>/result/ returns a table with the res_id, status and selected metrics of every run once all of them are done.
+            '''
+            _, col = analytics_collection()
+            if col.find_one({'analytic_id': analytic_id}) is None:
+                return 'No resource at that URL.', 404
+
+            data = request.get_json(force=True)
+            datasrc = data['src'][0]
+            if isinstance(datasrc, list):
+                return "When Posting Analytic %s, datasrc was a list" % analytic_id, 400
+            if not data.get('grid') and not data.get('runs'):
+                return 'A sweep needs a grid or a list of runs', 400
+            isResultSource = 'analytic_id' in datasrc
+            mat_id = datasrc['src_id'] if isResultSource else datasrc['id']
+            try:
+                sweep = utils.sweep_parameters(data['parameters'], data.get('grid'), data.get('runs'))
+            except (AttributeError, KeyError, TypeError) as ex:
+                return 'Bad parameter grid: %s' % ex, 400
+            if len(sweep) > SWEEP_MAX_RUNS:
+                return 'The sweep has %d runs, at most %d are allowed' % (len(sweep), SWEEP_MAX_RUNS), 400
+
+            try:
+                job = submit_job('sweeps', 'bedrock.analytics.utils.sweep_job', {
+                    'analytic_id': analytic_id,
+                    'parameters': data['parameters'],
+                    'inputs': data['inputs'],
+                    'name': data['name'],
+                    'mat_id': mat_id,
+                    'src': datasrc,
+                    'grid': data.get('grid'),
+                    'runs': data.get('runs'),
+                    'metrics': data.get('metrics'),
+                    'res_src': [el['id'] for el in data['src']] if isResultSource else None,
+                    'use_cache': data.get('cache', True)
+                }, max_depth=ANALYTICS_QUEUE_DEPTH, meta={'analytic_id': analytic_id, 'src_id': mat_id,
+                                                          'runs': len(sweep)}, attempts=1)
+            except QueueFull as ex:
+                return str(ex), 503
+            start_workers('sweeps', SWEEP_RUNNERS)
+            start_workers('analytics', ANALYTICS_WORKERS)
+
+            resp = public_job(job)
+            resp['runs'] = len(sweep)
+            return resp, 202, {'Location': '%s/jobs/%s/' % (request.script_root, job['job_id'])}
+
+    @ns_a.route('/<analytic_id>/batch/')
+    @api.doc(params={'analytic_id': 'The ID assigned to a particular analtyic'})
+    class Batch(Resource):
+        @api.doc(responses={202: 'Queued', 400: 'Bad Request', 404: 'No resource at that URL',
+                            503: 'Analytics queue is full'})
+        @api.doc(params={
+            'payload': 'Must contain "name", "parameters" and the matrices to run on: "matrices", a list of {"src_id", "id"}, or "src_id", a source or list of sources whose matrices are all used, or "group", a source group. Optionally "inputs", the list of input filenames (default ["matrix.csv"]), "parallel", the number of runs at a time, and "cache".'
+        })
+        def post(self, analytic_id):
+            '''
+            Run an analytic with one set of parameters on many matrices.
+            Every matrix runs as its own analytics job, at most "parallel" at a time, and is stored as a normal result of that matrix.
+            The response carries the batch_id, /analytics/batches/<batch_id>/ returns the aggregated progress and the res_id and status of every run.
+            '''
+            _, col = analytics_collection()
+            if col.find_one({'analytic_id': analytic_id}) is None:
+                return 'No resource at that URL.', 404
+
+            data = request.get_json(force=True)
+            if 'parameters' not in data or 'name' not in data:
+                return 'A batch needs parameters and a name', 400
+            try:
+                matrices = batch_matrices(data)
+            except (AttributeError, KeyError, TypeError) as ex:
+                return 'Bad list of matrices: %s' % ex, 400
+            if not matrices:
+                return 'The batch matches no matrices', 400
+            if len(matrices) > BATCH_MAX_MATRICES:
+                return 'The batch has %d matrices, at most %d are allowed' % (
+                    len(matrices), BATCH_MAX_MATRICES), 400
+            try:
+                parallel = int(data.get('parallel') or BATCH_MAX_PARALLEL)
+            except (TypeError, ValueError):
+                return 'parallel must be a number', 400
+            if parallel < 1:
+                return 'parallel must be at least 1', 400
+
+            batch_id = utils.getNewId()
+            batches = utils.batches_collection()
+            batches.insert_one({
+                'batch_id': batch_id,
+                'analytic_id': analytic_id,
+                'name': data['name'],
+                'parameters': data['parameters'],
+                'parallel': parallel,
+                'status': QUEUED,
+                'created': utils.getCurrentTime(),
+                'total': len(matrices),
+                'done': 0,
+                'failed': 0,
+                'progress': 0.0,
+                'runs': [{'src_id': matrix['src_id'], 'mat_id': matrix['id']} for matrix in matrices]
+            })
+            try:
+                job = submit_job('batches', 'bedrock.analytics.utils.batch_job', {
+                    'batch_id': batch_id,
+                    'analytic_id': analytic_id,
+                    'parameters': data['parameters'],
+                    'matrices': matrices,
+                    'filenames': data.get('inputs') or ['matrix.csv'],
+                    'name': data['name'],
+                    'max_parallel': parallel,
+                    'use_cache': data.get('cache', True)
+                }, max_depth=ANALYTICS_QUEUE_DEPTH, meta={'analytic_id': analytic_id, 'batch_id': batch_id,
+                                                          'runs': len(matrices)}, attempts=1)
+            except QueueFull as ex:
+                batches.delete_one({'batch_id': batch_id})
+                return str(ex), 503
+            batches.update_one({'batch_id': batch_id}, {'$set': {'job_id': job['job_id']}})
+            start_workers('batches', BATCH_RUNNERS)
+            start_workers('analytics', ANALYTICS_WORKERS)
+
+            resp = public_job(job)
+            resp['batch_id'] = batch_id
+            resp['runs'] = len(matrices)
+            return resp, 202, {'Location': '%s/analytics/batches/%s/' % (request.script_root, batch_id)}
+
+    @ns_a.route('/batches/<batch_id>/')
+    @api.doc(params={'batch_id': 'The ID returned by POST /analytics/<analytic_id>/batch/'})
+    class BatchStatus(Resource):
+        @api.doc(responses={200: 'Success', 404: 'No resource at that URL'})
+        def get(self, batch_id):
+            '''
+            Returns the progress of a batch: its status, the total, done and failed run counts and the res_id, job_id and status of every run.
+            '''
+            batch = utils.get_batch(batch_id)
+            if batch is None:
+                return 'No resource at that URL.', 404
+            return batch
+
 
 @ns_r.route('/')
 class Results(Resource):
@@ -730,16 +872,9 @@ class Results(Resource):
         Returns a list of available results.
         '''
         _, col = results_collection()
-        cur = col.find()
-        results = []
-        for src in cur:
-            response = {
-                key: value
-                for key, value in src.items() if key != '_id'
-            }
-            results.append(response)
+        results = list(col.find({}, {"_id":0, "results":0}))
 
-        return results
+        return attach_results(col, results)
 
     # @api.doc(responses={204: 'Resource removed successfully'})
     @api.hide
@@ -750,6 +885,7 @@ class Results(Resource):
         _, col = results_collection()
         #remove the entries in mongo
         col.remove({})
+        result_items_collection(col).remove({})
         #remove the actual files
         for directory in os.listdir(RESULTS_PATH):
             file_path = os.path.join(RESULTS_PATH, directory)
@@ -765,13 +901,15 @@ class Results(Resource):
             Returns a list of explorable results.
             '''
             _, col = results_collection()
-            cur = col.find()
+            rootdirs = {src['src_id']: src['rootdir']
+                        for src in col.find({}, {'src_id':1, 'rootdir':1})}
+            cur = result_items_collection(col).find({}, {"_id":0})
             explorable = []
-            for src in cur:
-                for result in src['results']:
+            for result in cur:
+                if result['src_id'] in rootdirs:
                     exp = {}
-                    exp['rootdir'] = src['rootdir']
-                    exp['src_id'] = src['src_id']
+                    exp['rootdir'] = rootdirs[result['src_id']]
+                    exp['src_id'] = result['src_id']
                     exp['id'] = result['id']
                     exp['outputs'] = result['outputs']
                     exp['name'] = result['name']
@@ -795,14 +933,12 @@ class Results(Resource):
 
             '''
             res = get_results_source(src_id)
-
-            try:
-                src = src['results']
-            except IndexError:
+            if not res:
                 return 'No resource at that URL.', 404
             else:
-                col.remove(res)
-                shutil.rmtree(os.path.join(RESULTS_PATH + src_id))
+                _, col = results_collection()
+                delete_results(col, res['src_id'])
+                shutil.rmtree(os.path.join(RESULTS_PATH, res['src_id']))
                 return '', 204
 
         @api.doc(model='Results')
@@ -810,7 +946,7 @@ class Results(Resource):
             '''
             Returns the specified result tree.
             '''
-            res = get_results_source(src_id)
+            res = get_results_source(src_id, results=True)
             if not res:
                 return ('Not found', 404)
 
@@ -830,32 +966,17 @@ class Results(Resource):
             Deletes specified result.
             This will permanently remove this result from the system. USE CAREFULLY!
             '''
-            try:
-                res = get_results_source(src_id)
-                res = res['results']
-
-            except IndexError:
+            res = get_results_source(src_id)
+            if not res:
                 return 'No resource at that URL.', 404
 
-            else:
-                results_new = []
-                found = False
-                for each in res:
-                    if each['id'] != res_id and each['name'] != res_id:
-                        results_new.append(each)
-                    else:
-                        found = True
-                if found:
-                    col.update({
-                        'src_id': src_id
-                    }, {'$set': {
-                        'results': results_new
-                    }})
-                else:
-                    return 'No resource at that URL.', 404
+            _, col = results_collection()
+            result = delete_result(col, res['src_id'], res_id)
+            if result is None:
+                return 'No resource at that URL.', 404
 
-                shutil.rmtree(os.path.join(RESULTS_PATH, src_id, res_id))
-                return '', 204
+            shutil.rmtree(os.path.join(RESULTS_PATH, res['src_id'], result['id']))
+            return '', 204
 
         @api.doc(responses={200: 'Success', 404: 'No resource at that URL'})
         @api.doc(model='Result')
@@ -863,18 +984,12 @@ class Results(Resource):
             '''
             Returns the specified result.
             '''
-            try:
-                res = get_results_source(src_id)
-                res = res['results']
-
-            except IndexError:
-                response = {}
-                # return ('No resource at that URL.', 404)
-
-            else:
-                for result in res:
-                    if result['id'] == res_id or result['name'] == res_id:
-                        return {'result': result}
+            res = get_results_source(src_id)
+            if res:
+                _, col = results_collection()
+                result = find_result(col, res['src_id'], res_id)
+                if result:
+                    return {'result': result}
 
             return 'No resource at that URL.', 404
 
@@ -888,16 +1003,17 @@ class Results(Resource):
                 '''
                 res = get_results_source(src_id)
 
-                if not res:
-                    pass
-                else:
-                    res = res['results']
-                    for result in res:
-                        if result['id'] == res_id or result['name'] == res_id:
-                            return send_from_directory(
-                                result['rootdir'],
-                                output_file,
-                                as_attachment=True,
-                                attachment_filename=file_download_name)
+                if res:
+                    _, col = results_collection()
+                    result = find_result(col, res['src_id'], res_id)
+                    if result:
+                        return send_from_directory(
+                            result['rootdir'],
+                            output_file,
+                            as_attachment=True,
+                            attachment_filename=file_download_name)
 
                 return ('No resource at that URL.', 404)
+
+
+job_routes(api, ns_j, ('analytics', 'sweeps', 'batches'), 'analytics job', 'Result')
@@ -0,0 +1,91 @@
+"""artifacts.py persists the fitted state of Model analytics.
+
+An artifact is a directory written beside the result outputs: manifest.json names the
+artifact version, the analytic that fitted it and the attributes it holds. Numeric numpy
+arrays are saved as .npy files that are memory mapped when they are large, everything else
+is pickled into state.pkl. The directory is swapped in whole so a reader never sees half
+of an artifact.
+"""
+import json
+import os
+import shutil
+from datetime import datetime
+import numpy as np
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+from bedrock.CONSTANTS import MODEL_MMAP_BYTES
+from bedrock.core.io import DIRMASK
+
+ARTIFACT_DIR = 'model.artifact'
+ARTIFACT_VERSION = 1
+
+
+class ArtifactError(Exception):
+    """raised when an artifact is missing or was written by an incompatible version"""
+    pass
+
+
+def artifact_path(storepath):
+    """the artifact directory of the result at storepath"""
+    return os.path.join(storepath, ARTIFACT_DIR)
+
+
+def write_artifact(storepath, analytic_id, state):
+    """persist the attribute dict state of analytic_id under storepath, returns the directory"""
+    target = artifact_path(storepath)
+    tmp = target + '.%d.tmp' % os.getpid()
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp, DIRMASK)
+    arrays = {}
+    other = {}
+    for name, value in state.items():
+        if isinstance(value, np.ndarray) and value.dtype.kind in 'biuf':
+            np.save(os.path.join(tmp, name + '.npy'), value)
+            arrays[name] = {'dtype': value.dtype.str, 'shape': list(value.shape)}
+        else:
+            other[name] = value
+    with open(os.path.join(tmp, 'state.pkl'), 'wb') as outfile:
+        pickle.dump(other, outfile, pickle.HIGHEST_PROTOCOL)
+    with open(os.path.join(tmp, 'manifest.json'), 'w') as outfile:
+        json.dump({'version': ARTIFACT_VERSION, 'analytic_id': analytic_id,
+                   'created': str(datetime.now()), 'arrays': arrays,
+                   'attributes': sorted(other)}, outfile)
+    if os.path.exists(target):
+        shutil.rmtree(target)
+    os.rename(tmp, target)
+    return target
+
+
+def read_manifest(path, analytic_id=None):
+    """the manifest of the artifact directory path, which must have been fitted by analytic_id if given"""
+    try:
+        with open(os.path.join(path, 'manifest.json')) as infile:
+            manifest = json.load(infile)
+    except (OSError, IOError, ValueError) as ex:
+        raise ArtifactError('no model artifact at %s: %s' % (path, ex))
+    if manifest.get('version') != ARTIFACT_VERSION:
+        raise ArtifactError('model artifact %s has version %s, expected %s' % (
+            path, manifest.get('version'), ARTIFACT_VERSION))
+    if analytic_id is not None and manifest.get('analytic_id') != analytic_id:
+        raise ArtifactError('model artifact %s was fitted by %s, not %s' % (
+            path, manifest.get('analytic_id'), analytic_id))
+    return manifest
+
+
+def read_artifact(path, analytic_id=None, mmap_bytes=MODEL_MMAP_BYTES):
+    """the attribute dict stored in the artifact directory path and the bytes it holds in memory.
+    arrays of at least mmap_bytes are memory mapped read only. see read_manifest for analytic_id"""
+    manifest = read_manifest(path, analytic_id)
+    with open(os.path.join(path, 'state.pkl'), 'rb') as infile:
+        state = pickle.load(infile)
+    resident = os.path.getsize(os.path.join(path, 'state.pkl'))
+    for name in manifest['arrays']:
+        filepath = os.path.join(path, name + '.npy')
+        mapped = os.path.getsize(filepath) >= mmap_bytes
+        state[name] = np.load(filepath, mmap_mode='r' if mapped else None)
+        if not mapped:
+            resident += state[name].nbytes
+    return state, resident
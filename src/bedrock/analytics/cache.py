@@ -0,0 +1,174 @@
+"""cache.py memoizes analytic results by content.
+
+A result is keyed by a hash of the analytic id, a digest of the opal's source code, the
+normalized parameters and digests of the input files. The output tree of a run is kept
+under RESULTS_CACHE_PATH/<key>/ as hard links, so a later identical run only has to link
+the files into its own result directory. A fetch holds the entry lock shared while it links
+and eviction takes it exclusively, so an entry is never removed under a run that is reading it.
+"""
+import fcntl
+import hashlib
+import inspect
+import json
+import logging
+import os
+import shutil
+from contextlib import contextmanager
+from datetime import datetime
+import pymongo
+import pymongo.errors
+from bedrock.CONSTANTS import ANALYTICS_DB_NAME, RESULT_CACHE_COL_NAME, RESULTS_CACHE_PATH, \
+    RESULTS_CACHE_MAX_BYTES, RESULTS_CACHE_MAX_ENTRIES
+from bedrock.core.db import db_client
+from bedrock.core.utils import resolve_class
+
+# entry locks live here, striped by the first two hex digits of the key so they do not pile up
+LOCKS_DIR = '.locks'
+
+# file digests keyed by (path, size, mtime) so unchanged inputs are only hashed once per process
+_digests = {}
+_indexed = set()
+
+
+def cache_collection():
+    """return the result cache collection, creating its indexes once per process"""
+    col = db_client()[ANALYTICS_DB_NAME][RESULT_CACHE_COL_NAME]
+    if RESULT_CACHE_COL_NAME not in _indexed:
+        col.create_index('key', unique=True)
+        col.create_index('last_used')
+        _indexed.add(RESULT_CACHE_COL_NAME)
+    return col
+
+
+def file_digest(filepath, blocksize=1 << 20):
+    """sha1 of the contents of filepath"""
+    stat = os.stat(filepath)
+    memo = (filepath, stat.st_size, stat.st_mtime)
+    if memo not in _digests:
+        sha = hashlib.sha1()
+        with open(filepath, 'rb') as infile:
+            for block in iter(lambda: infile.read(blocksize), b''):
+                sha.update(block)
+        _digests[memo] = sha.hexdigest()
+    return _digests[memo]
+
+
+def code_version(analytic_id):
+    """digest of the source file that defines the analytic"""
+    cls = resolve_class(analytic_id)
+    return file_digest(inspect.getsourcefile(cls))
+
+
+def normalize_parameters(parameters):
+    """the (attrname, value) pairs that are actually set on the analytic, sorted by attrname"""
+    return sorted([each['attrname'], each['value']] for each in parameters)
+
+
+def result_key(analytic_id, parameters, inputs):
+    """content hash identifying a run, None when some input can not be read"""
+    try:
+        files = sorted((name, file_digest(os.path.join(spec['rootdir'], name)))
+                       for name, spec in inputs.items())
+        cls = resolve_class(analytic_id)
+        if not getattr(cls, 'cacheable', True):
+            return None
+        version = code_version(analytic_id)
+    except (OSError, IOError, KeyError, TypeError) as ex:
+        logging.info('not caching %s: %s', analytic_id, ex)
+        return None
+    description = json.dumps([analytic_id, version, normalize_parameters(parameters), files],
+                             sort_keys=True)
+    return hashlib.sha1(description.encode('utf-8')).hexdigest()
+
+
+def link_tree(src, dst):
+    """hard link every file under src into dst, copying when links are not possible"""
+    size = 0
+    for root, _, files in os.walk(src):
+        target = os.path.join(dst, os.path.relpath(root, src))
+        if not os.path.exists(target):
+            os.makedirs(target)
+        for filename in files:
+            source = os.path.join(root, filename)
+            dest = os.path.join(target, filename)
+            if os.path.exists(dest):
+                os.remove(dest)
+            try:
+                os.link(source, dest)
+            except OSError:
+                shutil.copy2(source, dest)
+            size += os.path.getsize(dest)
+    return size
+
+
+@contextmanager
+def entry_lock(key, mode=fcntl.LOCK_SH):
+    """hold the lock of cache entry key across processes, shared by fetches and exclusive for eviction"""
+    lockdir = os.path.join(RESULTS_CACHE_PATH, LOCKS_DIR)
+    if not os.path.isdir(lockdir):
+        try:
+            os.makedirs(lockdir)
+        except OSError:
+            # another worker created it first
+            pass
+    with open(os.path.join(lockdir, key[:2] + '.lock'), 'a') as lockfile:
+        fcntl.flock(lockfile, mode)
+        try:
+            yield
+        finally:
+            fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+
+def fetch(key, storepath):
+    """link a cached result into storepath and return its outputs, None on a miss"""
+    col = cache_collection()
+    entry = col.find_one_and_update({'key': key},
+                                    {'$set': {'last_used': datetime.now()}, '$inc': {'hits': 1}})
+    if entry is None:
+        return None
+    cachedir = os.path.join(RESULTS_CACHE_PATH, key)
+    with entry_lock(key):
+        # an eviction that got the lock first has removed the tree
+        if not os.path.isdir(cachedir):
+            col.delete_one({'key': key})
+            return None
+        link_tree(cachedir, storepath)
+    return entry['outputs']
+
+
+def store(key, storepath, outputs):
+    """keep the result tree at storepath in the cache under key"""
+    cachedir = os.path.join(RESULTS_CACHE_PATH, key)
+    if os.path.isdir(cachedir):
+        return
+    tmpdir = cachedir + '.%d.tmp' % os.getpid()
+    size = link_tree(storepath, tmpdir)
+    try:
+        os.rename(tmpdir, cachedir)
+    except OSError:
+        # another worker stored the same result first
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        return
+    now = datetime.now()
+    try:
+        cache_collection().insert_one({'key': key, 'outputs': outputs, 'size': size,
+                                       'created': now, 'last_used': now, 'hits': 0})
+    except pymongo.errors.DuplicateKeyError:
+        pass
+    evict()
+
+
+def evict(max_bytes=RESULTS_CACHE_MAX_BYTES, max_entries=RESULTS_CACHE_MAX_ENTRIES):
+    """remove least recently used cache entries until the cache fits its bounds"""
+    col = cache_collection()
+    entries = list(col.find({}, {'key': 1, 'size': 1}).sort('last_used', pymongo.ASCENDING))
+    total = sum(entry.get('size', 0) for entry in entries)
+    count = len(entries)
+    for entry in entries:
+        if total <= max_bytes and count <= max_entries:
+            break
+        col.delete_one({'_id': entry['_id']})
+        with entry_lock(entry['key'], fcntl.LOCK_EX):
+            shutil.rmtree(os.path.join(RESULTS_CACHE_PATH, entry['key']), ignore_errors=True)
+        total -= entry.get('size', 0)
+        count -= 1
@@ -0,0 +1,188 @@
+"""serving.py keeps published models warm for the classify endpoint.
+
+A model instance is built once per model id and parameter set and kept in an LRU of this
+process, bounded by MODEL_POOL_BYTES. Requests with the same parameters reuse the instance,
+so whatever state the model loaded or computed on construction survives between calls.
+The size of an instance is its own nbytes attribute when it has one, else its pickled size.
+Models whose classify works row by row can set batchable so concurrent requests share one
+vectorized classify call through their Batcher.
+"""
+import hashlib
+import json
+import logging
+import numbers
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from bedrock.CONSTANTS import MODEL_POOL_BYTES, MODEL_BATCH_WAIT, MODEL_BATCH_MAX_ROWS
+
+# unpicklable models are charged this much against the budget
+DEFAULT_MODEL_BYTES = 64 * 1024 ** 2
+
+_entries = OrderedDict()
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'bytes': 0}
+
+
+def parameters_key(parameters):
+    """digest of the (attrname, value) pairs a model is initialized with"""
+    pairs = sorted([each['attrname'], each['value']] for each in parameters or [])
+    return hashlib.sha1(json.dumps(pairs, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def model_bytes(model):
+    """approximate memory held by a model instance"""
+    size = getattr(model, 'nbytes', None)
+    if isinstance(size, numbers.Integral):
+        return size
+    try:
+        return len(pickle.dumps(model, pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return DEFAULT_MODEL_BYTES
+
+
+def get_entry(model_id, parameters, build, version=None, budget=MODEL_POOL_BYTES):
+    """
+    the pool entry holding the warm instance of model_id for parameters, its lock and batcher.
+    build() makes a new instance on a miss, a None instance is not kept and gives None. an entry
+    built for another version (e.g. a reloaded opal class or a new model artifact) is replaced
+    """
+    key = (model_id, parameters_key(parameters))
+    with _lock:
+        entry = _entries.pop(key, None)
+        if entry is not None and entry['version'] == version:
+            _entries[key] = entry
+            _stats['hits'] += 1
+            return entry
+        if entry is not None:
+            _stats['bytes'] -= entry['bytes']
+        _stats['misses'] += 1
+    model = build()
+    if model is None:
+        return None
+    size = model_bytes(model)
+    lock = threading.Lock()
+    with _lock:
+        if key in _entries:
+            # another request built it at the same time
+            return _entries[key]
+        entry = {'model': model, 'lock': lock, 'batcher': Batcher(model, lock),
+                 'bytes': size, 'version': version}
+        _entries[key] = entry
+        _stats['bytes'] += size
+        evict(budget)
+    logging.info('loaded model %s (%d bytes)', model_id, size)
+    return entry
+
+
+def get_model(model_id, parameters, build, version=None, budget=MODEL_POOL_BYTES):
+    """the warm instance of model_id for parameters and the lock to hold while using it, see get_entry"""
+    entry = get_entry(model_id, parameters, build, version, budget)
+    if entry is None:
+        return None, threading.Lock()
+    return entry['model'], entry['lock']
+
+
+class Batcher(object):
+    """
+    coalesces concurrent classify calls of one model instance. the first caller of a batch
+    waits up to wait seconds or until max_rows rows are queued, then classifies all of them
+    in one call and hands every caller its slice of the results. callers arriving while a
+    batch runs start the next one. the window adapts to the traffic: a caller only waits
+    while another batch is running or the last batch coalesced several calls, so a lone
+    request is not delayed
+    """
+    def __init__(self, model, lock, wait=MODEL_BATCH_WAIT, max_rows=MODEL_BATCH_MAX_ROWS):
+        self.model = model
+        self.lock = lock
+        self.wait = wait
+        self.max_rows = max_rows
+        self.pending = []
+        self.rows = 0
+        self.running = 0
+        self.coalesced = False
+        self.cond = threading.Condition()
+
+    def classify(self, inputs):
+        """classify the rows in inputs as part of a batch, returns one result per row"""
+        slot = {'done': threading.Event(), 'result': None, 'error': None}
+        with self.cond:
+            self.pending.append((inputs, slot))
+            self.rows += len(inputs)
+            leader = len(self.pending) == 1
+            if self.rows >= self.max_rows:
+                self.cond.notify_all()
+        if leader:
+            with self.cond:
+                busy = self.running > 0 or self.coalesced
+            deadline = time.time() + (self.wait if busy else 0)
+            with self.cond:
+                remaining = deadline - time.time()
+                while self.rows < self.max_rows and remaining > 0:
+                    self.cond.wait(remaining)
+                    remaining = deadline - time.time()
+                batch, self.pending, self.rows = self.pending, [], 0
+                self.coalesced = len(batch) > 1
+                self.running += 1
+            try:
+                self.run(batch)
+            finally:
+                with self.cond:
+                    self.running -= 1
+        slot['done'].wait()
+        if slot['error'] is not None:
+            raise slot['error']
+        return slot['result']
+
+    def run(self, batch):
+        """classify a batch in one call and split the results back to its callers"""
+        rows = [row for inputs, _ in batch for row in inputs]
+        try:
+            with self.lock:
+                results = list(self.model.classify(rows))
+            if len(results) != len(rows):
+                raise ValueError('classify returned %d results for %d rows' % (len(results), len(rows)))
+        except Exception as ex:
+            for _, slot in batch:
+                slot['error'] = ex
+                slot['done'].set()
+            return
+        start = 0
+        for inputs, slot in batch:
+            slot['result'] = results[start:start + len(inputs)]
+            start += len(inputs)
+            slot['done'].set()
+
+
+def evict(budget):
+    """drop least recently used models until the pool fits budget, call with _lock held"""
+    while _stats['bytes'] > budget and len(_entries) > 1:
+        _, entry = _entries.popitem(last=False)
+        _stats['bytes'] -= entry['bytes']
+        _stats['evictions'] += 1
+
+
+def evict_model(model_id):
+    """drop every instance of model_id, e.g. when it is unpublished. returns how many were dropped"""
+    with _lock:
+        keys = [key for key in _entries if key[0] == model_id]
+        for key in keys:
+            _stats['bytes'] -= _entries.pop(key)['bytes']
+    return len(keys)
+
+
+def clear():
+    """forget every model held by this process"""
+    with _lock:
+        _entries.clear()
+        _stats['bytes'] = 0
+
+
+def stats():
+    """hit, miss and eviction counters of this process' model pool"""
+    with _lock:
+        result = dict(_stats)
+        result['models'] = sorted(set(key[0] for key in _entries))
+        result['budget'] = MODEL_POOL_BYTES
+    return result
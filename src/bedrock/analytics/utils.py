@@ -1,16 +1,24 @@
 
 from __future__ import print_function
 
-import csv
 from datetime import datetime
 from importlib import import_module
+import itertools
+import json
 import os
+import time
 import uuid
-from bedrock.CONSTANTS import MONGO_HOST, MONGO_PORT, ANALYTICS_COL_NAME, ANALYTICS_DB_NAME, ANALYTICS_OPALS
-from bedrock.core.utils import get_class
+from bedrock.CONSTANTS import ANALYTICS_COL_NAME, ANALYTICS_DB_NAME, ANALYTICS_OPALS, \
+    RESULTS_COL_NAME, RESULTS_PATH, RESULTS_CACHE, MATRIX_BINARY, MATRIX_WRITE_BLOCK, MATRIX_SEGMENTS, \
+    MODEL_BATCHING, SWEEP_MAX_RUNS, SWEEP_MAX_PARALLEL, JOB_POLL_INTERVAL, JOB_WAIT_TIMEOUT, BATCHES_COL_NAME, BATCH_MAX_PARALLEL
+from bedrock.analytics import artifacts, cache, serving
+from bedrock.core.db import db_client, insert_result, result_items_collection
+from bedrock.core import jobs, matrixcache
+from bedrock.core.io import read_columnar, read_columns, write_columnar, remove_columnar
+from bedrock.core import csvload, segments, sparse
+from bedrock.core.utils import get_class, resolve_class
 import numpy as np
 import pandas as pd
-import pymongo
 import logging
 import traceback
 
@@ -39,21 +47,85 @@ def setUpDirectoryMatrix(src_id):
     return rootpath, dirName
 
 
-def loadMatrix(filepath):
+def loadMatrix(filepath, downcast=False):
     """
     use pandas to load the csv file into the dataframe,
-    using a header if appropriate
+    using a header if appropriate.
+    a numeric matrix.csv comes from the shared memory mapped matrix cache and
+    any other matrix.csv with an up to date binary copy or segments is loaded from that instead.
+    large csv files are parsed in parallel chunks, downcast shrinks their numeric columns.
+    a MatrixMarket .mtx file is returned as a csc sparse matrix, see loadSparseMatrix
     """
-    with open(filepath, 'rbU') as csvfile:
-        snippet = csvfile.read(2048)
-        sniffer = csv.Sniffer()
-        dialect = sniffer.sniff(snippet)
-    if sniffer.has_header(snippet):
-        df = pd.read_csv(filepath, dialect=dialect)
-    else:
-        df = pd.read_csv(filepath, dialect=dialect, header=None)
+    rootpath, filename = os.path.split(filepath)
+    if filename.endswith('.mtx'):
+        return loadSparseMatrix(filepath)
+    if filename == 'matrix.csv':
+        df = matrixcache.load_frame(rootpath)
+        if df is None:
+            df = read_columnar(rootpath)
+        if df is None:
+            df = segments.load_segments(rootpath)
+        if df is not None:
+            return df
+
+    return csvload.read_csv(filepath, downcast=downcast)
+
+
+def loadSparseMatrix(filepath, fmt='csc'):
+    """
+    load a MatrixMarket .mtx file as a csc or csr matrix. the file is converted to a binary
+    copy on first use and later loads memory map it instead of parsing the text again
+    """
+    return sparse.load_sparse(filepath, fmt)
+
+
+def loadMatrixSince(filepath, since=None):
+    """
+    the rows appended to a segmented matrix.csv after segment since, and the id of the
+    last segment read. pass that id as since on the next call to only see newer rows.
+    returns None when the matrix is not segmented
+    """
+    return segments.read_segments(os.path.dirname(filepath), since)
+
+
+def writeOutput(rootpath, filename, data):
+    """write data one entry per line to rootpath/filename.txt"""
+    with open(os.path.join(rootpath, filename + '.txt'), 'w') as output:
+        output.write(''.join(str(x) + '\n' for x in data))
+
+
+def appendOutput(rootpath, filename, data):
+    """append data one entry per line to rootpath/filename.txt"""
+    with open(os.path.join(rootpath, filename + '.txt'), 'a') as output:
+        output.write(''.join(str(x) + '\n' for x in data))
+
+
+def matrixColumns(maps, matrixFeatures, rootpath, writeLabels):
+    """
+    collect the matrix columns as numpy string arrays, in matrixFeatures order.
+    numeric features are taken as they are, label mapped features contribute their
+    encoded values (converted in one vectorized step) and have their mapping written
+    out with writeLabels as feature name + .txt
+    """
+    columns = []
+    for each in matrixFeatures:
+        if isinstance(maps[each], list):
+            columns.append(np.asarray(maps[each]).astype(str))
+        else:
+            if 'values' in maps[each]:    #the mongoids field has no values
+                columns.append(np.asarray(maps[each]['values']).astype(str))
+            writeLabels(rootpath, each, maps[each]['indexToLabel'])
+    return columns
 
-    return df
+
+def writeMatrix(columns, filepath, mode='w', blocksize=MATRIX_WRITE_BLOCK):
+    """
+    write the columns as rows of a headerless csv, streaming blocksize rows at a time.
+    matrix is documents x features (i.e. rows = individual items and columns = features)
+    """
+    frame = pd.DataFrame(dict(enumerate(columns)), columns=list(range(len(columns))))
+    with open(filepath, mode) as matrix:
+        frame.to_csv(matrix, header=False, index=False, chunksize=blocksize)
 
 
 def writeFiles(maps,
@@ -64,31 +136,18 @@ def writeFiles(maps,
     """
     write the output files associated with each loaded file
     matrix.csv, features.txt, features_original.txt, and any non-numeric fields' mappings
+    return_data returns the matrix as a 2d array of strings
     """
     #make directory
     if not os.path.exists(rootpath):
         os.makedirs(rootpath)
 
-    #write output files
-    toWrite = []
+    toWrite = matrixColumns(maps, matrixFeatures, rootpath, writeOutput)
+
     #list of features to write to the output features.txt file
     features = []
     featuresOrig = []
-
-    #determine if a feature is numeric or has a label mapping
     for i, each in enumerate(matrixFeatures):
-        # for each in maps.keys():
-        if isinstance(maps[each], list):
-            toWrite.append(maps[each])
-        #since the feature has a label mapping, write out the label values in order for later reference
-        #filename is the feature name + .txt
-        else:
-            try:
-                toWrite.append([str(x) for x in maps[each]['values']])
-            except KeyError:
-                pass    #ignore, since this is the mongoids field and has no values
-            #write the features to output
-            writeOutput(rootpath, each, maps[each]['indexToLabel'])
         if matrixFeaturesOriginal[i] != '_id':    #don't do this for mongoids
             features.append(each)
             featuresOrig.append(matrixFeaturesOriginal[i])
@@ -97,20 +156,14 @@ def writeFiles(maps,
     writeOutput(rootpath, 'features_original', featuresOrig)
     writeOutput(rootpath, 'features', features)
 
-    toReturn = []
-    #convert lists to numpy arrays
-    #matrix is documents x features (i.e. rows = individual items and columns = features)
-    with open(os.path.join(rootpath, 'matrix.csv'), 'w') as matrix:
-        for i in range(len(toWrite[0])):
-            temp = []
-            for each in toWrite:
-                temp.append(each[i])
-                if return_data:
-                    toReturn.append(temp)
-            matrix.write(','.join(temp) + '\n')
+    writeMatrix(toWrite, os.path.join(rootpath, 'matrix.csv'))
+
+    if MATRIX_BINARY:
+        write_columnar(rootpath, toWrite, features)
+    segments.remove_segments(rootpath)
 
     if return_data:
-        return toReturn
+        return np.column_stack(toWrite)
 
 
 def updateFiles(maps,
@@ -118,39 +171,32 @@ def updateFiles(maps,
                 matrixFeaturesOriginal,
                 rootpath,
                 return_data=False):
+    """
+    append new rows to matrix.csv and the label mappings of a matrix written by writeFiles
+    the rows are also appended as a new segment so readers can fetch only the new data
+    return_data returns the appended rows as a 2d array of strings
+    """
+    toWrite = matrixColumns(maps, matrixFeatures, rootpath, appendOutput)
 
-    #write output files
-    toWrite = []
+    if MATRIX_SEGMENTS and segments.read_manifest(rootpath) is None:
+        # the first update turns the matrix as written so far into segment 0
+        existing = read_columns(rootpath)
+        if existing is None:
+            frame = pd.read_csv(os.path.join(rootpath, 'matrix.csv'), header=None, dtype=str,
+                                keep_default_na=False)
+            existing = [frame[col].values for col in frame.columns]
+        segments.reset_segments(rootpath, existing, matrixFeatures)
 
-    #determine if a feature is numeric or has a label mapping
-    for i, each in enumerate(matrixFeatures):
-        # for each in maps.keys():
-        if isinstance(maps[each], list):
-            toWrite.append(maps[each])
-        #since the feature has a label mapping, write out the label values in order for later reference
-        #filename is the feature name + .txt
-        else:
-            try:
-                toWrite.append([str(x) for x in maps[each]['values']])
-            except KeyError:
-                pass    #ignore, since this is the mongoids field and has no values
-            #write the features to output
-            appendOutput(rootpath, each, maps[each]['indexToLabel'])
-
-    toReturn = []
-    #convert lists to numpy arrays
-    #matrix is documents x features (i.e. rows = individual items and columns = features)
-    with open(os.path.join(rootpath, 'matrix.csv'), 'a') as matrix:
-        for i in range(len(toWrite[0])):
-            temp = []
-            for each in toWrite:
-                temp.append(each[i])
-            matrix.write(','.join(temp) + '\n')
-            if return_data:
-                toReturn.append(temp)
+    writeMatrix(toWrite, os.path.join(rootpath, 'matrix.csv'), mode='a')
+
+    if MATRIX_SEGMENTS:
+        segments.append_segment(rootpath, toWrite)
+
+    # the binary copy no longer matches, loaders fall back to matrix.csv
+    remove_columnar(rootpath)
 
     if return_data:
-        return toReturn
+        return np.column_stack(toWrite)
 
 
 def initialize(alg, parameters):
@@ -172,33 +218,354 @@ def get_metadata(analytic_id):
     return metadata
 
 
-def run_analysis(queue, analytic_id, parameters, inputs, storepath, name):
+def analyze(analytic_id, parameters, inputs, storepath, name, progress=None):
+    """run the analytic and write its results to storepath, returns the list of outputs.
+    raises if the parameters do not check out or compute fails."""
     alg = get_class(analytic_id)
     initialize(alg, parameters)
-    if alg.check_parameters():
-        try:
-            alg.compute(inputs, storepath=storepath, name=name)
-        except:
-            tb = traceback.format_exc()
-            logging.error("Error running compute for analytics")
-            logging.error(tb)
-            queue.put(None)
-        alg.write_results(storepath)
-        print(analytic_id.split('.')[-1] + ' successful')
-        # return alg.get_outputs()
-        queue.put(alg.get_outputs())
-    else:
-        logging.error("Check Parameters failed")
+    alg.progress_callback = progress
+    if not alg.check_parameters():
+        raise ValueError('Check Parameters failed for %s' % analytic_id)
+    alg.compute(inputs, storepath=storepath, name=name)
+    alg.write_results(storepath)
+    alg.save_model(storepath)
+    print(analytic_id.split('.')[-1] + ' successful')
+    return alg.get_outputs()
+
+
+def run_analysis(queue, analytic_id, parameters, inputs, storepath, name):
+    try:
+        queue.put(analyze(analytic_id, parameters, inputs, storepath, name))
+    except:
+        tb = traceback.format_exc()
+        logging.error("Error running compute for analytics")
+        logging.error(tb)
         queue.put(None)
 
 
-def classify(analytic_id, parameters, inputs):
+def save_result(mat_id, src, res):
+    """store the metadata of a finished result in the results tree of matrix mat_id"""
+    client = db_client()
+    col = client[ANALYTICS_DB_NAME][RESULTS_COL_NAME]
+    col.update_one({'src_id': mat_id}, {'$setOnInsert': {
+        'rootdir': os.path.join(RESULTS_PATH, mat_id) + '/',
+        'src': src,
+        'src_id': mat_id
+    }}, upsert=True)
+    insert_result(col, mat_id, res)
+    return res
+
+
+def cached_analyze(analytic_id, parameters, inputs, storepath, name, progress=None, use_cache=True):
+    """analyze, but reuse the outputs of an identical earlier run when the result cache has them"""
+    key = None
+    if use_cache and RESULTS_CACHE:
+        key = cache.result_key(analytic_id, parameters, inputs)
+    if key is not None:
+        outputs = cache.fetch(key, storepath)
+        if outputs is not None:
+            logging.info('%s served from the result cache %s', analytic_id, key)
+            return outputs
+    outputs = analyze(analytic_id, parameters, inputs, storepath, name, progress=progress)
+    if key is not None:
+        cache.store(key, storepath, outputs)
+    return outputs
+
+
+def analysis_job(progress, analytic_id, parameters, inputs, storepath, name, res_id, mat_id, src,
+                 res_src=None, use_cache=True):
+    """job target for POST /analytics/<analytic_id>/, runs the analytic and stores the result"""
+    progress(0.0, 'compute')
+    outputs = cached_analyze(analytic_id, parameters, inputs, storepath, name,
+                             progress=progress, use_cache=use_cache)
+    progress(1.0, 'store')
+    res = {}
+    res['id'] = res_id
+    res['rootdir'] = storepath
+    res['name'] = name
+    res['src_id'] = mat_id
+    res['created'] = getCurrentTime()
+    res['analytic_id'] = analytic_id
+    res['parameters'] = parameters
+    res['outputs'] = outputs
+    if res_src is not None:
+        res['res_id'] = res_src
+    artifact = artifacts.artifact_path(storepath)
+    if os.path.isdir(artifact):
+        res['artifact'] = artifact
+    return save_result(mat_id, src, res)
+
+
+def find_artifact(analytic_id, res_id=None):
+    """the result of analytic_id holding the model artifact to publish: the result res_id, or the
+    newest result with an artifact. None when there is no such result"""
+    col = db_client()[ANALYTICS_DB_NAME][RESULTS_COL_NAME]
+    query = {'analytic_id': analytic_id, 'artifact': {'$exists': True}}
+    if res_id is not None:
+        query['id'] = res_id
+    return result_items_collection(col).find_one(query, {'_id': 0}, sort=[('_id', -1)])
+
+
+def sweep_parameters(parameters, grid=None, runs=None):
+    """
+    the parameter lists of a sweep over the base parameters. grid maps attrnames to lists of
+    values and expands to every combination, runs is a list of {attrname: value} dicts.
+    returns (overrides, parameters) pairs
+    """
+    if grid:
+        names = sorted(grid)
+        runs = [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+    sweep = []
+    for overrides in runs or []:
+        run = [dict(each) for each in parameters]
+        for each in run:
+            if each['attrname'] in overrides:
+                each['value'] = overrides[each['attrname']]
+        known = set(each['attrname'] for each in run)
+        run.extend({'attrname': name, 'value': value}
+                   for name, value in sorted(overrides.items()) if name not in known)
+        sweep.append((overrides, run))
+    return sweep
+
+
+def read_metric(storepath, metric):
+    """
+    a metric of a finished run, metric is 'output' or 'output:key'. a .json output is looked up
+    by key (a dotted path), any other output gives its first line. None when it is missing
+    """
+    output, _, key = metric.partition(':')
+    try:
+        with open(os.path.join(storepath, output)) as infile:
+            if output.endswith('.json'):
+                value = json.load(infile)
+                for part in key.split('.') if key else []:
+                    value = value[int(part)] if isinstance(value, list) else value[part]
+                return value
+            line = infile.readline().strip().strip('"')
+    except (OSError, IOError, ValueError, KeyError, IndexError, TypeError):
+        return None
+    try:
+        return float(line)
+    except ValueError:
+        return line
+
+
+def warm_inputs(inputs):
+    """build the binary copies of the input matrices once, so the runs of a sweep map them
+    instead of each parsing the csv"""
+    for filename, spec in inputs.items():
+        if filename == 'matrix.csv' and os.path.exists(os.path.join(spec['rootdir'], filename)):
+            matrixcache.load_dense(spec['rootdir'])
+
+
+def analysis_run(analytic_id, parameters, inputs, name, mat_id, src, res_src=None, use_cache=True):
+    """a new result directory and the analysis_job kwargs writing into it"""
+    res_id = getNewId()
+    storepath = os.path.join(RESULTS_PATH, mat_id, res_id) + '/'
+    os.makedirs(storepath)
+    return {
+        'analytic_id': analytic_id,
+        'parameters': parameters,
+        'inputs': inputs,
+        'storepath': storepath,
+        'name': name,
+        'res_id': res_id,
+        'mat_id': mat_id,
+        'src': src,
+        'res_src': res_src,
+        'use_cache': use_cache
+    }
+
+
+def run_analysis_jobs(progress, runs, max_parallel=None, finished=None, poll=JOB_POLL_INTERVAL,
+                      timeout=JOB_WAIT_TIMEOUT):
+    """
+    queue an analysis job for every run, a dict with the analysis_job kwargs under 'kwargs',
+    keeping at most max_parallel of them pending, and wait for all of them. sets job_id, status
+    and error on the runs and calls finished(run) as each one ends. jobs still pending after
+    timeout seconds are failed
+    """
+    waiting = list(runs)
+    running = []
+    deadline = time.time() + timeout
+    while waiting or running:
+        if time.time() > deadline:
+            for run in running:
+                jobs.fail_job(run['job_id'], 'gave up waiting after %d seconds' % timeout)
+            for run in waiting:
+                run['status'] = jobs.FAILED
+                run['error'] = 'not started within %d seconds' % timeout
+                if finished is not None:
+                    finished(run)
+            waiting = []
+        while waiting and (max_parallel is None or len(running) < max_parallel):
+            run = waiting.pop(0)
+            kwargs = run['kwargs']
+            job = jobs.submit_job('analytics', 'bedrock.analytics.utils.analysis_job', kwargs, meta={
+                'analytic_id': kwargs['analytic_id'], 'res_id': kwargs['res_id'], 'src_id': kwargs['mat_id']})
+            run['job_id'] = job['job_id']
+            run['status'] = jobs.QUEUED
+            running.append(run)
+        for run in list(running):
+            job = jobs.get_job(run['job_id'])
+            if job is not None and job['status'] in jobs.PENDING:
+                continue
+            running.remove(run)
+            run['status'] = job['status'] if job is not None else jobs.FAILED
+            if run['status'] != jobs.DONE:
+                run['error'] = job['error'] if job is not None else 'job %s disappeared' % run['job_id']
+            if finished is not None:
+                finished(run)
+        done = len(runs) - len(waiting) - len(running)
+        progress(float(done) / len(runs), '%d of %d runs' % (done, len(runs)))
+        if running:
+            time.sleep(poll)
+    return runs
+
+
+def sweep_job(progress, analytic_id, parameters, inputs, name, mat_id, src, grid=None, runs=None,
+              metrics=None, res_src=None, use_cache=True, max_parallel=SWEEP_MAX_PARALLEL,
+              poll=JOB_POLL_INTERVAL):
+    """
+    job target for POST /analytics/<analytic_id>/sweep/. runs one analysis job per parameter
+    set, at most max_parallel at a time, each stored as a normal result, and returns a summary
+    table with the selected metrics of every run
+    """
+    sweep = sweep_parameters(parameters, grid, runs)
+    if not sweep:
+        raise ValueError('the sweep of %s has no runs' % analytic_id)
+    if len(sweep) > SWEEP_MAX_RUNS:
+        raise ValueError('the sweep of %s has %d runs, at most %d are allowed' % (
+            analytic_id, len(sweep), SWEEP_MAX_RUNS))
+    progress(0.0, 'load')
+    warm_inputs(inputs)
+    table = []
+    for overrides, run in sweep:
+        label = ', '.join('%s=%s' % (key, value) for key, value in sorted(overrides.items()))
+        kwargs = analysis_run(analytic_id, run, inputs, '%s (%s)' % (name, label), mat_id, src,
+                              res_src, use_cache)
+        table.append({'parameters': overrides, 'res_id': kwargs['res_id'], 'kwargs': kwargs})
+
+    def summarize(row):
+        if row['status'] == jobs.DONE:
+            row['metrics'] = dict((metric, read_metric(row['kwargs']['storepath'], metric))
+                                  for metric in metrics or [])
+
+    run_analysis_jobs(progress, table, max_parallel, finished=summarize, poll=poll)
+    for row in table:
+        del row['kwargs']
+    return {'analytic_id': analytic_id, 'src_id': mat_id, 'metrics': metrics or [], 'runs': table}
+
+
+def batches_collection():
+    """the collection tracking batch runs of an analytic over many matrices"""
+    return db_client()[ANALYTICS_DB_NAME][BATCHES_COL_NAME]
+
+
+def get_batch(batch_id):
+    """the state of a batch without its mongo _id, None if there is no such batch"""
+    return batches_collection().find_one({'batch_id': batch_id}, {'_id': 0})
+
+
+def batch_job(progress, batch_id, analytic_id, parameters, matrices, filenames, name,
+              max_parallel=BATCH_MAX_PARALLEL, use_cache=True, poll=JOB_POLL_INTERVAL):
+    """
+    job target for POST /analytics/<analytic_id>/batch/. runs the analytic on every matrix as
+    its own analysis job, at most max_parallel at a time, each stored as a normal result of its
+    matrix. the state of every run and the aggregate counts are kept on the batch document
+    """
+    col = batches_collection()
+    col.update_one({'batch_id': batch_id}, {'$set': {'status': jobs.RUNNING, 'started': getCurrentTime()}})
+    table = []
+    for matrix in matrices:
+        inputs = dict((filename, matrix) for filename in filenames)
+        kwargs = analysis_run(analytic_id, parameters, inputs, '%s %s' % (name, matrix['name']),
+                              matrix['id'], matrix, use_cache=use_cache)
+        table.append({'src_id': matrix['src_id'], 'mat_id': matrix['id'], 'res_id': kwargs['res_id'],
+                      'kwargs': kwargs})
+    position = dict((row['res_id'], i) for i, row in enumerate(table))
+    counts = {jobs.DONE: 0, jobs.FAILED: 0}
+
+    def public(row):
+        return dict((key, value) for key, value in row.items() if key != 'kwargs')
+
+    col.update_one({'batch_id': batch_id}, {'$set': {'runs': [public(row) for row in table]}})
+
+    def record(row):
+        # only the entry of this run, the runs array of a large batch is too big to rewrite each time
+        status = jobs.DONE if row['status'] == jobs.DONE else jobs.FAILED
+        counts[status] += 1
+        col.update_one({'batch_id': batch_id}, {
+            '$set': {'runs.%d' % position[row['res_id']]: public(row),
+                     'progress': float(counts[jobs.DONE] + counts[jobs.FAILED]) / len(table)},
+            '$inc': {status: 1}})
+
+    try:
+        run_analysis_jobs(progress, table, max_parallel, finished=record, poll=poll)
+    except Exception:
+        col.update_one({'batch_id': batch_id}, {'$set': {
+            'status': jobs.FAILED, 'error': traceback.format_exc(), 'finished': getCurrentTime()}})
+        raise
+    status = jobs.DONE if not counts[jobs.FAILED] else jobs.FAILED
+    col.update_one({'batch_id': batch_id}, {'$set': {'status': status, 'finished': getCurrentTime()}})
+    # the runs stay on the batch document, GET /analytics/batches/<batch_id>/
+    return {'batch_id': batch_id, 'analytic_id': analytic_id, 'status': status, 'total': len(table),
+            'done': counts[jobs.DONE], 'failed': counts[jobs.FAILED]}
+
+
+def new_model(analytic_id, parameters, artifact=None):
+    """a model initialized with parameters and the fitted state in artifact, None when the
+    parameters are incomplete. an unreadable artifact is logged and skipped"""
     alg = get_class(analytic_id)
     initialize(alg, parameters)
-    if alg.check_parameters():
-        return list(alg.classify(inputs))
-    else:
+    if artifact:
+        try:
+            alg.load_model(artifact, analytic_id)
+        except artifacts.ArtifactError as ex:
+            logging.warning('not loading the artifact of %s: %s', analytic_id, ex)
+    return alg if alg.check_parameters() else None
+
+
+def model_parameters(analytic_id, parameters):
+    """the parameters a model is served with: the defaults of its parameters_spec with the
+    given values on top, so requests that leave out a default share the instance built for it"""
+    defaults = [{'attrname': each['attrname'], 'value': each['value']}
+                for each in resolve_class(analytic_id)().parameters_spec if 'attrname' in each]
+    overrides = dict((each['attrname'], each['value']) for each in parameters or [])
+    return sweep_parameters(defaults, runs=[overrides])[0][1]
+
+
+def classify(analytic_id, parameters, inputs, artifact=None, release=None):
+    """classify inputs with the warm instance of the model for these parameters and artifact.
+    release is the publish stamp of the model, a worker holding an instance built for another
+    release rebuilds it. concurrent requests to a batchable model are classified together in
+    micro-batches"""
+    parameters = model_parameters(analytic_id, parameters)
+    entry = serving.get_entry(analytic_id, parameters,
+                              lambda: new_model(analytic_id, parameters, artifact),
+                              version=(resolve_class(analytic_id), artifact, release))
+    if entry is None:
         return []
+    if MODEL_BATCHING and getattr(entry['model'], 'batchable', False) and isinstance(inputs, list):
+        return entry['batcher'].classify(inputs)
+    with entry['lock']:
+        return list(entry['model'].classify(inputs))
+
+
+def preload_model(analytic_id, artifact=None, release=None):
+    """load a model with its default parameters into the serving pool, e.g. when it is published.
+    classify requests that send no parameters or the defaults use this instance"""
+    parameters = model_parameters(analytic_id, [])
+    alg, _ = serving.get_model(analytic_id, parameters,
+                               lambda: new_model(analytic_id, parameters, artifact),
+                               version=(resolve_class(analytic_id), artifact, release))
+    return alg is not None
+
+
+def unload_model(analytic_id):
+    """drop the warm instances of a model from the serving pool of this process. the other
+    workers drop theirs on their next request for it, see classify"""
+    return serving.evict_model(analytic_id)
 
 
 #runs simple dense matrix test
@@ -235,15 +602,30 @@ def write_analytic(text, classname):
     metadata = get_metadata(analytic_id)
     metadata['analytic_id'] = analytic_id
 
-    client = pymongo.MongoClient(MONGO_HOST, MONGO_PORT)
+    client = db_client()
     col = client[ANALYTICS_DB_NAME][ANALYTICS_COL_NAME]
 
     col.insert(metadata)
 
 
 class Algorithm(object):
+    # set to False in analytics whose outputs are not determined by their inputs and parameters
+    cacheable = True
+    # set to True in models whose classify maps a list of rows to one result per row, so
+    # concurrent classify requests can be batched into one call
+    batchable = False
+    # attributes holding the fitted state of a Model, persisted as an artifact after compute
+    # and restored before classify. override model_state and restore_state for anything else
+    model_attributes = []
+
     def __init__(self):
         self.results = {}
+        self.progress_callback = None
+
+    def report_progress(self, fraction, stage=None):
+        """let a long running compute report how far along it is, fraction is in [0, 1]"""
+        if getattr(self, 'progress_callback', None) is not None:
+            self.progress_callback(fraction, stage)
 
     def check_parameters(self):
         #check to make sure inputs are set
@@ -259,6 +641,33 @@ class Algorithm(object):
         for key, res in self.results.items():
             self.write_output(storepath, key, res)
 
+    def model_state(self):
+        """the fitted state to persist as a dict of attribute values"""
+        return dict((name, getattr(self, name)) for name in self.model_attributes if hasattr(self, name))
+
+    def restore_state(self, state):
+        """set the fitted state read back from an artifact"""
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def save_model(self, storepath):
+        """write the fitted state as an artifact beside the outputs in storepath.
+        returns the artifact directory, None when there is no state to keep"""
+        state = self.model_state()
+        if not state:
+            return None
+        analytic_id = '%s.%s' % (type(self).__module__, type(self).__name__)
+        return artifacts.write_artifact(storepath, analytic_id, state)
+
+    def load_model(self, path, analytic_id=None):
+        """restore the fitted state from the artifact directory path, large arrays are memory mapped.
+        raises artifacts.ArtifactError when it is missing, incompatible or fitted by another analytic
+        than analytic_id"""
+        state, resident = artifacts.read_artifact(path, analytic_id)
+        self.restore_state(state)
+        # sizes the instance in the serving pool, mapped arrays live in the shared page cache
+        self.nbytes = resident
+
     def write_output(self, rootpath, key, outputData):
         filepath = rootpath + '/' + key
 
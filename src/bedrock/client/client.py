@@ -14,6 +14,7 @@ import logging
 import requests
 import pandas
 import os
+import time
 
 logging.basicConfig(
     format='%(levelname)s: %(asctime)s: %(message)s', level=logging.INFO)
@@ -43,6 +44,22 @@ class BedrockAPI(object):
         """make a post request using requests"""
         return requests.post(self.endpoint(category, path), *args, **kwargs)
 
+    def job(self, category, job_id):
+        """get the status of a job queued on the category api"""
+        return self.get(category, "jobs/%s" % job_id)
+
+    def wait_job(self, category, job_id, poll=0.5, timeout=None):
+        """poll a queued job until it is done or failed and return the response of its result endpoint.
+        raises RuntimeError if the job does not finish within timeout seconds."""
+        start = time.time()
+        while True:
+            resp = self.get(category, "jobs/%s/result" % job_id)
+            if resp.status_code != 202:
+                return resp
+            if timeout is not None and time.time() - start > timeout:
+                raise RuntimeError("job %s did not finish in %s seconds" % (job_id, timeout))
+            time.sleep(poll)
+
     def list(self, category, subcategory):
         """List the resourdes available in category/subcategory.
 
@@ -92,6 +109,8 @@ class BedrockAPI(object):
         # Post to the dataloader/sources/source_id endpoint
         url = self.endpoint("dataloader", "sources/%s" % (src_id))
         resp = requests.post(url, json=matbody)
+        if resp.status_code == 202:
+            resp = self.wait_job("dataloader", resp.json()['job_id'])
         return resp.json()
 
     def run_analytic(self, analytic_id, input_mtx, output_name, input_data={}, parameter_data=[]):
@@ -103,6 +122,8 @@ class BedrockAPI(object):
         }
 
         resp = self.post("analytics", "analytics/%s" % analytic_id, json=postData)
+        if resp.status_code == 202:
+            resp = self.wait_job("analytics", resp.json()['job_id'])
         output_mtx = resp.json()
         return output_mtx
 
@@ -1,9 +1,51 @@
 """
    workflow.py contains the classes necessary to construct workflows and send them to the api server
 """
+import hashlib
 import json
+import numbers
 import sys
 
+def is_bundle(value, bundles):
+    """True when value refers to a bundle rather than being a literal input"""
+    return isinstance(value, numbers.Integral) and not isinstance(value, bool) \
+        and 0 <= value < len(bundles)
+
+def digest(value):
+    """stable sha1 of a json serializable value"""
+    return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def fingerprints(workflow):
+    """fingerprint of every node of workflow keyed by head. A fingerprint covers the opalclass and
+    parameters of the node and the fingerprints of the bundles it reads, so it changes whenever the
+    node or anything upstream of it changes."""
+    nodes = dict((node['head'], node) for node in workflow['nodes'])
+    bundles = workflow.get('bundles') or []
+    producers = {}
+    for node in workflow['nodes']:
+        for name, bundle in node['outputs'].items():
+            producers[bundle] = (node['head'], name)
+    prints = {}
+    def visit(head, path):
+        if head in path:
+            raise ValueError('workflow has a cycle through %s' % head)
+        if head not in prints:
+            node = nodes[head]
+            inputs = {}
+            for name, value in node['inputs'].items():
+                if is_bundle(value, bundles) and value in producers:
+                    producer, output = producers[value]
+                    inputs[name] = [visit(producer, path | set([head])), output]
+                elif is_bundle(value, bundles):
+                    inputs[name] = digest(bundles[value])
+                else:
+                    inputs[name] = digest(value)
+            prints[head] = digest([node['meta']['opalclass'], node['meta'].get('parameters'), inputs])
+        return prints[head]
+    for head in nodes:
+        visit(head, set())
+    return prints
+
 class NodeMeta(dict):
     """NodeMeta stores the class, description and parameters of the opal that we are calling"""
     def __init__(self, opalclass, description, parameters):
@@ -72,6 +114,9 @@ class Workflow(dict):
                     repval = key
                 node['inputs'][key] = repval
         return self
+    def fingerprints(self):
+        """fingerprint of every node keyed by head, see fingerprints"""
+        return fingerprints(self)
     def execute(self):
         """run the workflow"""
         nodes = self['nodes']
@@ -121,11 +166,11 @@ class WorkflowAPI(object):
         hdr = {'content-type': 'application/json'}
         return requests.post(path, headers = hdr, data=json.dumps(wkf))
 
-    def put(self, wkf):
-        """put a new workflow up and return the new uid"""
-        path = self.api.server + "workflows" + "/" +"1"
+    def put(self, wkf, uid=None):
+        """replace the stored workflow uid (or wkf['_id']) with wkf, keeping the outputs of its last runs"""
+        path = self.api.server + "workflows" + "/" + (uid or wkf['_id'])
         hdr = {'content-type': 'application/json'}
-        return requests.put(path, headers = hdr, data=wkf)
+        return requests.put(path, headers = hdr, data=json.dumps(wkf))
     def delete(self, uid):
         """Delete a workflow by id"""
         if uid == 'all':
@@ -137,6 +182,15 @@ class WorkflowAPI(object):
 
         path = self.api.server + "workflows" + "/" + uid
         return requests.delete(path)
+    def run(self, uid, force=False):
+        """start a run of a stored workflow on the server, the response holds the run_id.
+        nodes whose fingerprint did not change since their last run are reused unless force is set"""
+        path = self.api.server + "workflows" + "/" + uid + "/run"
+        return requests.post(path, params={'force': 'true'} if force else None)
+    def run_status(self, uid, run_id):
+        """get the state of every node of a workflow run"""
+        path = self.api.server + "workflows" + "/" + uid + "/runs/" + run_id
+        return requests.get(path)
 
 if __name__ == "__main__":
     from bedrock.client.client import BedrockAPI
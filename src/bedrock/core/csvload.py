@@ -0,0 +1,140 @@
+"""csvload.py parses large csv files with several threads.
+
+The dialect and header of a file are sniffed once per process and remembered by path, size
+and mtime. Files above CSV_PARALLEL_BYTES are split on line boundaries into byte ranges of
+about CSV_CHUNK_BYTES that are parsed side by side. The tokenizer and number conversion of
+the pandas C parser release the GIL, so threads keep the cores busy without forking, which
+the daemonic job workers that load matrices are not allowed to do.
+"""
+import csv
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+import pandas as pd
+from bedrock.CONSTANTS import CSV_PARALLEL_BYTES, CSV_CHUNK_BYTES, CSV_WORKERS
+
+SNIFF_BYTES = 2048
+
+# (dialect, header) keyed by (path, size, mtime)
+_dialects = {}
+_dialects_lock = threading.Lock()
+
+
+def sniff(filepath):
+    """the csv dialect of filepath and its column names, None when it has no header row"""
+    stat = os.stat(filepath)
+    memo = (os.path.realpath(filepath), stat.st_size, stat.st_mtime)
+    with _dialects_lock:
+        if memo in _dialects:
+            return _dialects[memo]
+    with open(filepath, 'rb') as csvfile:
+        snippet = csvfile.read(SNIFF_BYTES)
+        csvfile.seek(0)
+        first = csvfile.readline()
+    if not isinstance(snippet, str):
+        snippet = snippet.decode('utf-8', 'replace')
+        first = first.decode('utf-8', 'replace')
+    sniffer = csv.Sniffer()
+    dialect = sniffer.sniff(snippet)
+    header = None
+    if sniffer.has_header(snippet):
+        header = next(csv.reader([first.rstrip('\r\n')], dialect))
+    with _dialects_lock:
+        _dialects[memo] = (dialect, header)
+    return dialect, header
+
+
+def line_ranges(filepath, start, chunk_bytes):
+    """split filepath from byte start into ranges of about chunk_bytes ending on line boundaries"""
+    size = os.path.getsize(filepath)
+    ranges = []
+    with open(filepath, 'rb') as csvfile:
+        begin = start
+        while begin < size:
+            end = begin + chunk_bytes
+            if end >= size:
+                end = size
+            else:
+                csvfile.seek(end)
+                csvfile.readline()
+                end = csvfile.tell()
+            ranges.append((begin, end))
+            begin = end
+    return ranges
+
+
+def read_range(filepath, begin, end, dialect, names):
+    """parse the lines of filepath between byte offsets begin and end"""
+    with open(filepath, 'rb') as csvfile:
+        csvfile.seek(begin)
+        data = csvfile.read(end - begin)
+    if not data.strip():
+        return None
+    return pd.read_csv(io.BytesIO(data), dialect=dialect, header=None, names=names)
+
+
+def splittable(filepath, dialect, sample=1 << 16):
+    """ranges split on newlines are only safe when fields are not quoted, they may hold newlines"""
+    with open(filepath, 'rb') as csvfile:
+        head = csvfile.read(sample)
+    quotechar = dialect.quotechar or '"'
+    return quotechar.encode('ascii') not in head
+
+
+def align_chunks(chunks):
+    """keep a column as text in every chunk when some chunk could not parse it as numbers"""
+    for col in chunks[0].columns:
+        kinds = set(chunk[col].dtype.kind for chunk in chunks)
+        if 'O' in kinds and len(kinds) > 1:
+            for chunk in chunks:
+                if chunk[col].dtype.kind != 'O':
+                    values = chunk[col]
+                    chunk[col] = values.astype(str).where(values.notnull())
+    return chunks
+
+
+def downcast_frame(df):
+    """shrink integer and float columns to the smallest dtype that holds their values"""
+    for col in df.columns:
+        kind = df[col].dtype.kind
+        if kind in 'iu':
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+        elif kind == 'f':
+            df[col] = pd.to_numeric(df[col], downcast='float')
+    return df
+
+
+def read_csv(filepath, downcast=False, workers=CSV_WORKERS, chunk_bytes=CSV_CHUNK_BYTES,
+             parallel_bytes=CSV_PARALLEL_BYTES):
+    """
+    read filepath into a DataFrame, with its header row as column names when it has one.
+    large files are parsed in chunks by workers threads (every core when workers is 0),
+    downcast shrinks the numeric columns
+    """
+    dialect, header = sniff(filepath)
+    size = os.path.getsize(filepath)
+    workers = workers or multiprocessing.cpu_count()
+    duplicates = header is not None and len(set(header)) != len(header)
+    if size < parallel_bytes or workers < 2 or duplicates or not splittable(filepath, dialect):
+        df = pd.read_csv(filepath, dialect=dialect, header=0 if header is not None else None)
+        return downcast_frame(df) if downcast else df
+    start = 0
+    if header is not None:
+        with open(filepath, 'rb') as csvfile:
+            csvfile.readline()
+            start = csvfile.tell()
+    ranges = line_ranges(filepath, start, chunk_bytes)
+    pool = ThreadPool(min(workers, len(ranges)))
+    try:
+        chunks = pool.map(lambda span: read_range(filepath, span[0], span[1], dialect, header), ranges)
+    finally:
+        pool.close()
+    chunks = [chunk for chunk in chunks if chunk is not None]
+    logging.info('parsed %s in %d chunks', filepath, len(chunks))
+    if not chunks:
+        return pd.DataFrame(columns=header)
+    df = pd.concat(align_chunks(chunks), ignore_index=True)
+    return downcast_frame(df) if downcast else df
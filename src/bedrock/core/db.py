@@ -1,12 +1,56 @@
 """db.py is a layer for interacting with the database across all of the bedrock apis."""
+import logging
+import os
+import threading
+import time
 import pymongo
+import pymongo.errors
 from bson import ObjectId
-from bedrock.CONSTANTS import MONGO_HOST, MONGO_PORT, DATALOADER_DB_NAME
+from bedrock.CONSTANTS import MONGO_HOST, MONGO_PORT, MONGO_POOL_SIZE, DATALOADER_DB_NAME, \
+  MATRICES_COL_NAME, RESULT_ITEMS_COL_NAME, COUNTER_FLUSH_COUNT, COUNTER_FLUSH_INTERVAL
 
-def db_client(host=MONGO_HOST, port=MONGO_PORT):
-    client = pymongo.MongoClient(MONGO_HOST, MONGO_PORT)
+# process-wide registry of pooled clients keyed by (host, port)
+_clients = {}
+_clients_pid = None
+_clients_lock = threading.Lock()
+# databases whose matrices collection has been indexed and migrated by this process
+_matrices_ready = set()
+# same for the per-result documents of the analytics results trees
+_results_ready = set()
+
+def db_client(host=MONGO_HOST, port=MONGO_PORT, pool_size=MONGO_POOL_SIZE):
+    """returns the pooled MongoClient for host:port shared by every api in this process.
+
+    Clients are created lazily on first use. MongoClient is not fork safe, so the
+    registry is discarded whenever the pid changes (e.g. mod_wsgi daemon processes
+    or multiprocessing workers forked from a parent that already connected).
+    """
+    global _clients_pid
+    key = (host, port)
+    pid = os.getpid()
+    client = _clients.get(key) if _clients_pid == pid else None
+    if client is not None:
+        return client
+    with _clients_lock:
+        if _clients_pid != pid:
+            _clients.clear()
+            _clients_pid = pid
+        client = _clients.get(key)
+        if client is None:
+            client = pymongo.MongoClient(host, port, maxPoolSize=pool_size, connect=False)
+            _clients[key] = client
     return client
 
+def reset_clients():
+    """close and forget every pooled client in this process"""
+    global _clients_pid
+    with _clients_lock:
+        if _clients_pid == os.getpid():
+            for client in _clients.values():
+                client.close()
+        _clients.clear()
+        _clients_pid = None
+
 def db_collection(client, db, collection_name):
     collection = client[db][collection_name]
     return collection
@@ -18,6 +62,91 @@ def get_db_config(client, config_db="bedrock_config", config_collection="config"
     except:
         return {}
 
+def get_opals_version(client, config_db="bedrock_config", config_collection="versions"):
+    """the opal registry version, bumped whenever an opal is added, removed or reloaded"""
+    doc = client[config_db][config_collection].find_one({'_id': 'opals'})
+    return doc['version'] if doc else 0
+
+def bump_opals_version(client, config_db="bedrock_config", config_collection="versions"):
+    """atomically increment the opal registry version and return the new value"""
+    doc = client[config_db][config_collection].find_one_and_update(
+        {'_id': 'opals'}, {'$inc': {'version': 1}}, upsert=True,
+        return_document=pymongo.ReturnDocument.AFTER)
+    return doc['version']
+
+def increment_field(col, query, field, amount=1):
+    """atomically add amount to field of the document matching query in one round trip.
+    returns the new value, None when no document matches"""
+    doc = col.find_one_and_update(query, {'$inc': {field: amount}}, projection={field: 1, '_id': 0},
+                                  return_document=pymongo.ReturnDocument.AFTER)
+    return doc[field] if doc else None
+
+def toggle_field(col, query, field, retries=10):
+    """atomically flip a boolean field of the document matching query.
+    the write only applies if the field still has the value that was read, so concurrent
+    toggles never get lost. returns the new value, None when no document matches"""
+    for _ in range(retries):
+        doc = col.find_one(query, {field: 1, '_id': 0})
+        if doc is None:
+            return None
+        current = doc.get(field, False)
+        guarded = dict(query)
+        guarded[field] = current
+        if col.update_one(guarded, {'$set': {field: not current}}).matched_count:
+            return not current
+    raise pymongo.errors.OperationFailure('could not toggle %s after %d attempts' % (field, retries))
+
+class BufferedCounter(object):
+    """coalesces many increments of one field into periodic $inc writes.
+
+    add() only touches memory. The pending amount is written when it reaches flush_count,
+    when flush_interval seconds have passed since the last write, or when flush() is called.
+    A timer armed by the first unwritten add() does the timed write, so counts left behind by
+    a stream that went idle still land within flush_interval.
+    """
+    def __init__(self, col, query, field, flush_count=COUNTER_FLUSH_COUNT,
+                 flush_interval=COUNTER_FLUSH_INTERVAL):
+        self.col = col
+        self.query = query
+        self.field = field
+        self.flush_count = flush_count
+        self.flush_interval = flush_interval
+        self.pending = 0
+        self.value = None
+        self.flushed_at = time.time()
+        self.timer = None
+        self.lock = threading.Lock()
+
+    def add(self, amount=1):
+        """count amount, returns the estimated total including what is not written yet"""
+        with self.lock:
+            self.pending += amount
+            wait = self.flushed_at + self.flush_interval - time.time()
+            if self.pending >= self.flush_count or wait <= 0:
+                self._flush()
+            elif self.timer is None:
+                self.timer = threading.Timer(wait, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+            return (self.value or 0) + self.pending
+
+    def flush(self):
+        """write the pending amount now, returns the stored total"""
+        with self.lock:
+            self._flush()
+            return self.value
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.pending:
+            value = increment_field(self.col, self.query, self.field, self.pending)
+            if value is not None:
+                self.value = value
+            self.pending = 0
+        self.flushed_at = time.time()
+
 def drop_id_key(record):
     """returns a copy of record without the key _id """
     return {key: value for key, value in record.items() if key != '_id'}
@@ -31,22 +160,182 @@ def serialize_id_key(record):
             return value
     return {key: filt(value) for key, value in record.items()}
 
-def find_source(col, src_id):
-    """find a source from pymongo collection"""
-    source = col.find_one({'src_id':src_id},{"_id":0})
+def find_source(col, src_id, matrices=False):
+    """find a source from pymongo collection, optionally joined with its matrices"""
+    source = col.find_one({'src_id':src_id},{"_id":0, "matrices":0})
     if not source:
-        source = col.find_one({'name':src_id},{"_id":0})
+        source = col.find_one({'name':src_id},{"_id":0, "matrices":0})
         if not source:
             return None
+    if matrices:
+        source['matrices'] = list_matrices(col, source['src_id'])
     return source
 
+def matrices_collection(col):
+    """return the matrices collection that sits beside the sources collection col.
+
+    The first call in each process makes sure the (src_id, id) and (src_id, name)
+    indexes exist and moves any matrices still embedded in source documents.
+    """
+    database = col.database
+    mat_col = database[MATRICES_COL_NAME]
+    if database.name not in _matrices_ready:
+        mat_col.create_index([('src_id', pymongo.ASCENDING), ('id', pymongo.ASCENDING)], unique=True)
+        mat_col.create_index([('src_id', pymongo.ASCENDING), ('name', pymongo.ASCENDING)], unique=True)
+        migrate_matrices(col, mat_col)
+        _matrices_ready.add(database.name)
+    return mat_col
+
+def migrate_matrices(col, mat_col):
+    """one-time move of the embedded source['matrices'] arrays into mat_col.
+    Safe to rerun, matrices that already exist are left alone. Matrices that share a name
+    within their source get the same _<n> suffix as new ones do, and the embedded array is
+    only dropped once all of its matrices are stored."""
+    for src in col.find({'matrices.0': {'$exists': True}}, {'src_id':1, 'matrices':1}):
+        taken = set(each['name'] for each in mat_col.find({'src_id': src['src_id']}, {'name':1}))
+        moved = True
+        for matrix in src['matrices']:
+            matrix['src_id'] = src['src_id']
+            if mat_col.find_one({'src_id': src['src_id'], 'id': matrix.get('id')}, {'_id':1}):
+                continue
+            name = matrix.get('name')
+            n = 2
+            while matrix.get('name') in taken:
+                matrix['name'] = '%s_%d' % (name, n)
+                n += 1
+            if matrix.get('name') != name:
+                logging.warning('matrix %s of source %s renamed from %s to %s', matrix.get('id'),
+                                src['src_id'], name, matrix['name'])
+            try:
+                mat_col.insert_one(matrix)
+                taken.add(matrix.get('name'))
+            except pymongo.errors.DuplicateKeyError:
+                logging.warning('could not migrate matrix %s of source %s', matrix.get('id'), src['src_id'])
+                moved = False
+        if moved:
+            col.update_one({'_id': src['_id']}, {'$unset': {'matrices': ''}})
+
+def list_matrices(col, src_id):
+    """list the matrices of a source in creation order"""
+    mat_col = matrices_collection(col)
+    return list(mat_col.find({'src_id':src_id}, {"_id":0}).sort('_id', pymongo.ASCENDING))
+
+def attach_matrices(col, sources):
+    """join the matrices onto a list of sources with a single query"""
+    by_src = {}
+    for src in sources:
+        src['matrices'] = by_src.setdefault(src['src_id'], [])
+    if by_src:
+        mat_col = matrices_collection(col)
+        cur = mat_col.find({'src_id': {'$in': list(by_src.keys())}}, {"_id":0})
+        for matrix in cur.sort('_id', pymongo.ASCENDING):
+            by_src[matrix['src_id']].append(matrix)
+    return sources
+
 def find_matrix(col, src_id, mat_id):
-    """finds a matrix of source in the collection col"""
-    # matrix = col.find({'src_id':src_id, 'matrices.id':mtxid })
-    matrices = find_source(col, src_id)['matrices']
-    matrix_manual = None
+    """finds a matrix of source src_id (uuid or name) by its id or name, None if missing"""
+    mat_col = matrices_collection(col)
+    matrix = mat_col.find_one({'src_id':src_id, 'id':mat_id}, {"_id":0})
+    if not matrix:
+        matrix = mat_col.find_one({'src_id':src_id, 'name':mat_id}, {"_id":0})
+    if not matrix:
+        source = col.find_one({'name':src_id}, {"src_id":1})
+        if source and source['src_id'] != src_id:
+            return find_matrix(col, source['src_id'], mat_id)
+    return matrix
+
+def insert_matrices(col, src_id, matrices):
+    """store newly generated matrices for the source src_id"""
+    if not matrices:
+        return
+    mat_col = matrices_collection(col)
+    docs = []
     for matrix in matrices:
-        if matrix['id'] == mat_id or matrix['name'] == mat_id:
-            matrix_manual = matrix
-    # assert matrix == matrix_manual
-    return matrix_manual
+        doc = dict(matrix)
+        doc['src_id'] = src_id
+        docs.append(doc)
+    mat_col.insert_many(docs)
+
+def delete_matrix(col, src_id, mat_id):
+    """remove a single matrix, returns the removed matrix or None if there was none"""
+    matrix = find_matrix(col, src_id, mat_id)
+    if matrix:
+        matrices_collection(col).delete_one({'src_id':matrix['src_id'], 'id':matrix['id']})
+    return matrix
+
+def delete_matrices(col, src_id):
+    """remove every matrix of the source src_id"""
+    matrices_collection(col).delete_many({'src_id':src_id})
+
+def result_items_collection(col):
+    """return the collection holding one document per result, beside the results trees col.
+
+    The first call in each process makes sure the (src_id, id), (src_id, name) and
+    analytic_id indexes exist and moves any results still embedded in the trees.
+    """
+    database = col.database
+    res_col = database[RESULT_ITEMS_COL_NAME]
+    if database.name not in _results_ready:
+        col.create_index('src_id')
+        res_col.create_index([('src_id', pymongo.ASCENDING), ('id', pymongo.ASCENDING)], unique=True)
+        res_col.create_index([('src_id', pymongo.ASCENDING), ('name', pymongo.ASCENDING)])
+        res_col.create_index('analytic_id')
+        migrate_results(col, res_col)
+        _results_ready.add(database.name)
+    return res_col
+
+def migrate_results(col, res_col):
+    """one-time move of the embedded tree['results'] arrays into res_col.
+    Safe to rerun, results that already exist are left alone."""
+    for tree in col.find({'results.0': {'$exists': True}}, {'src_id':1, 'results':1}):
+        for result in tree['results']:
+            result['src_id'] = tree['src_id']
+            try:
+                res_col.insert_one(result)
+            except pymongo.errors.DuplicateKeyError:
+                logging.warning('result %s of %s already migrated', result.get('id'), tree['src_id'])
+        col.update_one({'_id': tree['_id']}, {'$unset': {'results': ''}})
+
+def list_results(col, src_id):
+    """list the results generated from the matrix src_id in creation order"""
+    res_col = result_items_collection(col)
+    return list(res_col.find({'src_id':src_id}, {"_id":0}).sort('_id', pymongo.ASCENDING))
+
+def attach_results(col, trees):
+    """join the results onto a list of results trees with a single query"""
+    by_src = {}
+    for tree in trees:
+        tree['results'] = by_src.setdefault(tree['src_id'], [])
+    if by_src:
+        res_col = result_items_collection(col)
+        cur = res_col.find({'src_id': {'$in': list(by_src.keys())}}, {"_id":0})
+        for result in cur.sort('_id', pymongo.ASCENDING):
+            by_src[result['src_id']].append(result)
+    return trees
+
+def find_result(col, src_id, res_id):
+    """finds a result of the matrix src_id by its id or name, None if missing"""
+    res_col = result_items_collection(col)
+    result = res_col.find_one({'src_id':src_id, 'id':res_id}, {"_id":0})
+    if not result:
+        result = res_col.find_one({'src_id':src_id, 'name':res_id}, {"_id":0},
+                                  sort=[('_id', pymongo.DESCENDING)])
+    return result
+
+def insert_result(col, src_id, result):
+    """atomically add a result to the tree of matrix src_id"""
+    doc = dict(result)
+    doc['src_id'] = src_id
+    result_items_collection(col).insert_one(doc)
+
+def delete_result(col, src_id, res_id):
+    """remove a single result, returns the removed result or None if there was none"""
+    result = find_result(col, src_id, res_id)
+    if result:
+        result_items_collection(col).delete_one({'src_id':src_id, 'id':result['id']})
+    return result
+
+def delete_results(col, src_id):
+    """remove the results tree of matrix src_id and every result in it"""
+    col.remove({'src_id':src_id})
+    result_items_collection(col).delete_many({'src_id':src_id})
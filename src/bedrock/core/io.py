@@ -3,6 +3,9 @@ This will allow bedrock to support data stored in HDFS, on remote clusters, and
 """
 import os
 import json
+import shutil
+import numpy as np
+import pandas as pd
 from bedrock.CONSTANTS import *
 import werkzeug
 
@@ -28,3 +31,92 @@ def write_source_config(dataloader_path, src_id, conn_info):
     with open(filepath, 'w') as outfile:
         json.dump(conn_info, outfile)
     return diroriginal, filepath
+
+
+# binary columnar matrices: rootpath/matrix.bin/ holds header.json and one .npy file per column
+COLUMNAR_DIR = 'matrix.bin'
+COLUMNAR_VERSION = 1
+
+
+def columnar_path(rootpath):
+    """directory of the binary copy of rootpath/matrix.csv"""
+    return os.path.join(rootpath, COLUMNAR_DIR)
+
+
+def column_array(values):
+    """type a column of strings as int64 or float64 when every value is numeric, otherwise as text"""
+    series = pd.Series(values)
+    try:
+        return pd.to_numeric(series.replace('', np.nan), errors='raise').values
+    except (ValueError, TypeError):
+        return np.asarray(series.astype(str).values).astype(str)
+
+
+def write_columnar(rootpath, columns, features=None):
+    """write a list of equal length columns as typed .npy arrays plus a header.
+    The directory is swapped in whole so readers never see a half written matrix."""
+    arrays = [column_array(col) for col in columns]
+    rows = len(arrays[0]) if arrays else 0
+    target = columnar_path(rootpath)
+    tmp = target + '.%d.tmp' % os.getpid()
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp, DIRMASK)
+    for i, arr in enumerate(arrays):
+        np.save(os.path.join(tmp, 'col_%05d.npy' % i), arr)
+    header = {
+        'version': COLUMNAR_VERSION,
+        'shape': [rows, len(arrays)],
+        'dtypes': [arr.dtype.str for arr in arrays],
+        'features': list(features) if features is not None and len(features) == len(arrays) else None,
+    }
+    with open(os.path.join(tmp, 'header.json'), 'w') as outfile:
+        json.dump(header, outfile)
+    remove_columnar(rootpath)
+    os.rename(tmp, target)
+
+
+def remove_columnar(rootpath):
+    """drop the binary copy of a matrix, e.g. after matrix.csv changed"""
+    target = columnar_path(rootpath)
+    if os.path.exists(target):
+        shutil.rmtree(target)
+
+
+def read_columnar_header(rootpath):
+    """the header of the binary copy of rootpath/matrix.csv, None if there is no up to date copy"""
+    header_path = os.path.join(columnar_path(rootpath), 'header.json')
+    csv_path = os.path.join(rootpath, 'matrix.csv')
+    try:
+        if os.path.exists(csv_path) and os.path.getmtime(header_path) < os.path.getmtime(csv_path):
+            return None
+        with open(header_path) as infile:
+            header = json.load(infile)
+    except (OSError, IOError, ValueError):
+        return None
+    if header.get('version') != COLUMNAR_VERSION:
+        return None
+    return header
+
+
+def read_columns(rootpath, mmap_mode='c'):
+    """the memory mapped column arrays of a binary matrix, None if there is no up to date copy.
+    they are copy on write by default, writes stay private to the caller"""
+    header = read_columnar_header(rootpath)
+    if header is None:
+        return None
+    target = columnar_path(rootpath)
+    return [np.load(os.path.join(target, 'col_%05d.npy' % i), mmap_mode=mmap_mode)
+            for i in range(header['shape'][1])]
+
+
+def read_columnar(rootpath, names=None):
+    """load the binary matrix at rootpath as a DataFrame with integer column labels,
+    or names when given. returns None if there is no up to date copy."""
+    columns = read_columns(rootpath)
+    if columns is None:
+        return None
+    frame = pd.DataFrame(dict(enumerate(columns)), columns=list(range(len(columns))))
+    if names is not None:
+        frame.columns = names
+    return frame
@@ -0,0 +1,275 @@
+"""jobs.py is a small job queue stored in MongoDB so the bedrock apis can run long tasks
+outside of the web request.
+
+A job names a target function by its fully qualified name and the keyword arguments to
+call it with. Worker processes claim queued jobs atomically, call
+target(progress, **kwargs) and store the return value or the traceback on the job.
+The arguments and the return value are kept as extended JSON text, they often hold
+filenames as keys which MongoDB does not accept in documents.
+
+A running job carries the worker that claimed it and a heartbeat the worker refreshes every
+JOB_HEARTBEAT_INTERVAL seconds. Workers die with the web process that started them, so jobs
+whose heartbeat is older than JOB_LEASE are reaped: queued again while they have attempts
+left, failed otherwise.
+"""
+import importlib
+import logging
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime
+import pymongo
+import pymongo.errors
+from bson import json_util
+from bedrock.CONSTANTS import JOBS_DB_NAME, JOBS_COL_NAME, JOB_POLL_INTERVAL, JOB_HEARTBEAT_INTERVAL, \
+    JOB_LEASE, JOB_REAP_INTERVAL, JOB_MAX_ATTEMPTS
+from bedrock.core.db import db_client
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+PENDING = [QUEUED, RUNNING]
+
+# fields of a job that are safe to hand back to clients
+PUBLIC_FIELDS = ['job_id', 'queue', 'status', 'progress', 'stage', 'meta',
+                 'created', 'started', 'finished', 'attempts']
+
+_indexed = set()
+# worker processes started by this process keyed by (pid, queue)
+_workers = {}
+
+
+class QueueFull(Exception):
+    """raised by submit_job when a queue already holds its maximum number of pending jobs"""
+    pass
+
+
+def jobs_collection(client=None):
+    """return the jobs collection, creating its indexes once per process"""
+    client = client or db_client()
+    col = client[JOBS_DB_NAME][JOBS_COL_NAME]
+    if JOBS_COL_NAME not in _indexed:
+        col.create_index('job_id', unique=True)
+        col.create_index([('queue', pymongo.ASCENDING), ('status', pymongo.ASCENDING)])
+        col.create_index([('status', pymongo.ASCENDING), ('heartbeat', pymongo.ASCENDING)])
+        _indexed.add(JOBS_COL_NAME)
+    return col
+
+
+def submit_job(queue, target, kwargs, max_depth=None, meta=None, attempts=JOB_MAX_ATTEMPTS):
+    """queue a call of target(progress, **kwargs) and return the new job.
+    raises QueueFull when max_depth jobs of queue are already pending. a job whose worker
+    dies is queued again until it was claimed attempts times, coordinators that submit
+    jobs of their own should only get one"""
+    col = jobs_collection()
+    if max_depth is not None:
+        reap_jobs()
+        pending = col.count_documents({'queue': queue, 'status': {'$in': PENDING}})
+        if pending >= max_depth:
+            raise QueueFull('%d jobs already pending in queue %s' % (pending, queue))
+    job = {
+        'job_id': uuid.uuid4().hex,
+        'queue': queue,
+        'target': target,
+        'kwargs': json_util.dumps(kwargs),
+        'meta': meta or {},
+        'status': QUEUED,
+        'progress': 0.0,
+        'stage': None,
+        'result': None,
+        'error': None,
+        'attempts': 0,
+        'max_attempts': attempts,
+        'created': str(datetime.now()),
+        'started': None,
+        'finished': None,
+    }
+    col.insert_one(dict(job))
+    job['kwargs'] = kwargs
+    return job
+
+
+def get_job(job_id, queues=None):
+    """find a job by id, None if there is no such job or it is not in one of queues when given"""
+    query = {'job_id': job_id}
+    if queues is not None:
+        query['queue'] = {'$in': list(queues)}
+    return decode_job(jobs_collection().find_one(query, {"_id": 0}))
+
+
+def decode_job(job):
+    """turn the stored arguments and result of a job back into python values"""
+    if job is not None:
+        for key in ['kwargs', 'result']:
+            if job.get(key) is not None:
+                job[key] = json_util.loads(job[key])
+    return job
+
+
+def list_jobs(queue, status=None):
+    """list the jobs of a queue, newest first"""
+    query = {'queue': queue}
+    if status:
+        query['status'] = status
+    cur = jobs_collection().find(query, {"_id": 0, "kwargs": 0, "result": 0})
+    return list(cur.sort('_id', pymongo.DESCENDING))
+
+
+def public_job(job):
+    """the part of a job that is returned by the status endpoints"""
+    return {key: job.get(key) for key in PUBLIC_FIELDS}
+
+
+def worker_name():
+    """host and pid of this process, recorded on the jobs it claims"""
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+def claim_job(queue):
+    """atomically take the oldest queued job of queue, None if the queue is empty"""
+    return decode_job(jobs_collection().find_one_and_update(
+        {'queue': queue, 'status': QUEUED},
+        {'$set': {'status': RUNNING,
+                  'started': str(datetime.now()),
+                  'heartbeat': time.time(),
+                  'worker': worker_name()},
+         '$inc': {'attempts': 1}},
+        projection={"_id": 0},
+        sort=[('_id', pymongo.ASCENDING)],
+        return_document=pymongo.ReturnDocument.AFTER))
+
+
+def update_progress(job_id, progress, stage=None):
+    """record how far along a running job is, progress is a fraction in [0, 1]"""
+    update = {'progress': float(progress), 'heartbeat': time.time()}
+    if stage is not None:
+        update['stage'] = stage
+    jobs_collection().update_one({'job_id': job_id}, {'$set': update})
+
+
+def progress_reporter(job_id):
+    """returns the progress(fraction, stage=None) callable handed to job targets"""
+    def progress(fraction, stage=None):
+        update_progress(job_id, fraction, stage)
+    return progress
+
+
+def resolve_target(target):
+    """import the function named by the fully qualified name target"""
+    modulename, _, name = target.rpartition('.')
+    return getattr(importlib.import_module(modulename), name)
+
+
+def heartbeat(job_id, stop, interval=JOB_HEARTBEAT_INTERVAL):
+    """refresh the heartbeat of a running job until stop is set"""
+    col = jobs_collection()
+    while not stop.wait(interval):
+        try:
+            col.update_one({'job_id': job_id, 'status': RUNNING}, {'$set': {'heartbeat': time.time()}})
+        except pymongo.errors.PyMongoError as ex:
+            logging.error('could not refresh the heartbeat of job %s: %s', job_id, ex)
+
+
+def run_job(job):
+    """run a claimed job and store its result or error. the outcome is only stored while the
+    job is still ours, it may have been reaped or failed by a coordinator in the meantime"""
+    col = jobs_collection()
+    stop = threading.Event()
+    beat = threading.Thread(target=heartbeat, args=(job['job_id'], stop))
+    beat.daemon = True
+    beat.start()
+    mine = {'job_id': job['job_id'], 'status': RUNNING, 'worker': job['worker']}
+    try:
+        target = resolve_target(job['target'])
+        # a result that can not be stored fails the job like any other error of the target
+        result = json_util.dumps(target(progress_reporter(job['job_id']), **job['kwargs']))
+    except Exception:
+        tb = traceback.format_exc()
+        logging.error('job %s failed:\n%s', job['job_id'], tb)
+        col.update_one(mine, {'$set': {
+            'status': FAILED, 'error': tb, 'finished': str(datetime.now())}})
+    else:
+        col.update_one(mine, {'$set': {
+            'status': DONE, 'result': result, 'progress': 1.0,
+            'finished': str(datetime.now())}})
+    finally:
+        stop.set()
+
+
+def fail_job(job_id, error):
+    """fail a job that has not finished yet, e.g. when its coordinator gives up waiting"""
+    jobs_collection().update_one({'job_id': job_id, 'status': {'$in': PENDING}}, {'$set': {
+        'status': FAILED, 'error': error, 'worker': None, 'finished': str(datetime.now())}})
+
+
+def reap_jobs(lease=JOB_LEASE):
+    """queue again or fail the running jobs whose worker stopped refreshing their heartbeat,
+    returns how many were reaped"""
+    col = jobs_collection()
+    query = {'status': RUNNING, '$or': [{'heartbeat': {'$lt': time.time() - lease}},
+                                        {'heartbeat': {'$exists': False}}]}
+    stale = col.find(query, {'_id': 0, 'job_id': 1, 'worker': 1, 'attempts': 1, 'max_attempts': 1})
+    reaped = 0
+    for job in stale:
+        if job.get('attempts', 1) < job.get('max_attempts', 1):
+            update = {'status': QUEUED, 'worker': None, 'started': None, 'progress': 0.0, 'stage': None}
+        else:
+            update = {'status': FAILED, 'finished': str(datetime.now()),
+                      'error': 'worker %s stopped running job %s' % (job.get('worker'), job['job_id'])}
+        # only if the job is still stale and still held by the same worker
+        mine = dict(query, job_id=job['job_id'], worker=job.get('worker'))
+        if col.update_one(mine, {'$set': update}).modified_count:
+            logging.warning('reaped job %s of worker %s, it is now %s', job['job_id'],
+                            job.get('worker'), update['status'])
+            reaped += 1
+    return reaped
+
+
+def work(queue, poll=JOB_POLL_INTERVAL, parent=None, reap_interval=JOB_REAP_INTERVAL):
+    """consume jobs from queue forever, or until the parent process goes away. every worker
+    also reaps the jobs of dead workers of any queue now and then"""
+    reaped = 0
+    while parent is None or os.getppid() == parent:
+        if time.time() - reaped > reap_interval:
+            reaped = time.time()
+            try:
+                reap_jobs()
+            except pymongo.errors.PyMongoError as ex:
+                logging.error('could not reap jobs: %s', ex)
+        try:
+            job = claim_job(queue)
+        except pymongo.errors.PyMongoError as ex:
+            logging.error('could not claim a job from %s: %s', queue, ex)
+            job = None
+        if job is None:
+            time.sleep(poll)
+            continue
+        run_job(job)
+
+
+def start_workers(queue, count):
+    """make sure count worker processes started by this process consume queue"""
+    key = (os.getpid(), queue)
+    procs = [proc for proc in _workers.get(key, []) if proc.is_alive()]
+    for _ in range(count - len(procs)):
+        proc = multiprocessing.Process(target=work, args=(queue,), kwargs={'parent': os.getpid()})
+        proc.daemon = True
+        proc.start()
+        procs.append(proc)
+    _workers[key] = procs
+    return procs
+
+
+if __name__ == "__main__":
+    # run dedicated workers outside of the web server: python -m bedrock.core.jobs analytics 4
+    logging.basicConfig(level=logging.INFO)
+    QUEUE = sys.argv[1]
+    COUNT = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    for proc in start_workers(QUEUE, COUNT):
+        proc.join()
@@ -0,0 +1,140 @@
+"""matrixcache.py keeps hot matrices memory mapped so concurrent requests share them.
+
+A matrix whose columns share one numeric dtype is stored once more as a single 2d .npy array (column major) beside its
+binary columns. Every process maps that file read only, so the operating system keeps a
+single physical copy in the page cache no matter how many workers use the matrix, and
+pandas can wrap it without copying. Each process keeps an LRU of its read only mappings keyed
+by the matrix rootdir and the mtime of matrix.csv, bounded by MATRIX_CACHE_BYTES. Frames
+handed to analytics map the file again copy on write, so an opal may change its input in
+place without touching the file or the frames of other callers.
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from bedrock.CONSTANTS import MATRIX_CACHE_BYTES
+from bedrock.core.io import columnar_path, column_array, read_columns, write_columnar
+from bedrock.core.segments import load_segments
+
+DENSE_FILE = 'dense.npy'
+
+_entries = OrderedDict()
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'evicted_bytes': 0, 'bytes': 0}
+
+
+def matrix_key(rootpath):
+    """cache key of the matrix at rootpath, changes whenever matrix.csv is rewritten"""
+    return os.path.realpath(rootpath), os.path.getmtime(os.path.join(rootpath, 'matrix.csv'))
+
+
+def dense_path(rootpath):
+    """location of the shared 2d copy of the matrix at rootpath"""
+    return os.path.join(columnar_path(rootpath), DENSE_FILE)
+
+
+def build_dense(rootpath):
+    """write the shared 2d copy of a matrix, returns False when it does not have a single numeric dtype"""
+    columns = read_columns(rootpath)
+    if columns is None:
+        frame = load_segments(rootpath)
+        if frame is None:
+            frame = pd.read_csv(os.path.join(rootpath, 'matrix.csv'), header=None)
+        # use the arrays just written, matrix.csv may carry an mtime ahead of our clock
+        columns = [column_array(frame[col].values) for col in frame.columns]
+        write_columnar(rootpath, columns)
+    # only matrices with a single numeric dtype, anything else keeps its per column types
+    dtypes = set(col.dtype for col in columns or [])
+    if len(dtypes) != 1 or not np.issubdtype(columns[0].dtype, np.number):
+        return False
+    dtype = columns[0].dtype
+    path = dense_path(rootpath)
+    tmp = path + '.%d.tmp' % os.getpid()
+    dense = np.lib.format.open_memmap(tmp, mode='w+', dtype=dtype,
+                                      shape=(len(columns[0]), len(columns)), fortran_order=True)
+    for i, col in enumerate(columns):
+        dense[:, i] = col
+    dense.flush()
+    del dense
+    os.rename(tmp, path)
+    return True
+
+
+def map_dense(rootpath):
+    """memory map the shared 2d copy of a matrix, building it if needed. None if it can not have one"""
+    path = dense_path(rootpath)
+    csv_path = os.path.join(rootpath, 'matrix.csv')
+    fresh = os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(csv_path)
+    if not fresh and not build_dense(rootpath):
+        return None
+    return np.load(path, mmap_mode='r')
+
+
+def load_dense(rootpath, budget=MATRIX_CACHE_BYTES):
+    """the matrix at rootpath as a read only 2d memory mapped array (rows x features),
+    or None when the matrix does not have a single numeric dtype"""
+    key = matrix_key(rootpath)
+    with _lock:
+        if key in _entries:
+            dense = _entries.pop(key)
+            _entries[key] = dense
+            _stats['hits'] += 1
+            return dense
+        _stats['misses'] += 1
+    try:
+        dense = map_dense(rootpath)
+    except (OSError, IOError, ValueError) as ex:
+        logging.warning('could not map matrix %s: %s', rootpath, ex)
+        return None
+    with _lock:
+        if key not in _entries:
+            _entries[key] = dense
+            _stats['bytes'] += nbytes(dense)
+        evict(budget)
+    return dense
+
+
+def load_frame(rootpath, names=None):
+    """the matrix at rootpath as a writable DataFrame over a copy on write mapping, or None
+    when the matrix does not have a single numeric dtype. pages are shared until written"""
+    if load_dense(rootpath) is None:
+        return None
+    try:
+        dense = np.load(dense_path(rootpath), mmap_mode='c')
+    except (OSError, IOError, ValueError) as ex:
+        logging.warning('could not map matrix %s: %s', rootpath, ex)
+        return None
+    return pd.DataFrame(dense, columns=names, copy=False)
+
+
+def nbytes(dense):
+    """bytes held by a cache entry"""
+    return dense.nbytes if dense is not None else 0
+
+
+def evict(budget):
+    """drop least recently used mappings until the cache fits budget, call with _lock held"""
+    while _stats['bytes'] > budget and len(_entries) > 1:
+        _, dense = _entries.popitem(last=False)
+        size = nbytes(dense)
+        _stats['bytes'] -= size
+        _stats['evictions'] += 1
+        _stats['evicted_bytes'] += size
+
+
+def clear():
+    """forget every mapping held by this process"""
+    with _lock:
+        _entries.clear()
+        _stats['bytes'] = 0
+
+
+def stats():
+    """hit, miss and eviction counters of this process' matrix cache"""
+    with _lock:
+        result = dict(_stats)
+        result['entries'] = len(_entries)
+        result['budget'] = MATRIX_CACHE_BYTES
+    return result
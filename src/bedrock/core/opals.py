@@ -5,13 +5,36 @@ logging.basicConfig()
 import bedrock.analytics.utils
 import bedrock.dataloader.utils
 import bedrock.visualization.utils
-from bedrock.CONSTANTS import MONGO_HOST, MONGO_PORT, VIS_DB_NAME, VIS_COL_NAME, \
+from bedrock.CONSTANTS import VIS_DB_NAME, VIS_COL_NAME, \
   DATALOADER_DB_NAME, DATALOADER_COL_NAME, INGEST_COL_NAME, FILTERS_COL_NAME, \
   ANALYTICS_DB_NAME, ANALYTICS_COL_NAME, RESULTS_COL_NAME
-import pymongo
+from bedrock.core.db import db_client
+from bedrock.core.utils import invalidate_classes, bump_classes_version, prewarm_classes
+
+# (database, collection, id key) of every opal registry
+OPAL_REGISTRIES = [(DATALOADER_DB_NAME, INGEST_COL_NAME, 'ingest_id'),
+                   (DATALOADER_DB_NAME, FILTERS_COL_NAME, 'filter_id'),
+                   (ANALYTICS_DB_NAME, ANALYTICS_COL_NAME, 'analytic_id'),
+                   (VIS_DB_NAME, VIS_COL_NAME, 'vis_id')]
+
+def prewarm_opals():
+    """import every registered opal so the first request of a worker does not pay for it"""
+    client = db_client()
+    classnames = []
+    for db, col, key in OPAL_REGISTRIES:
+        classnames.extend(doc[key] for doc in client[db][col].find({}, {key: 1}) if key in doc)
+    return prewarm_classes(classnames)
 
 def manage_opals(mode, api, modulename):
-    client = pymongo.MongoClient(MONGO_HOST, MONGO_PORT)
+    """add, remove or reload an opal in the registry of api"""
+    if mode == 'reload':
+        invalidate_classes(modulename)
+    changed = _manage_opals(mode, api, modulename)
+    bump_classes_version()
+    return changed
+
+def _manage_opals(mode, api, modulename):
+    client = db_client()
 
     if api == 'ingest':
         col = client[DATALOADER_DB_NAME][INGEST_COL_NAME]
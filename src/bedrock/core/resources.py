@@ -0,0 +1,56 @@
+"""resources.py holds the flask-restplus resources shared by the bedrock apis."""
+from flask_restplus import Resource
+from bedrock.core.jobs import get_job, public_job, DONE, FAILED
+
+
+def job_routes(api, ns, queues, kind, model):
+    """
+    add /<job_id>/, /<job_id>/result/ and /<job_id>/error/ to namespace ns for the jobs of queues.
+    a job of any other queue is not found, so an api never hands out the jobs of another.
+    kind names the jobs in the documentation, e.g. 'analytics job', model is the api model of a job result
+    """
+    not_found = 'No resource at that URL.', 404
+
+    @ns.route('/<job_id>/')
+    @api.doc(params={'job_id': 'The ID returned when the job was queued'})
+    class Job(Resource):
+        @api.doc(responses={200: 'Success', 404: 'No resource at that URL'},
+                 description='Returns the status, stage and progress of the %s.' % kind)
+        def get(self, job_id):
+            job = get_job(job_id, queues)
+            if not job:
+                return not_found
+            return public_job(job)
+
+    @ns.route('/<job_id>/result/')
+    @api.doc(params={'job_id': 'The ID returned when the job was queued'})
+    class JobResult(Resource):
+        @api.doc(responses={
+            200: 'Success',
+            202: 'Job still pending',
+            404: 'No resource at that URL',
+            409: 'Job failed'
+        }, description='Returns the result of the %s once it is done.' % kind)
+        @api.doc(model=model)
+        def get(self, job_id):
+            job = get_job(job_id, queues)
+            if not job:
+                return not_found
+            if job['status'] == DONE:
+                return job['result']
+            if job['status'] == FAILED:
+                return public_job(job), 409
+            return public_job(job), 202
+
+    @ns.route('/<job_id>/error/')
+    @api.doc(params={'job_id': 'The ID returned when the job was queued'})
+    class JobError(Resource):
+        @api.doc(responses={200: 'Success', 404: 'No resource at that URL'},
+                 description='Returns the traceback of the %s when it failed.' % kind)
+        def get(self, job_id):
+            job = get_job(job_id, queues)
+            if not job or job['status'] != FAILED:
+                return not_found
+            return {'job_id': job_id, 'error': job['error']}
+
+    return Job, JobResult, JobError
@@ -0,0 +1,363 @@
+"""segments.py stores growing matrices as immutable append-only segments.
+
+rootpath/segments/ holds one directory per segment with a .npy file per column, and a
+manifest.json listing the segments in row order with their id, first row, row count and
+per column stats. Segment ids only increase, so a reader that remembers the last id it
+saw can fetch just the rows appended after it. Segments are never modified, appends add a
+new one and the compactor replaces runs of small segments by a single merged segment that
+remembers where each of its parts ended. The parts are only retired in the manifest and
+deleted once SEGMENT_RETIRE_SECONDS have passed, by a later compaction or by the first reader
+that finds them expired, so a reader holding the previous manifest can still open them.
+Readers that lose the race anyway read again.
+"""
+import errno
+import fcntl
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from bedrock.CONSTANTS import SEGMENT_COMPACT_ROWS, SEGMENT_COMPACT_COUNT, SEGMENT_MAX_ROWS, \
+    SEGMENT_RETIRE_SECONDS
+from bedrock.core.io import column_array, DIRMASK
+
+SEGMENTS_DIR = 'segments'
+SEGMENTS_VERSION = 1
+# times read_segments starts over when a segment vanished under it
+READ_ATTEMPTS = 3
+
+# rootpaths with a compaction running in this process
+_compacting = set()
+_compacting_lock = threading.Lock()
+
+
+def segments_path(rootpath):
+    """directory holding the segments of the matrix at rootpath"""
+    return os.path.join(rootpath, SEGMENTS_DIR)
+
+
+@contextmanager
+def manifest_lock(rootpath, wait=True):
+    """serialize manifest updates of appenders and the compactor, across processes.
+    with wait=False gives False at once instead of waiting when the lock is held"""
+    with open(os.path.join(segments_path(rootpath), '.lock'), 'a') as lockfile:
+        try:
+            fcntl.flock(lockfile, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError) as ex:
+            if ex.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+
+def read_manifest(rootpath):
+    """the manifest of the segmented matrix at rootpath, None if it has none"""
+    try:
+        with open(os.path.join(segments_path(rootpath), 'manifest.json')) as infile:
+            manifest = json.load(infile)
+    except (OSError, IOError, ValueError):
+        return None
+    if manifest.get('version') != SEGMENTS_VERSION:
+        return None
+    return manifest
+
+
+def write_manifest(rootpath, manifest):
+    """atomically replace the manifest"""
+    path = os.path.join(segments_path(rootpath), 'manifest.json')
+    tmp = path + '.%d.tmp' % os.getpid()
+    with open(tmp, 'w') as outfile:
+        json.dump(manifest, outfile)
+    os.rename(tmp, path)
+
+
+def column_stats(arr):
+    """min, max, mean and missing count of a numeric column, only the missing count for text"""
+    if np.issubdtype(arr.dtype, np.number):
+        values = arr.astype(float)
+        nulls = int(np.isnan(values).sum())
+        if nulls == len(values):
+            return {'min': None, 'max': None, 'mean': None, 'nulls': nulls}
+        return {'min': float(np.nanmin(values)), 'max': float(np.nanmax(values)),
+                'mean': float(np.nanmean(values)), 'nulls': nulls}
+    return {'nulls': int((arr == '').sum())}
+
+
+def write_segment(rootpath, seg_id, arrays, name=None):
+    """write the typed column arrays of a segment, returns its manifest entry without start"""
+    name = name or 'seg_%08d' % seg_id
+    target = os.path.join(segments_path(rootpath), name)
+    tmp = target + '.%d.tmp' % os.getpid()
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp, DIRMASK)
+    for i, arr in enumerate(arrays):
+        np.save(os.path.join(tmp, 'col_%05d.npy' % i), arr)
+    os.rename(tmp, target)
+    return {
+        'id': seg_id,
+        'dir': name,
+        'rows': len(arrays[0]) if arrays else 0,
+        'dtypes': [arr.dtype.str for arr in arrays],
+        'stats': [column_stats(arr) for arr in arrays],
+        'parts': [],
+    }
+
+
+def reset_segments(rootpath, columns, features=None):
+    """start the segments of a matrix over with columns as segment 0"""
+    target = segments_path(rootpath)
+    if os.path.exists(target):
+        shutil.rmtree(target)
+    os.makedirs(target, DIRMASK)
+    with manifest_lock(rootpath):
+        entry = write_segment(rootpath, 0, [column_array(col) for col in columns])
+        entry['start'] = 0
+        write_manifest(rootpath, {
+            'version': SEGMENTS_VERSION,
+            'features': list(features) if features is not None else None,
+            'rows': entry['rows'],
+            'next_id': 1,
+            'segments': [entry],
+        })
+    return entry
+
+
+def append_segment(rootpath, columns, compact=True):
+    """append columns as a new segment, returns its manifest entry.
+    kicks off a background compaction when small segments pile up"""
+    if read_manifest(rootpath) is None:
+        return reset_segments(rootpath, columns)
+    arrays = [column_array(col) for col in columns]
+    with manifest_lock(rootpath):
+        manifest = read_manifest(rootpath)
+        entry = write_segment(rootpath, manifest['next_id'], arrays)
+        entry['start'] = manifest['rows']
+        manifest['segments'].append(entry)
+        manifest['rows'] += entry['rows']
+        manifest['next_id'] += 1
+        write_manifest(rootpath, manifest)
+    if compact and any(len(run) >= SEGMENT_COMPACT_COUNT for run in small_runs(manifest)):
+        compact_in_background(rootpath)
+    return entry
+
+
+def segment_columns(rootpath, entry, mmap_mode='r'):
+    """the memory mapped column arrays of one segment"""
+    target = os.path.join(segments_path(rootpath), entry['dir'])
+    return [np.load(os.path.join(target, 'col_%05d.npy' % i), mmap_mode=mmap_mode)
+            for i in range(len(entry['dtypes']))]
+
+
+def segment_offset(manifest, since):
+    """the row right after segment since, also when since was merged into a larger segment"""
+    for entry in manifest['segments']:
+        if entry['id'] == since:
+            return entry['start'] + entry['rows']
+        for seg_id, end in entry['parts']:
+            if seg_id == since:
+                return end
+    if since < manifest['segments'][0]['id']:
+        return 0
+    raise KeyError('no segment %d' % since)
+
+
+def concat_columns(pieces):
+    """join the pieces of a column, as text when the segments did not agree on a numeric type"""
+    if not all(np.issubdtype(piece.dtype, np.number) for piece in pieces):
+        pieces = [np.asarray(piece).astype(str) for piece in pieces]
+    return np.concatenate(pieces)
+
+
+def read_segments(rootpath, since=None, names=None):
+    """the rows of the matrix at rootpath appended after segment since (all rows if since is None)
+    as a DataFrame, and the id of the last segment read. None if the matrix has no segments"""
+    for attempt in range(READ_ATTEMPTS):
+        try:
+            return read_manifest_segments(rootpath, since, names)
+        except (IOError, OSError) as ex:
+            # a segment of the manifest we read was deleted since, the new manifest has its replacement
+            if attempt == READ_ATTEMPTS - 1:
+                raise
+            logging.info('segments of %s changed while reading, retrying: %s', rootpath, ex)
+
+
+def read_manifest_segments(rootpath, since=None, names=None):
+    """read_segments for a single manifest, raises IOError when one of its segments is gone"""
+    manifest = read_manifest(rootpath)
+    if manifest is None:
+        return None
+    if expired_parts(manifest):
+        purge_retired(rootpath, wait=False)
+    offset = 0 if since is None else segment_offset(manifest, since)
+    pieces = []
+    for entry in manifest['segments']:
+        end = entry['start'] + entry['rows']
+        if end <= offset:
+            continue
+        columns = segment_columns(rootpath, entry)
+        skip = max(offset - entry['start'], 0)
+        pieces.append([col[skip:] for col in columns])
+    last = manifest['segments'][-1]['id']
+    if not pieces:
+        width = len(manifest['segments'][-1]['dtypes'])
+        return pd.DataFrame(columns=names if names is not None else list(range(width))), last
+    columns = [concat_columns([piece[i] for piece in pieces]) for i in range(len(pieces[0]))]
+    frame = pd.DataFrame(dict(enumerate(columns)), columns=list(range(len(columns))))
+    if names is not None:
+        frame.columns = names
+    return frame, last
+
+
+def load_segments(rootpath, names=None):
+    """every row of the segmented matrix at rootpath as a DataFrame, None if it has no segments"""
+    found = read_segments(rootpath, names=names)
+    return found[0] if found is not None else None
+
+
+def remove_segments(rootpath):
+    """drop the segments of a matrix, e.g. when matrix.csv is written from scratch"""
+    target = segments_path(rootpath)
+    if os.path.exists(target):
+        shutil.rmtree(target)
+
+
+def small_runs(manifest, min_rows=SEGMENT_COMPACT_ROWS):
+    """runs of adjacent segments smaller than min_rows, as lists of indices into the manifest"""
+    runs = []
+    run = []
+    for i, entry in enumerate(manifest['segments']):
+        if entry['rows'] < min_rows:
+            run.append(i)
+        else:
+            if len(run) > 1:
+                runs.append(run)
+            run = []
+    if len(run) > 1:
+        runs.append(run)
+    return runs
+
+
+def compact_segments(rootpath, min_rows=SEGMENT_COMPACT_ROWS, max_rows=SEGMENT_MAX_ROWS,
+                     grace=SEGMENT_RETIRE_SECONDS):
+    """merge every run of small segments into one segment of at most max_rows rows. the merged
+    parts are retired and deleted by a compaction at least grace seconds later.
+    returns the number of segments removed"""
+    manifest = read_manifest(rootpath)
+    if manifest is None:
+        return 0
+    merged = []
+    for run in small_runs(manifest, min_rows):
+        group = []
+        for i in run:
+            entry = manifest['segments'][i]
+            if group and sum(e['rows'] for e in group) + entry['rows'] > max_rows:
+                merged.append(group)
+                group = []
+            group.append(entry)
+        merged.append(group)
+    merged = [group for group in merged if len(group) > 1]
+    replacements = []
+    for group in merged:
+        pieces = [segment_columns(rootpath, entry) for entry in group]
+        arrays = [concat_columns([piece[i] for piece in pieces]) for i in range(len(pieces[0]))]
+        replacements.append((write_merged(rootpath, group, arrays), group))
+    removed = []
+    applied = 0
+    with manifest_lock(rootpath):
+        current = read_manifest(rootpath)
+        dirs = set(entry['dir'] for entry in current['segments'])
+        segments = current['segments']
+        for replacement, group in replacements:
+            if not all(entry['dir'] in dirs for entry in group):
+                # another compactor got there first
+                shutil.rmtree(os.path.join(segments_path(rootpath), replacement['dir']), ignore_errors=True)
+                continue
+            merged_dirs = set(entry['dir'] for entry in group)
+            first = [entry['dir'] for entry in segments].index(group[0]['dir'])
+            segments = segments[:first] + [replacement] + \
+                [entry for entry in segments[first:] if entry['dir'] not in merged_dirs]
+            removed.extend(group)
+            applied += 1
+        now = time.time()
+        retired = current.get('retired', []) + [[entry['dir'], now] for entry in removed]
+        expired = [name for name, when in retired if when <= now - grace]
+        if not removed and not expired:
+            return 0
+        current['segments'] = segments
+        current['retired'] = [[name, when] for name, when in retired if when > now - grace]
+        write_manifest(rootpath, current)
+    for name in expired:
+        shutil.rmtree(os.path.join(segments_path(rootpath), name), ignore_errors=True)
+    return len(removed) - applied
+
+
+def expired_parts(manifest, grace=SEGMENT_RETIRE_SECONDS, now=None):
+    """the directories of the retired parts of manifest that no reader can hold any more"""
+    now = time.time() if now is None else now
+    return [name for name, when in manifest.get('retired', []) if when <= now - grace]
+
+
+def purge_retired(rootpath, grace=SEGMENT_RETIRE_SECONDS, wait=True):
+    """delete the expired retired parts of the matrix at rootpath, for sources that stopped
+    appending and so are not compacted any more. with wait=False nothing is done while an
+    appender or the compactor holds the manifest. returns the number of parts deleted"""
+    if not os.path.isdir(segments_path(rootpath)):
+        return 0
+    with manifest_lock(rootpath, wait) as locked:
+        manifest = read_manifest(rootpath) if locked else None
+        if manifest is None:
+            return 0
+        now = time.time()
+        expired = expired_parts(manifest, grace, now)
+        if not expired:
+            return 0
+        manifest['retired'] = [[name, when] for name, when in manifest['retired'] if when > now - grace]
+        write_manifest(rootpath, manifest)
+    for name in expired:
+        shutil.rmtree(os.path.join(segments_path(rootpath), name), ignore_errors=True)
+    return len(expired)
+
+
+def write_merged(rootpath, group, arrays):
+    """write the merged segment replacing group. it takes the id of the newest part so ids stay
+    increasing, and remembers where each part ended so readers can still start after any of them"""
+    name = 'seg_%08d_%08d' % (group[0]['id'], group[-1]['id'])
+    entry = write_segment(rootpath, group[-1]['id'], arrays, name=name)
+    entry['start'] = group[0]['start']
+    parts = []
+    for part in group:
+        parts.extend(part['parts'])
+        parts.append([part['id'], part['start'] + part['rows']])
+    entry['parts'] = parts
+    return entry
+
+
+def compact_in_background(rootpath):
+    """run compact_segments for rootpath in a daemon thread unless one is already running"""
+    with _compacting_lock:
+        if rootpath in _compacting:
+            return
+        _compacting.add(rootpath)
+
+    def run():
+        try:
+            removed = compact_segments(rootpath)
+            logging.info('compacted %d segments of %s', removed, rootpath)
+        except Exception as ex:
+            logging.warning('could not compact the segments of %s: %s', rootpath, ex)
+        finally:
+            with _compacting_lock:
+                _compacting.discard(rootpath)
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
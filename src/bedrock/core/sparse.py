@@ -0,0 +1,128 @@
+"""sparse.py keeps a binary copy of MatrixMarket files.
+
+The first load of a .mtx file converts it to compressed sparse arrays saved as .npy files in
+<file>.bin/<format>/ next to it, so later loads memory map data, indices and indptr instead
+of parsing text again. CSC is written on conversion, CSR the first time it is asked for. A
+copy older than its .mtx file is ignored and rebuilt.
+"""
+import json
+import logging
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from scipy.io import mmread
+from scipy.sparse import coo_matrix, csc_matrix, csr_matrix
+from bedrock.core.io import DIRMASK
+
+SPARSE_VERSION = 1
+FORMATS = {'csc': csc_matrix, 'csr': csr_matrix}
+
+
+def sparse_path(filepath, fmt):
+    """directory of the binary copy of filepath in fmt"""
+    return os.path.join(filepath + '.bin', fmt)
+
+
+def read_sparse_header(filepath, fmt):
+    """the header of the binary copy of filepath in fmt, None if there is no up to date copy"""
+    header_path = os.path.join(sparse_path(filepath, fmt), 'header.json')
+    try:
+        if os.path.getmtime(header_path) < os.path.getmtime(filepath):
+            return None
+        with open(header_path) as infile:
+            header = json.load(infile)
+    except (OSError, IOError, ValueError):
+        return None
+    if header.get('version') != SPARSE_VERSION:
+        return None
+    return header
+
+
+def write_sparse(filepath, matrix, fmt):
+    """save matrix as the binary copy of filepath in fmt, returns its header.
+    The directory is swapped in whole"""
+    matrix = FORMATS[fmt](matrix)
+    matrix.sum_duplicates()
+    matrix.sort_indices()
+    target = sparse_path(filepath, fmt)
+    tmp = target + '.%d.tmp' % os.getpid()
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp, DIRMASK)
+    for name in ('data', 'indices', 'indptr'):
+        np.save(os.path.join(tmp, name + '.npy'), getattr(matrix, name))
+    header = {'version': SPARSE_VERSION, 'format': fmt, 'shape': list(matrix.shape),
+              'nnz': int(matrix.nnz), 'dtype': matrix.dtype.str}
+    with open(os.path.join(tmp, 'header.json'), 'w') as outfile:
+        json.dump(header, outfile)
+    if os.path.exists(target):
+        shutil.rmtree(target)
+    os.rename(tmp, target)
+    return header
+
+
+def map_sparse(filepath, fmt):
+    """the binary copy of filepath in fmt with copy on write mapped arrays, None if there is none"""
+    header = read_sparse_header(filepath, fmt)
+    if header is None:
+        return None
+    return open_sparse(filepath, fmt, header)
+
+
+def open_sparse(filepath, fmt, header):
+    """map the arrays of the binary copy of filepath in fmt described by header"""
+    target = sparse_path(filepath, fmt)
+    arrays = [np.load(os.path.join(target, name + '.npy'), mmap_mode='c')
+              for name in ('data', 'indices', 'indptr')]
+    return FORMATS[fmt](tuple(arrays), shape=tuple(header['shape']), copy=False)
+
+
+def read_mtx(filepath):
+    """parse a MatrixMarket file. general coordinate matrices go through the pandas C parser,
+    anything else through scipy's mmread"""
+    with open(filepath) as infile:
+        banner = infile.readline().lower().split()
+        skip = 1
+        line = infile.readline()
+        while line.startswith('%'):
+            skip += 1
+            line = infile.readline()
+    if len(banner) < 5 or banner[2] != 'coordinate' or banner[4] != 'general' or banner[3] == 'complex':
+        return mmread(filepath)
+    rows, cols, nnz = [int(x) for x in line.split()]
+    pattern = banner[3] == 'pattern'
+    names = ['row', 'col'] if pattern else ['row', 'col', 'value']
+    dtype = {'row': np.int64, 'col': np.int64}
+    if not pattern:
+        dtype['value'] = np.int64 if banner[3] == 'integer' else np.float64
+    # round_trip parses every value to the same double as mmread, the default parser can be an ulp off
+    entries = pd.read_csv(filepath, sep=r'\s+', header=None, names=names, skiprows=skip + 1,
+                          nrows=nnz, dtype=dtype, comment='%', float_precision='round_trip')
+    values = np.ones(len(entries)) if pattern else entries['value'].values
+    return coo_matrix((values, (entries['row'].values - 1, entries['col'].values - 1)), shape=(rows, cols))
+
+
+def load_sparse(filepath, fmt='csc'):
+    """the MatrixMarket matrix at filepath as a csc or csr matrix over memory mapped arrays,
+    converting it to binary on first use"""
+    if fmt not in FORMATS:
+        raise ValueError('unknown sparse format %s' % fmt)
+    matrix = map_sparse(filepath, fmt)
+    if matrix is not None:
+        return matrix
+    # build from the binary copy in the other format when there is one, mmread is slow
+    for other in FORMATS:
+        source = map_sparse(filepath, other)
+        if source is not None:
+            break
+    else:
+        source = read_mtx(filepath)
+    try:
+        header = write_sparse(filepath, source, fmt)
+    except (OSError, IOError) as ex:
+        # read only result directories still get the matrix, just without the binary copy
+        logging.warning('could not write the binary copy of %s: %s', filepath, ex)
+        return FORMATS[fmt](source)
+    # map the copy just written, the .mtx file may carry an mtime ahead of our clock
+    return open_sparse(filepath, fmt, header)
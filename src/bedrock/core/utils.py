@@ -1,10 +1,86 @@
 """
     Utility functions for bedrock
 """
+import importlib
+import logging
+import threading
+import time
+from bedrock.CONSTANTS import OPALS_VERSION_CHECK_INTERVAL
+
+try:
+    from importlib import reload
+except ImportError:
+    pass # python2 has reload as a builtin
+
+# classes resolved in this process keyed by fully qualified classname
+_classes = {}
+_classes_lock = threading.Lock()
+_classes_version = None
+_classes_checked = 0
+
+def resolve_class(classname):
+    """return the class named by the fully qualified classname, importing it only once per process"""
+    check_classes_version()
+    cls = _classes.get(classname)
+    if cls is None:
+        modulename, _, objectname = classname.rpartition(".")
+        module = importlib.import_module(modulename)
+        cls = getattr(module, objectname)
+        with _classes_lock:
+            _classes[classname] = cls
+    return cls
+
 def get_class(classname):
-    modulename = classname.rpartition(".")[0]
-    import importlib
-    m = importlib.import_module(modulename)
-    objectname = "m.%s" % (classname.rpartition(".")[2])
-    mod = eval(objectname)()
-    return mod
+    """instantiate the opal class named by the fully qualified classname"""
+    return resolve_class(classname)()
+
+def invalidate_classes(classname=None):
+    """forget a cached class, or all of them, so the next lookup imports it again.
+    The modules are reloaded so changes on disk are picked up."""
+    with _classes_lock:
+        classnames = list(_classes.keys()) if classname is None else [classname]
+        for name in classnames:
+            _classes.pop(name, None)
+    for modulename in set(name.rpartition(".")[0] for name in classnames):
+        try:
+            reload(importlib.import_module(modulename))
+        except Exception as ex:
+            logging.warning('could not reload module %s: %s', modulename, ex)
+
+def prewarm_classes(classnames):
+    """resolve a list of classnames up front, returns the ones that failed to import"""
+    failed = []
+    for classname in classnames:
+        try:
+            resolve_class(classname)
+        except Exception as ex:
+            logging.warning('could not prewarm opal %s: %s', classname, ex)
+            failed.append(classname)
+    return failed
+
+def bump_classes_version():
+    """bump the shared registry version so the other processes drop their cached classes"""
+    global _classes_version
+    from bedrock.core.db import db_client, bump_opals_version
+    version = bump_opals_version(db_client())
+    if _classes_version == version - 1:
+        _classes_version = version
+
+def check_classes_version():
+    """drop the cache when another process has changed the opal registry.
+    The shared version is read at most every OPALS_VERSION_CHECK_INTERVAL seconds."""
+    global _classes_version, _classes_checked
+    now = time.time()
+    if now - _classes_checked < OPALS_VERSION_CHECK_INTERVAL:
+        return
+    _classes_checked = now
+    from bedrock.core.db import db_client, get_opals_version
+    try:
+        version = get_opals_version(db_client())
+    except Exception as ex:
+        logging.warning('could not read the opal registry version: %s', ex)
+        return
+    if version != _classes_version:
+        if _classes_version is not None:
+            invalidate_classes()
+        _classes_version = version
@@ -14,7 +14,6 @@ import traceback
 import urllib2
 from datetime import datetime
 
-import pymongo
 import requests
 from bson.json_util import dumps
 from bson.objectid import ObjectId
@@ -26,10 +25,15 @@ from werkzeug import secure_filename
 
 import utils
 from bedrock.CONSTANTS import DATALOADER_COL_NAME, DATALOADER_DB_NAME, DATALOADER_PATH
-from bedrock.CONSTANTS import INGEST_COL_NAME, RESULTS_PATH, RESULTS_COL_NAME  #, RESPATH
-from bedrock.CONSTANTS import FILTERS_COL_NAME
-from bedrock.core.db import db_client, db_collection, find_matrix, find_source
+from bedrock.CONSTANTS import INGEST_COL_NAME, RESULTS_PATH, RESULTS_COL_NAME, ANALYTICS_DB_NAME
+from bedrock.CONSTANTS import FILTERS_COL_NAME, DATALOADER_WORKERS, DATALOADER_QUEUE_DEPTH, FILTER_WORKERS
+from bedrock.core.db import db_client, db_collection, find_matrix, find_source, \
+  attach_matrices, delete_matrix, delete_matrices, matrices_collection, delete_results, get_opals_version
 from bedrock.core.io import write_source_file, write_source_config
+from bedrock.core import segments
+from bedrock.dataloader import streams
+from bedrock.core.jobs import submit_job, start_workers, public_job, QueueFull
+from bedrock.core.resources import job_routes
 from bedrock.core.models import Source
 
 def explore(cur):
@@ -59,6 +63,7 @@ api = Api(app, version="0.1", title="DataLoader API",
 ns = api.namespace('sources')
 ns_i = api.namespace('ingest')
 ns_f = api.namespace('filters')
+ns_j = api.namespace('jobs')
 
 @api.model(fields={
                 'attrname': fields.String(description='Python variable name', required=True),
@@ -132,12 +137,15 @@ api.model('Features', {
 })
 
 @api.model(fields={
-                'examples': fields.List(fields.String, description='Example samples for this field'),
                 'key': fields.String(description='Name of this field', required=True),
                 'key_usr': fields.String(description='User-edited name of this field', required=True),
                 'suggestion': fields.String(description='Top suggested filter for this field'),
                 'suggestions': fields.List(fields.String, description='List of other possible filters for this field', required=True),
                 'type': fields.List(fields.String, description='Basic type for this field', required=True),
+                'examples': fields.List(fields.String, description='First values of this field'),
+                'range': fields.List(fields.Float, description='Smallest and largest sampled value of a Numeric field'),
+                'nulls': fields.Float(description='Fraction of sampled values that are missing'),
+                'cardinality': fields.Integer(description='Number of distinct sampled values'),
                 })
 class Schema(fields.Raw):
     def format(self, value):
@@ -217,7 +225,7 @@ class Sources(Resource):
         col = db_collection(client, DATALOADER_DB_NAME, DATALOADER_COL_NAME)
         sources = list(col.find({},{"_id":0,"stash":0}))
 
-        return sources
+        return attach_matrices(col, sources)
 
     @api.hide
     def delete(self):
@@ -229,6 +237,7 @@ class Sources(Resource):
         col = db_collection(client, DATALOADER_DB_NAME, DATALOADER_COL_NAME)
         #remove the entries in mongo
         col.remove({})
+        matrices_collection(col).remove({})
         #remove the actual files
         for directory in os.listdir(DATALOADER_PATH):
             file_path = os.path.join(DATALOADER_PATH, directory)
@@ -246,15 +255,10 @@ class Sources(Resource):
 
             client = db_client()
             col = db_collection(client, DATALOADER_DB_NAME, DATALOADER_COL_NAME)
-            try:
-                matrices = find_source(col, src_id)['matrices']
-            except IndexError:
-                response = {}
-                # return ('No resource at that URL.', 404)
-            else:
-                for matrix in matrices:
-                    if matrix['id'] == matrix_id or matrix['name'] == matrix_id:
-                        return send_from_directory(matrix['rootdir'],output_file, as_attachment=True, attachment_filename=file_download_name)
+            matrix = find_matrix(col, src_id, matrix_id)
+            if matrix:
+                return send_from_directory(matrix['rootdir'],output_file, as_attachment=True, attachment_filename=file_download_name)
+            return 'No resource at that URL.', 404
 
     @ns.route('/<name>/<ingest_id>/<group_name>/')
     class NewSource(Resource):
@@ -286,6 +290,7 @@ class Sources(Resource):
                     src_id = existing_source['src_id']
                     if overwrite:
                         col.delete_one({"src_id":src_id})
+                        delete_matrices(col, src_id)
                         file_path = '/'.join([DATALOADER_PATH,src_id])
                         shutil.rmtree(file_path)
                 else:
@@ -340,7 +345,7 @@ class Sources(Resource):
             client = db_client()
             col = db_collection(client, DATALOADER_DB_NAME, DATALOADER_COL_NAME)
             explorables = list(col.find({},{"_id":0}))
-            return explorables
+            return attach_matrices(col, explorables)
 
     @ns.route('/group/<group_name>/')
     class Group(Resource):
@@ -353,7 +358,7 @@ class Sources(Resource):
             col = db_collection(client, DATALOADER_DB_NAME, DATALOADER_COL_NAME)
             sources = list(col.find({'group_name':group_name},{"_id":0}))
 
-            return sources
+            return attach_matrices(col, sources)
 
     @ns.route('/groups/')
     class Groups(Resource):
@@ -381,7 +386,7 @@ class Sources(Resource):
             client = db_client()
             col = db_collection(client, DATALOADER_DB_NAME, DATALOADER_COL_NAME)
             try:
-                response = find_source(col, src_id)
+                response = find_source(col, src_id, matrices=True)
                 if response is None:
                     return 'No resource at that URL', 404
             except Exception as e:
@@ -397,28 +402,25 @@ class Sources(Resource):
             '''
             client = db_client()
             col = db_collection(client, DATALOADER_DB_NAME, DATALOADER_COL_NAME)
-            try:
-                src = find_source(col, src_id)
-
-            except IndexError:
+            src = find_source(col, src_id, matrices=True)
+            if src is None:
                 return 'No resource at that URL.', 404
 
             else:
-                try:
-                    matrices = src['matrices']
-                except KeyError:
+                src_id = src['src_id']
+                matrices = src['matrices']
+                if not matrices:
                     logging.info('No Matrices for source %s on delete', src_id)
                 else:
-                    client = db_client()
-                    rescol = db_collection(client, DATALOADER_DB_NAME, DATALOADER_COL_NAME)
+                    rescol = db_collection(client, ANALYTICS_DB_NAME, RESULTS_COL_NAME)
                     for mat in matrices:
                         mat_id = mat['id']
                         # this subtree is deleted when the DATALOADER_PATH/src_id gets removed later
                         # shutil.rmtree(os.path.join(DATALOADER_PATH, src_id, mat_id))
                         try:
-                            logging.info('going to remove %s/%s', RESPATH, mat_id)
-                            shutil.rmtree(os.path.join(RESPATH, mat_id))
-                            rescol.remove({'src_id':mat_id})
+                            delete_results(rescol, mat_id)
+                            logging.info('going to remove %s/%s', RESULTS_PATH, mat_id)
+                            shutil.rmtree(os.path.join(RESULTS_PATH, mat_id))
 
                         except Exception as ex:
                             logging.error('could not remove matrix results %s while deleting source %s exception:%s', mat_id, src_id, ex)
@@ -432,6 +434,7 @@ class Sources(Resource):
                     return err, 500
                 try:
                     col.remove({'src_id':src_id})
+                    delete_matrices(col, src_id)
                 except:
                     return 'Failed to remove source from database', 500
                 try:
@@ -441,37 +444,39 @@ class Sources(Resource):
                 return 'Deleted Source: %s'%src_id, 204
 
 
+        @api.doc(responses={202: 'Queued', 404: 'No resource at that URL', 409: 'Matrix name taken',
+                            503: 'Dataloader queue is full'})
         @api.doc(model='Matrix', body='Source')
         def post(self, src_id):
             '''
             Generate a matrix from the source stored at that ID.
-            Returns metadata for that matrix.
+            The matrix is generated in a worker process. The response carries the job_id to poll at /jobs/<job_id>/, which reports the read, filter and store stages, the metadata for the new matrices is available from /jobs/<job_id>/result/ once the job is done.
             '''
             try:
                 posted_data = request.get_json(force=True)
                 client = db_client()
                 col = db_collection(client, DATALOADER_DB_NAME, DATALOADER_COL_NAME)
 
-                try:
-                    src = find_source(col, src_id)
-
-                except IndexError:
+                src = find_source(col, src_id)
+                if src is None:
                     return 'No resource at that URL.', 404
 
-                error, matricesNew = utils.ingest(posted_data, src)
-
-                if error:
-                    return 'Unable to create matrix.', 406
+                if 'matrixName' in posted_data and find_matrix(col, src['src_id'], posted_data['matrixName']):
+                    return 'A matrix named %s already exists.' % posted_data['matrixName'], 409
 
-                matrices = []
-                for each in src['matrices']:
-                    matrices.append(each)
-                matrices.extend(matricesNew)
-                col.update({'src_id':src_id}, { '$set': {'matrices': matrices} })
+                job = submit_job('dataloader', 'bedrock.dataloader.utils.matrix_job', {
+                    'src_id': src['src_id'],
+                    'posted_data': posted_data
+                }, max_depth=DATALOADER_QUEUE_DEPTH, meta={'src_id': src['src_id'],
+                                                           'matrixName': posted_data.get('matrixName')}, attempts=1)
+            except QueueFull as ex:
+                return str(ex), 503
             except:
                 tb = traceback.format_exc()
                 return tb, 406
-            return matricesNew, 201
+            start_workers('dataloader', DATALOADER_WORKERS)
+            start_workers(utils.FILTER_QUEUE, FILTER_WORKERS)
+            return public_job(job), 202, {'Location': '%s/jobs/%s/' % (request.script_root, job['job_id'])}
 
 
         @ns.route('/<src_id>/explore/')
@@ -490,11 +495,11 @@ class Sources(Resource):
 
                 filepath = src['rootdir'] + '/source/'
 
-                #get filters
+                #get filters, the cursor is only read when the cached result is stale
                 f_col = db_collection(client, DATALOADER_DB_NAME, FILTERS_COL_NAME)
                 filters = f_col.find()
 
-                return utils.explore(src['ingest_id'], filepath, filters)
+                return utils.cached_explore(src['ingest_id'], filepath, filters, get_opals_version(client))
 
         @ns.route('/<src_id>/custom/<param1>/<param2>/')
         class Custom_2(Resource):
@@ -544,49 +549,58 @@ class Sources(Resource):
 
         @ns.route('/<src_id>/stream/')
         class Stream(Resource):
+            @api.doc(responses={200: 'Success', 404: 'No resource at that URL', 503: 'Stream could not be started'})
             def post(self, src_id):
                 '''
-                For streaming, start or end the streaming service.
-                No payload is sent for this request.
+                For streaming, start the streaming service.
+                No payload is sent for this request. The stream runs under the stream supervisor, which restarts it if it crashes.
+                Returns the state of the stream.
                 '''
                 client = db_client()
                 col = db_collection(client, DATALOADER_DB_NAME, DATALOADER_COL_NAME)
-                try:
-                    src = find_source(col, src_id)
-
-                except IndexError:
+                src = find_source(col, src_id)
+                if src is None:
                     return 'No resource at that URL.', 404
+                try:
+                    return utils.stream(src['ingest_id'], src['rootdir'])
+                except streams.StreamError as ex:
+                    return str(ex), 503
 
-                filepath = src['rootdir']
-
-                #get filters
-                f_client = db_client()
-                f_col = db_collection(client, DATALOADER_DB_NAME, FILTERS_COL_NAME)
-                filters = f_col.find()
-                return utils.stream(src['ingest_id'], filepath)
-
+            @api.doc(responses={200: 'Success', 404: 'No resource at that URL', 503: 'Stream could not be started'})
             def patch(self, src_id):
                 '''
                 For streaming, toggles streaming on or off.
-                This request is used in conjunction with the POST request to this same endpoint.
-
+                This request is used in conjunction with the POST request to this same endpoint. Returns the state of the stream.
                 '''
                 client = db_client()
                 col = db_collection(client, DATALOADER_DB_NAME, DATALOADER_COL_NAME)
-                try:
-                    src = find_source(col, src_id)
-
-                except IndexError:
+                src = find_source(col, src_id)
+                if src is None:
                     return 'No resource at that URL.', 404
+                try:
+                    return utils.update(src['ingest_id'], src['rootdir'])
+                except streams.StreamError as ex:
+                    return str(ex), 503
 
-                filepath = src['rootdir']
+            @api.doc(responses={200: 'Success', 404: 'No stream for that source'})
+            def get(self, src_id):
+                '''
+                Returns the state of the stream of a source: status, pid, restarts, rows ingested and rows_per_sec.
+                '''
+                try:
+                    return streams.stream_status(src_id)
+                except streams.StreamError as ex:
+                    return str(ex), 404
 
-                #get filters
-                f_client = db_client()
-                f_col = db_collection(client, DATALOADER_DB_NAME, FILTERS_COL_NAME)
-                filters = f_col.find()
-                utils.update(src['ingest_id'], filepath)
-                return
+            @api.doc(responses={200: 'Success', 404: 'No stream for that source'})
+            def delete(self, src_id):
+                '''
+                For streaming, stop the streaming service. Returns the state of the stream.
+                '''
+                try:
+                    return streams.stop_stream(src_id)
+                except streams.StreamError as ex:
+                    return str(ex), 404
 
 
         @ns.route('/<src_id>/<mat_id>/')
@@ -598,18 +612,10 @@ class Sources(Resource):
                 '''
                 client = db_client()
                 col = db_collection(client, DATALOADER_DB_NAME, DATALOADER_COL_NAME)
-                try:
-                    matrices = find_source(col, src_id)['matrices']
-
-                except IndexError:
-                    return 'No resource at that URL.', 404
-
-                else:
-                    for matrix in matrices:
-                        if matrix['id'] == mat_id or matrix['name'] == mat_id:
-                            return matrix
-
+                matrix = find_matrix(col, src_id, mat_id)
+                if matrix is None:
                     return 'No resource at that URL.', 404
+                return matrix
 
             def delete(self, src_id, mat_id):
                 '''
@@ -618,37 +624,23 @@ class Sources(Resource):
                 '''
                 client = db_client()
                 col = db_collection(client, DATALOADER_DB_NAME, DATALOADER_COL_NAME)
-                try:
-                    matrices = find_source(col, src_id)['matrices']
-
-                except IndexError:
+                matrix = delete_matrix(col, src_id, mat_id)
+                if matrix is None:
                     return 'No resource at that URL.', 404
 
                 else:
-                    matrices_new = []
-                    found = False
-                    for each in matrices:
-                        if each['id'] != mat_id and each['name'] != mat_id:
-                            matrices_new.append(each)
-                        else:
-                            found = True
-                    if found:
-                        col.update({'src_id':src_id}, { '$set': {'matrices': matrices_new} })
-                    else:
-                        return 'No resource at that URL.', 404
-
+                    src_id, mat_id = matrix['src_id'], matrix['id']
                     shutil.rmtree(DATALOADER_PATH + src_id + '/' + mat_id)
 
-                    col = client[DATALOADER_DB_NAME][RESULTS_COL_NAME]
+                    col = client[ANALYTICS_DB_NAME][RESULTS_COL_NAME]
                     try:
-                        col.remove({'src_id':mat_id})
-                        shutil.rmtree(RESPATH + mat_id)
+                        delete_results(col, mat_id)
+                        shutil.rmtree(RESULTS_PATH + mat_id)
 
                     except:
                         pass
 
-                    else:
-                        return '', 204
+                    return '', 204
 
 
             @ns.route('/<src_id>/<mat_id>/output/')
@@ -659,12 +651,9 @@ class Sources(Resource):
                     '''
                     client = db_client()
                     col = db_collection(client, DATALOADER_DB_NAME, DATALOADER_COL_NAME)
-                    try:
-                        matrix = find_matrix(col, src_id, mat_id)
-                    except IndexError:
+                    matrix = find_matrix(col, src_id, mat_id)
+                    if matrix is None:
                         return 'No resource at that URL.', 404
-                    except AssertionError:
-                        return 'Bad mongo query', 500
                     else:
                         try:
                             output_path = matrix['rootdir'] + 'output.txt'
@@ -686,12 +675,9 @@ class Sources(Resource):
                     '''
                     client = db_client()
                     col = db_collection(client, DATALOADER_DB_NAME, DATALOADER_COL_NAME)
-                    try:
-                        matrix = find_matrix(col, src_id, mat_id)
-                    except IndexError:
+                    matrix = find_matrix(col, src_id, mat_id)
+                    if matrix is None:
                         return 'No resource at that URL.', 404
-                    except AssertionError:
-                        return 'Bad Mongo Query', 500
                     else:
                         rootdir = matrix['rootdir']
                         features_filepath = rootdir + 'features.txt'
@@ -704,3 +690,36 @@ class Sources(Resource):
                             response = []
 
                         return response
+
+            @ns.route('/<src_id>/<mat_id>/segments/')
+            class Segments(Resource):
+                @api.doc(params={'since': 'Only list the segments appended after this segment id'})
+                def get(self, src_id, mat_id):
+                    '''
+                    Returns the segments of a streaming matrix.
+                    Every update of a streaming source appends a segment, remember the id of the last
+                    segment seen and pass it as since to only get the segments added after it.
+                    '''
+                    client = db_client()
+                    col = db_collection(client, DATALOADER_DB_NAME, DATALOADER_COL_NAME)
+                    matrix = find_matrix(col, src_id, mat_id)
+                    if matrix is None:
+                        return 'No resource at that URL.', 404
+                    manifest = segments.read_manifest(matrix['rootdir'])
+                    if manifest is None:
+                        return 'Matrix %s/%s is not segmented' % (src_id, mat_id), 404
+                    since = request.args.get('since')
+                    try:
+                        offset = segments.segment_offset(manifest, int(since)) if since else 0
+                    except (KeyError, ValueError):
+                        return 'No segment %s in %s/%s' % (since, src_id, mat_id), 404
+                    return {
+                        'features': manifest['features'],
+                        'rows': manifest['rows'],
+                        'last_id': manifest['segments'][-1]['id'],
+                        'segments': [entry for entry in manifest['segments']
+                                     if entry['start'] + entry['rows'] > offset],
+                    }
+
+
+job_routes(api, ns_j, ('dataloader',), 'matrix generation job', 'Matrix')
@@ -0,0 +1,416 @@
+"""streams.py supervises the processes of streaming sources.
+
+A single supervisor process per host owns one child process per streaming src_id. The web
+server talks to it over a unix socket: start and stop requests are delivered to the stream
+process through a shared event, crashed streams are restarted with a backoff, at most
+STREAM_MAX_CONCURRENT streams run at once and every stream reports the rows it ingested so
+the supervisor can compute its throughput. The state of the streams is written to the
+streams collection for reference, nothing polls it.
+
+The socket lives in STREAM_SUPERVISOR_DIR, a directory only the server user can enter, and
+both ends authenticate with a random key generated there on first use. Connections pickle
+their messages, so nothing else may be able to listen on or connect to that socket.
+
+Run it by hand with python -m bedrock.dataloader.streams, the dataloader api starts it on
+demand otherwise.
+"""
+import errno
+import logging
+import os
+import signal
+import stat
+import socket
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime
+from multiprocessing import Event, Process, Value
+from multiprocessing.connection import Client, Listener
+from bedrock.CONSTANTS import DATALOADER_DB_NAME, STREAMS_COL_NAME, \
+    STREAM_SUPERVISOR_DIR, STREAM_PYTHON, STREAM_MAX_CONCURRENT, \
+    STREAM_MAX_RESTARTS, STREAM_STOP_TIMEOUT, STREAM_CHECK_INTERVAL, SEGMENT_RETIRE_SECONDS
+from bedrock.core.db import db_client
+
+RUNNING = 'running'
+STOPPING = 'stopping'
+STOPPED = 'stopped'
+CRASHED = 'crashed'
+FAILED = 'failed'
+
+# the supervisor methods clients may call
+COMMANDS = ['start', 'stop', 'toggle', 'status']
+SOCKET_FILE = 'supervisor.sock'
+AUTHKEY_FILE = 'authkey'
+
+
+class StreamError(Exception):
+    """raised by the client functions when the supervisor refuses or can not be reached"""
+    pass
+
+
+###################################################################################################
+# inside the stream process
+
+# the stop event and row counter of the stream running in this process, set by run_stream
+_stop = None
+_rows = None
+
+
+def streaming():
+    """False once the stream running in this process has been asked to stop"""
+    return _stop is None or not _stop.is_set()
+
+
+def count_rows(count=1):
+    """add count to the rows ingested by the stream running in this process"""
+    if _rows is not None:
+        with _rows.get_lock():
+            _rows.value += count
+
+
+def run_stream(ingest_id, filepath, src_id, stop, rows):
+    """target of a stream process, runs the stream method of the ingest opal"""
+    global _stop, _rows
+    from bedrock.core.utils import get_class
+    from bedrock.dataloader.utils import flush_counts
+    _stop, _rows = stop, rows
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    mod = get_class(ingest_id)
+    try:
+        mod.stream(filepath)
+    finally:
+        flush_counts()
+
+
+###################################################################################################
+# the supervisor
+
+class Stream(object):
+    """a supervised stream process and its accounting"""
+    def __init__(self, src_id, ingest_id, filepath):
+        self.src_id = src_id
+        self.ingest_id = ingest_id
+        self.filepath = filepath
+        self.stop = Event()
+        self.rows = Value('L', 0)
+        self.proc = None
+        self.status = STOPPED
+        self.restarts = 0
+        self.retry_at = None
+        self.stop_at = None
+        self.started = None
+        self.rate = 0.0
+        self.sampled = (time.time(), 0)
+
+    def spawn(self):
+        self.stop.clear()
+        self.proc = Process(target=run_stream,
+                            args=(self.ingest_id, self.filepath, self.src_id, self.stop, self.rows))
+        self.proc.daemon = True
+        self.proc.start()
+        self.status = RUNNING
+        self.started = str(datetime.now())
+        self.retry_at = None
+        logging.info('stream %s started as pid %d', self.src_id, self.proc.pid)
+
+    def alive(self):
+        return self.proc is not None and self.proc.is_alive()
+
+    def sample(self):
+        """update the rows/s of the stream from its row counter"""
+        now, rows = time.time(), self.rows.value
+        then, before = self.sampled
+        if now > then:
+            self.rate = (rows - before) / (now - then)
+        self.sampled = (now, rows)
+
+    def info(self):
+        return {
+            'src_id': self.src_id,
+            'ingest_id': self.ingest_id,
+            'status': self.status,
+            'pid': self.proc.pid if self.alive() else None,
+            'host': socket.gethostname(),
+            'restarts': self.restarts,
+            'rows': self.rows.value,
+            'rows_per_sec': round(self.rate, 2),
+            'started': self.started,
+        }
+
+
+class Supervisor(object):
+    """owns the stream processes of this host"""
+    def __init__(self, max_streams=STREAM_MAX_CONCURRENT):
+        self.max_streams = max_streams
+        self.streams = {}
+        self.lock = threading.Lock()
+
+    def active(self):
+        return [stream for stream in self.streams.values() if stream.status in (RUNNING, STOPPING)]
+
+    def start(self, src_id, ingest_id, filepath):
+        with self.lock:
+            return self._start(src_id, ingest_id, filepath)
+
+    def stop(self, src_id):
+        with self.lock:
+            return self._stop(src_id)
+
+    def toggle(self, src_id, ingest_id, filepath):
+        # checked and switched under one lock, two toggles in a row never both start the stream
+        with self.lock:
+            stream = self.streams.get(src_id)
+            if stream is not None and stream.status in (RUNNING, CRASHED):
+                return self._stop(src_id)
+            return self._start(src_id, ingest_id, filepath)
+
+    def _start(self, src_id, ingest_id, filepath):
+        """spawn the stream of src_id unless it is running, call with self.lock held"""
+        stream = self.streams.get(src_id)
+        if stream is not None and stream.status in (RUNNING, STOPPING):
+            return stream.info()
+        if len(self.active()) >= self.max_streams:
+            raise StreamError('%d streams are already running' % self.max_streams)
+        stream = Stream(src_id, ingest_id, filepath)
+        self.streams[src_id] = stream
+        stream.spawn()
+        set_source_status(src_id, True)
+        return stream.info()
+
+    def _stop(self, src_id):
+        """ask the stream of src_id to stop, call with self.lock held"""
+        stream = self.streams.get(src_id)
+        if stream is None:
+            raise StreamError('stream %s is not running' % src_id)
+        if stream.status == RUNNING:
+            stream.status = STOPPING
+            stream.stop_at = time.time() + STREAM_STOP_TIMEOUT
+            stream.stop.set()
+            set_source_status(src_id, False)
+        elif stream.status in (CRASHED, FAILED):
+            stream.status = STOPPED
+        return stream.info()
+
+    def status(self, src_id=None):
+        with self.lock:
+            if src_id is None:
+                return [stream.info() for stream in self.streams.values()]
+            stream = self.streams.get(src_id)
+            if stream is None:
+                raise StreamError('stream %s is not running' % src_id)
+            return stream.info()
+
+    def check(self):
+        """reap, restart and sample every stream, called every STREAM_CHECK_INTERVAL seconds"""
+        now = time.time()
+        stopped = []
+        with self.lock:
+            for stream in self.streams.values():
+                stream.sample()
+                if stream.status == STOPPING:
+                    if not stream.alive():
+                        stream.status = STOPPED
+                        stopped.append(stream.src_id)
+                    elif now > stream.stop_at:
+                        # SIGTERM only sets the stop event in the stream process, so kill it
+                        logging.warning('stream %s did not stop, killing it', stream.src_id)
+                        os.kill(stream.proc.pid, signal.SIGKILL)
+                elif stream.status == RUNNING and not stream.alive():
+                    if stream.proc.exitcode == 0:
+                        stream.status = STOPPED
+                        set_source_status(stream.src_id, False)
+                        stopped.append(stream.src_id)
+                    elif stream.restarts >= STREAM_MAX_RESTARTS:
+                        logging.error('stream %s crashed %d times, giving up',
+                                      stream.src_id, stream.restarts + 1)
+                        stream.status = FAILED
+                        set_source_status(stream.src_id, False)
+                        stopped.append(stream.src_id)
+                    else:
+                        stream.status = CRASHED
+                        stream.retry_at = now + 2 ** stream.restarts
+                        logging.warning('stream %s exited with %s, restarting in %ds', stream.src_id,
+                                        stream.proc.exitcode, 2 ** stream.restarts)
+                elif stream.status == CRASHED and now >= stream.retry_at:
+                    stream.restarts += 1
+                    stream.spawn()
+        for src_id in stopped:
+            purge_later(src_id)
+        save_streams(self.status())
+
+    def handle(self, conn):
+        """answer the requests of one client connection"""
+        try:
+            while True:
+                try:
+                    request = conn.recv()
+                except EOFError:
+                    return
+                command, args = request[0], request[1:]
+                try:
+                    if command not in COMMANDS:
+                        raise StreamError('unknown command %r' % (command,))
+                    conn.send(('ok', getattr(self, command)(*args)))
+                except StreamError as ex:
+                    conn.send(('error', str(ex)))
+                except Exception:
+                    conn.send(('error', traceback.format_exc()))
+        finally:
+            conn.close()
+
+    def serve(self, directory=STREAM_SUPERVISOR_DIR):
+        """accept clients on the socket in directory and supervise the streams until killed"""
+        address = os.path.join(private_dir(directory), SOCKET_FILE)
+        if os.path.exists(address):
+            os.remove(address)
+        listener = Listener(address, family='AF_UNIX', authkey=authkey(directory))
+        accept = threading.Thread(target=self.accept, args=(listener,))
+        accept.daemon = True
+        accept.start()
+        while True:
+            try:
+                self.check()
+            except Exception:
+                logging.error('stream check failed:\n%s', traceback.format_exc())
+            time.sleep(STREAM_CHECK_INTERVAL)
+
+    def accept(self, listener):
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as ex:
+                # e.g. a client with the wrong authkey
+                logging.warning('refused a stream supervisor client: %r', ex)
+                continue
+            handler = threading.Thread(target=self.handle, args=(conn,))
+            handler.daemon = True
+            handler.start()
+
+
+def private_dir(directory=STREAM_SUPERVISOR_DIR):
+    """directory, created readable by this user only. raises StreamError when it exists but
+    belongs to another user or others may enter it"""
+    try:
+        os.makedirs(directory, 0o700)
+    except OSError as ex:
+        if ex.errno != errno.EEXIST:
+            raise
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise StreamError('%s must be a directory of uid %d with mode 0700' % (directory, os.getuid()))
+    return directory
+
+
+def authkey(directory=STREAM_SUPERVISOR_DIR):
+    """the key supervisor and clients authenticate with, generated the first time it is needed"""
+    path = os.path.join(private_dir(directory), AUTHKEY_FILE)
+    if not os.path.exists(path):
+        tmp = '%s.%d' % (path, os.getpid())
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.write(fd, os.urandom(32))
+        finally:
+            os.close(fd)
+        try:
+            # link does not replace a key another process wrote in the meantime
+            os.link(tmp, path)
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+        finally:
+            os.remove(tmp)
+    with open(path, 'rb') as keyfile:
+        return keyfile.read()
+
+
+def set_source_status(src_id, status):
+    """mirror the state of a stream in the status field of its source for older ingest opals"""
+    from bedrock.dataloader.utils import set_status
+    set_status(src_id, status)
+
+
+def purge_later(src_id, delay=SEGMENT_RETIRE_SECONDS):
+    """delete the segments a stopped stream retired once no reader can hold them any more,
+    nothing compacts its matrices after it stopped appending"""
+    def purge():
+        from bedrock.dataloader.utils import purge_segments
+        try:
+            logging.info('purged %d retired segments of %s', purge_segments(src_id), src_id)
+        except Exception as ex:
+            logging.warning('could not purge the segments of %s: %s', src_id, ex)
+    timer = threading.Timer(delay, purge)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+def save_streams(infos):
+    """record the state of the streams of this host"""
+    col = db_client()[DATALOADER_DB_NAME][STREAMS_COL_NAME]
+    for info in infos:
+        col.update_one({'src_id': info['src_id']}, {'$set': info}, upsert=True)
+
+
+###################################################################################################
+# client side, used by the dataloader api
+
+def connect(directory=STREAM_SUPERVISOR_DIR, wait=5.0):
+    """connect to the supervisor of this host, starting it when it is not running"""
+    key = authkey(directory)
+    address = os.path.join(directory, SOCKET_FILE)
+    try:
+        return Client(address, family='AF_UNIX', authkey=key)
+    except (IOError, OSError, EOFError):
+        pass
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(path for path in sys.path if path)
+    subprocess.Popen([STREAM_PYTHON, '-m', 'bedrock.dataloader.streams'], env=env,
+                     close_fds=True, preexec_fn=os.setsid)
+    deadline = time.time() + wait
+    while True:
+        time.sleep(0.1)
+        try:
+            return Client(address, family='AF_UNIX', authkey=key)
+        except (IOError, OSError, EOFError):
+            if time.time() > deadline:
+                raise StreamError('could not reach the stream supervisor at %s' % address)
+
+
+def request(command, *args):
+    """send a command to the supervisor and return its answer, raises StreamError if it refuses"""
+    conn = connect()
+    try:
+        conn.send((command,) + args)
+        status, value = conn.recv()
+    finally:
+        conn.close()
+    if status != 'ok':
+        raise StreamError(value)
+    return value
+
+
+def start_stream(src_id, ingest_id, filepath):
+    """start streaming src_id, returns the state of the stream"""
+    return request('start', src_id, ingest_id, filepath)
+
+
+def stop_stream(src_id):
+    """ask the stream of src_id to stop, returns the state of the stream"""
+    return request('stop', src_id)
+
+
+def toggle_stream(src_id, ingest_id, filepath):
+    """stop the stream of src_id when it runs, start it otherwise"""
+    return request('toggle', src_id, ingest_id, filepath)
+
+
+def stream_status(src_id=None):
+    """the state of the stream of src_id, or of every stream on this host"""
+    return request('status', src_id)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    Supervisor().serve()
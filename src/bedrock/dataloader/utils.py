@@ -1,21 +1,87 @@
 
 
-import os, multiprocessing
+import os
+import hashlib
+import logging
+import shutil
+import time
 import numpy as np
+import pandas as pd
+import pymongo.errors
 import json
 import uuid
 from datetime import datetime
-import pymongo
-from bedrock.CONSTANTS import MONGO_HOST, MONGO_PORT, DATALOADER_COL_NAME, DATALOADER_DB_NAME, DATALOADER_PATH
-from bedrock.core.utils import get_class
+from bedrock.CONSTANTS import DATALOADER_COL_NAME, DATALOADER_DB_NAME, DATALOADER_PATH, \
+    EXPLORE_SAMPLE_ROWS, EXPLORE_EXAMPLES, EXPLORE_CACHE, FILTER_WORKERS, JOB_POLL_INTERVAL, \
+    JOB_WAIT_TIMEOUT
+from bedrock.core.db import db_client, db_collection, find_source, find_matrix, insert_matrices, \
+    matrices_collection, increment_field, toggle_field, BufferedCounter
+from bedrock.core import jobs, segments
+from bedrock.core.utils import get_class, resolve_class
+from bedrock.dataloader import streams
 import sys
 import traceback
 
+# extract filters of one matrix run in parallel as jobs of this queue
+FILTER_QUEUE = 'filters'
+
 def explore(ingest_id, filepath, filters):
     mod = get_class(ingest_id) #create the object specified
     mod.initialize_filters(filters)
     return mod.explore(filepath)
 
+def source_digest(filepath):
+    """digest of the names, sizes and mtimes of every file under filepath.
+    cheap enough to compute on every request, unlike hashing the contents of large uploads"""
+    listing = []
+    for root, _, files in os.walk(filepath):
+        for filename in files:
+            path = os.path.join(root, filename)
+            stat = os.stat(path)
+            listing.append([os.path.relpath(path, filepath), stat.st_size, stat.st_mtime])
+    listing.sort()
+    return hashlib.sha1(json.dumps(listing).encode('utf-8')).hexdigest()
+
+def explore_key(ingest_id, filepath, version):
+    """cache key of the explore result of a source"""
+    description = json.dumps([ingest_id, source_digest(filepath), version])
+    return hashlib.sha1(description.encode('utf-8')).hexdigest()
+
+def explore_cache_path(filepath):
+    """the cached explore result of the source whose uploads are in filepath, kept beside source/"""
+    return os.path.join(os.path.dirname(os.path.normpath(filepath)), 'explore.json')
+
+def cached_explore(ingest_id, filepath, filters, version):
+    """
+    explore with the result cached per source. the cache is keyed by the ingest module, a digest
+    of the files under filepath and the opal registry version, so it is dropped when the source
+    files change or filters are added or reloaded. filters is only read on a miss
+    """
+    if not EXPLORE_CACHE or not getattr(resolve_class(ingest_id), 'cacheable', True):
+        return explore(ingest_id, filepath, filters)
+    key = explore_key(ingest_id, filepath, version)
+    cachefile = explore_cache_path(filepath)
+    try:
+        with open(cachefile) as infile:
+            cached = json.load(infile)
+        if cached['key'] == key:
+            return cached['body'], cached['code']
+    except (OSError, IOError, ValueError, KeyError):
+        pass
+    result = explore(ingest_id, filepath, filters)
+    body, code = result if isinstance(result, tuple) else (result, 200)
+    if code == 200:
+        # some ingest modules convert their uploads while exploring, key by what they left behind
+        key = explore_key(ingest_id, filepath, version)
+        tmp = cachefile + '.%d.tmp' % os.getpid()
+        try:
+            with open(tmp, 'w') as outfile:
+                json.dump({'key': key, 'body': body, 'code': code}, outfile, default=str)
+            os.rename(tmp, cachefile)
+        except (OSError, IOError, TypeError, ValueError) as ex:
+            logging.warning('could not cache the explore result of %s: %s', filepath, ex)
+    return body, code
+
 def custom(ingest_id, filepath, param1=None, param2=None, param3=None, payload=None, request={}):
     mod = get_class(ingest_id)
     return mod.custom(filepath, param1=param1, param2=param2, param3=param3, payload=payload, request=request)
@@ -50,28 +116,69 @@ def get_metadata(id, api="ingest"):
     return metadata
 
 
-def ingest(posted_data, src):
+def ingest(posted_data, src, progress=None):
     mod = get_class(src['ingest_id'])
+    mod.progress_callback = progress
+    mod.report_progress(0.0, 'read')
     return mod.ingest(posted_data, src)
 
+def matrix_job(progress, src_id, posted_data):
+    """job target for POST /dataloader/sources/<src_id>/, generates the matrices and stores their metadata.
+    when another job took one of their names in the meantime nothing of them is kept"""
+    col = db_collection(db_client(), DATALOADER_DB_NAME, DATALOADER_COL_NAME)
+    src = find_source(col, src_id)
+    if src is None:
+        raise ValueError('No source %s' % src_id)
+    error, matrices = ingest(posted_data, src, progress=progress)
+    if error:
+        raise ValueError('Unable to create matrix from source %s' % src_id)
+    # the filters wrote the matrix files, what is left is recording them
+    progress(0.9, 'store')
+    unique_matrix_names(matrices)
+    try:
+        insert_matrices(col, src['src_id'], matrices)
+    except pymongo.errors.DuplicateKeyError:
+        matrices_collection(col).delete_many({'src_id': src['src_id'],
+                                              'id': {'$in': [matrix['id'] for matrix in matrices]}})
+        for matrix in matrices:
+            if matrix.get('rootdir'):
+                shutil.rmtree(matrix['rootdir'], ignore_errors=True)
+        raise ValueError('A matrix named %s already exists in source %s' % (
+            posted_data.get('matrixName'), src['src_id']))
+    return matrices
+
+def unique_matrix_names(matrices):
+    """several extract filters in one request share matrixName, keep names unique per source"""
+    for i, matrix in enumerate(matrices[1:], 2):
+        if matrix.get('name') == matrices[0].get('name'):
+            matrix['name'] = '%s_%d' % (matrix['name'], i)
+    return matrices
+
+def unused_matrix_name(col, src_id, name):
+    """name, or name with the first free _<n> suffix when source src_id already has a matrix called name"""
+    candidate, n = name, 2
+    while find_matrix(col, src_id, candidate) is not None:
+        candidate = '%s_%d' % (name, n)
+        n += 1
+    return candidate
+
 def delete(src):
     mod = get_class(src['ingest_id'])
     return mod.delete(src['rootdir'])
 
-def stream(ingest_id, filepath):#update for function
-    mod = get_class(ingest_id)
-    multiprocessing.Process(target=mod.stream, args=[filepath]).start()
-    return
+def stream(ingest_id, filepath):
+    """start streaming the source at filepath under the stream supervisor"""
+    src_id = filepath.rstrip('/').split('/')[-1]
+    return streams.start_stream(src_id, ingest_id, filepath)
 
-    # mod.stream(filepath)
-
-def update(ingest_id, filepath):#update for function
-    mod = get_class(ingest_id)
-    return mod.update(filepath)
+def update(ingest_id, filepath):
+    """toggle the stream of the source at filepath on or off"""
+    src_id = filepath.rstrip('/').split('/')[-1]
+    return streams.toggle_stream(src_id, ingest_id, filepath)
 
 def get_status(src_id, client=None):
     if not client:
-        client = pymongo.MongoClient(MONGO_HOST, MONGO_PORT)
+        client = db_client()
     col = client[DATALOADER_DB_NAME][DATALOADER_COL_NAME]
     try:
         status = col.find({'src_id':src_id})[0]['status']
@@ -80,19 +187,22 @@ def get_status(src_id, client=None):
         return False
 
 def update_status(src_id, client=None):
+    """atomically toggle the streaming status of a source, returns the new status"""
     if not client:
-        client = pymongo.MongoClient(MONGO_HOST, MONGO_PORT)
+        client = db_client()
     col = client[DATALOADER_DB_NAME][DATALOADER_COL_NAME]
-    try:
-        status = col.find({'src_id':src_id})[0]['status']
-        col.update({'src_id':src_id}, {'$set':{'status': not status}})
+    return toggle_field(col, {'src_id': src_id}, 'status')
 
-    except IndexError:
-        pass
+def set_status(src_id, status, client=None):
+    """set the streaming status of a source"""
+    if not client:
+        client = db_client()
+    col = client[DATALOADER_DB_NAME][DATALOADER_COL_NAME]
+    col.update_one({'src_id': src_id}, {'$set': {'status': status}})
 
 def get_count(src_id, client=None):
     if not client:
-        client = pymongo.MongoClient(MONGO_HOST, MONGO_PORT)
+        client = db_client()
     col = client[DATALOADER_DB_NAME][DATALOADER_COL_NAME]
     try:
         count = col.find({'src_id':src_id})[0]['count']
@@ -100,20 +210,50 @@ def get_count(src_id, client=None):
     except IndexError:
         return 0
 
-def increment_count(src_id, client=None):
+def increment_count(src_id, client=None, amount=1):
+    """atomically add amount to the record count of a source, returns the new count"""
     if not client:
-        client = pymongo.MongoClient(MONGO_HOST, MONGO_PORT)
+        client = db_client()
     col = client[DATALOADER_DB_NAME][DATALOADER_COL_NAME]
-    try:
-        count = col.find({'src_id':src_id})[0]['count']
-        col.update({'src_id':src_id}, {'$set':{'count': count+1}})
-        return count+1
-
-    except IndexError:
+    count = increment_field(col, {'src_id': src_id}, 'count', amount)
+    if count is None:
         return 0
+    streams.count_rows(amount)
+    return count
+
+# buffered record counters of the sources streamed by this process, keyed by src_id
+_counters = {}
+
+def count_buffered(src_id, amount=1):
+    """add amount to the record count of a source without a round trip per call.
+    increments are coalesced and written every COUNTER_FLUSH_COUNT records or
+    COUNTER_FLUSH_INTERVAL seconds, returns the estimated count"""
+    counter = _counters.get(src_id)
+    if counter is None:
+        col = db_client()[DATALOADER_DB_NAME][DATALOADER_COL_NAME]
+        counter = _counters.setdefault(src_id, BufferedCounter(col, {'src_id': src_id}, 'count'))
+    streams.count_rows(amount)
+    return counter.add(amount)
+
+def flush_counts():
+    """write every buffered record count of this process"""
+    for counter in list(_counters.values()):
+        counter.flush()
+
+def purge_segments(src_id, client=None):
+    """delete the expired retired segments of the matrices of a source, e.g. after its stream
+    stopped and nothing compacts them any more. returns the number of parts deleted"""
+    if not client:
+        client = db_client()
+    col = client[DATALOADER_DB_NAME][DATALOADER_COL_NAME]
+    purged = 0
+    for matrix in matrices_collection(col).find({'src_id': src_id}, {'rootdir': 1}):
+        if matrix.get('rootdir'):
+            purged += segments.purge_retired(matrix['rootdir'])
+    return purged
 
 def get_stash(src_id):
-    client = pymongo.MongoClient(MONGO_HOST, MONGO_PORT)
+    client = db_client()
     col = client[DATALOADER_DB_NAME][DATALOADER_COL_NAME]
     try:
         vis = col.find({'src_id':src_id})[0]['stash']
@@ -122,7 +262,7 @@ def get_stash(src_id):
         return []
 
 def set_stash(src_id, new):
-    client = pymongo.MongoClient(MONGO_HOST, MONGO_PORT)
+    client = db_client()
     col = client[DATALOADER_DB_NAME][DATALOADER_COL_NAME]
     try:
         vis = col.find({'src_id':src_id})[0]['stash']
@@ -152,43 +292,111 @@ def setUpDirectoryMatrix(src_id):
     os.makedirs(rootpath, 777)
     return rootpath, dirName
 
-def extractSchemaFromListOfJSON(samples):
-    #initialize return list
+def record_fields(samples):
+    """field names of a list of records, in the order they first appear"""
+    fields = []
+    seen = set()
+    for sample in samples:
+        for key in sample.keys():
+            if key not in seen:
+                seen.add(key)
+                fields.append(key)
+    return fields
+
+
+def parses_as_number(value):
+    try:
+        float(value)
+        return True
+    except (ValueError, TypeError):
+        return False
+
+
+def distinct_counts(frame, missing):
+    """number of distinct non missing values of every column of a sample frame"""
+    try:
+        counts = frame.nunique().values
+    except TypeError:
+        # lists or dicts nested in the records are not hashable
+        counts = np.array([frame[field].dropna().map(repr).nunique() for field in frame.columns])
+    # nunique already skips nulls but counts the empty string as a value
+    blanks = (frame.values == '').any(axis=0)
+    return (counts - blanks).astype(int)
+
+
+def profile_records(samples, limit=EXPLORE_SAMPLE_ROWS):
+    """
+    profile the fields of the first limit records in samples with vectorized passes over a 2d array
+    returns a DataFrame indexed by field name with the type, null ratio, distinct count, numeric
+    range and mean of every field. a field is Numeric when every value that is not missing parses
+    as a number
+    """
+    samples = samples[:limit]
+    fields = record_fields(samples)
+    frame = pd.DataFrame.from_records(samples, columns=fields)
+    values = frame.values.astype(object)
+    missing = pd.isnull(values) | (values == '')
+    numbers = np.full(values.shape, np.nan)
+    candidates = []
+    for i, dtype in enumerate(frame.dtypes):
+        if dtype.kind in 'iuf':
+            numbers[:, i] = frame.iloc[:, i].values
+        elif not missing[:, i].all() and parses_as_number(values[~missing[:, i], i][0]):
+            # a column whose first value is not a number can never be Numeric, only parse the others
+            candidates.append(i)
+    if candidates:
+        parsed = pd.to_numeric(values[:, candidates].ravel(), errors='coerce')
+        numbers[:, candidates] = parsed.reshape(len(values), len(candidates))
+    numbers[missing] = np.nan
+    parsed = ~np.isnan(numbers)
+    present = (~missing).sum(axis=0)
+    numeric = (parsed.sum(axis=0) == present) & (present > 0)
+    with np.errstate(invalid='ignore'):
+        low = np.nanmin(np.where(parsed, numbers, np.inf), axis=0)
+        high = np.nanmax(np.where(parsed, numbers, -np.inf), axis=0)
+        mean = np.nansum(numbers, axis=0) / np.maximum(parsed.sum(axis=0), 1)
+    profile = pd.DataFrame({
+        'type': np.where(numeric, 'Numeric', 'String'),
+        'nulls': missing.mean(axis=0) if len(samples) else np.zeros(len(fields)),
+        'cardinality': distinct_counts(frame, missing),
+        'min': low,
+        'max': high,
+        'mean': mean,
+    }, index=fields)
+    return profile, frame, missing
+
+
+def extractSchemaFromListOfJSON(samples, ingest=None):
+    """
+    schema of every field of a list of JSON records for explore. the types, null ratios,
+    cardinality estimates and ranges come from profile_records over a bounded sample, the
+    filter suggestions from ingest when given
+    """
+    if not samples:
+        return []
+    profile, frame, missing = profile_records(samples)
     schema = []
-    #extract the field names
-    fields = [x for x in samples[0].keys()]
-    #for each field
-    for i in range(len(fields)):
-        # represents a single column/field
+    for i, (key, row) in enumerate(zip(profile.index, profile.to_dict('records'))):
         field = {}
-        examples = []
-        for j in range(len(samples)):
-            #possible for a particular sample to have nonstandard fields
-            try:
-                val = samples[j][fields[i]]
-            except KeyError:
-                val = ''
-            examples.append((str(val)))
-        # see if the first example is numeric
-        try:
-            float(examples[0])
-            field['type'] = ['Numeric']
-        # must be string
-        except (ValueError,TypeError):
-            field['type'] = ['String']
-
-        #give it a label
-        field['key'] = field['key_usr'] = fields[i]
-        #set the examples
-        field['examples'] = examples
-        #set a fake range
-        field['range'] = [-1,-1]
-        #set some suggestions
-        field['suggestions'] = field['options'] = self.get_filters(field['type'][0])
-        field['suggestion'] = self.get_best_filter(field['type'][0], fields[i], examples[0])
-        #add to schema, then repeat for next column
+        field['type'] = [row['type']]
+        field['key'] = field['key_usr'] = key
+        field['examples'] = ['' if missing[j, i] else '%s' % (value,)
+                             for j, value in enumerate(frame[key].values[:EXPLORE_EXAMPLES])]
+        if row['type'] == 'Numeric':
+            field['range'] = [float(row['min']), float(row['max'])]
+            field['mean'] = float(row['mean'])
+        else:
+            field['range'] = [-1, -1]
+        field['nulls'] = round(float(row['nulls']), 4)
+        field['cardinality'] = int(row['cardinality'])
+        if ingest is not None:
+            field['suggestions'] = field['options'] = ingest.get_filters(row['type'])
+            field['suggestion'] = ingest.get_best_filter(row['type'], key, field['examples'][0])
+        else:
+            field['suggestions'] = field['options'] = []
+            field['suggestion'] = None
         schema.append(field)
-        return schema
+    return schema
 
 
 def check(filter_id, name, col):
@@ -200,6 +408,13 @@ def apply(filter_id, parameters, col):
     initialize(filt, parameters)
     return filt.apply(col)
 
+def filter_job(progress, filter_id, parameters, conf):
+    """apply one extract filter, the job target of the filters queue.
+    returns the matrix it produced and how long it took"""
+    started = time.time()
+    matrix = apply(filter_id, parameters, conf)
+    return {'matrix': matrix, 'seconds': round(time.time() - started, 3)}
+
 class Filter(object):
     def __init__(self):
         pass
@@ -229,13 +444,31 @@ class Filter(object):
         return self.possible_names
 
 class Ingest(object):
+    # set by ingest() when the matrix is generated by a job, called as progress_callback(fraction, stage)
+    progress_callback = None
+
     def __init__(self):
         pass
 
+    def report_progress(self, fraction, stage=None):
+        """tell the job generating the matrix how far along it is, a no-op outside of jobs"""
+        if self.progress_callback is not None:
+            self.progress_callback(fraction, stage)
+
     def update(self, rootpath):
         src_id = rootpath.split('/')[-2]
         update_status(src_id)
 
+    def streaming(self):
+        """False once the supervisor has asked the stream running in this process to stop.
+        stream() implementations should check this instead of polling get_status"""
+        return streams.streaming()
+
+    def count_rows(self, src_id, count=1):
+        """report count newly ingested rows of src_id. the record count of the source is
+        updated in buffered batches and the supervisor turns the rows into rows/s"""
+        return count_buffered(src_id, count)
+
     def initialize(self, conf_filepath):
         with open(conf_filepath) as json_data:
             data = json.loads(json_data.read())
@@ -246,6 +479,10 @@ class Ingest(object):
     def explore(self, filepath):
         return {}, 200
 
+    def schema_from_records(self, samples):
+        """explore schema of a list of JSON records with the filters of this ingest module"""
+        return extractSchemaFromListOfJSON(samples, self)
+
     def ingest(self, posted_data, src):
         return False, []
 
@@ -286,25 +523,79 @@ class Ingest(object):
         except KeyError:
             matrixFilters = {}
 
+        extracts = []
         for field, filt in matrixFilters.items():
             if len(filt) > 0:
                 if filt['stage'] == 'before':
                     if filt['type'] == 'extract':
                         #create new matrix metadata
-                        conf['mat_id'] = getNewId()
-                        conf['storepath'] = src['rootdir'] + conf['mat_id'] + '/'
-                        conf['src_id'] = src['src_id']
-                        conf['name'] = posted_data['matrixName']
-                        val = self.apply_filter(filt['filter_id'], filt['parameters'], conf)
-                        if val != None:
-                            matrices.append( val )
-                        matrixFilters.pop(field, None)
+                        fconf = dict(conf)
+                        fconf['mat_id'] = getNewId()
+                        fconf['storepath'] = src['rootdir'] + fconf['mat_id'] + '/'
+                        fconf['src_id'] = src['src_id']
+                        fconf['name'] = posted_data['matrixName']
+                        extracts.append((field, filt, fconf))
                     elif filt['type'] == 'convert':
                         pass
                     elif filt['type'] == 'add':
                         pass
+        for field, filt, fconf in extracts:
+            matrixFilters.pop(field, None)
+
+        # the extract filters of different fields do not depend on each other, run them side by side
+        if len(extracts) > 1 and FILTER_WORKERS > 1 and not self.overrides('apply_filter'):
+            timed = self.apply_filters_parallel(extracts)
+        else:
+            timed = []
+            for done, (field, filt, fconf) in enumerate(extracts):
+                self.report_progress(0.1 + 0.8 * done / len(extracts), 'filter')
+                started = time.time()
+                val = self.apply_filter(filt['filter_id'], filt['parameters'], fconf)
+                timed.append({'matrix': val, 'seconds': round(time.time() - started, 3)})
+        for (field, filt, fconf), result in zip(extracts, timed):
+            val = result['matrix']
+            if val != None:
+                if isinstance(val, dict):
+                    val['filter'] = {'field': field, 'filter_id': filt['filter_id'],
+                                     'seconds': result['seconds']}
+                matrices.append( val )
         return matrices, matrixFilters
 
+    def overrides(self, name):
+        """True when the ingest module replaces the method name of Ingest"""
+        mine = getattr(type(self), name)
+        return getattr(mine, '__func__', mine) is not getattr(Ingest.__dict__[name], '__func__', Ingest.__dict__[name])
+
+    def apply_filters_parallel(self, extracts, poll=JOB_POLL_INTERVAL, timeout=JOB_WAIT_TIMEOUT):
+        """run (field, filter, conf) extracts as jobs on the filters queue and wait for all of them,
+        at most timeout seconds. returns their timed results in the order of extracts"""
+        job_ids = [jobs.submit_job(FILTER_QUEUE, 'bedrock.dataloader.utils.filter_job',
+                                   {'filter_id': filt['filter_id'], 'parameters': filt['parameters'],
+                                    'conf': fconf},
+                                   meta={'src_id': fconf['src_id'], 'field': field})['job_id']
+                   for field, filt, fconf in extracts]
+        results = {}
+        deadline = time.time() + timeout
+        while len(results) < len(job_ids):
+            if time.time() > deadline:
+                for job_id in job_ids:
+                    jobs.fail_job(job_id, 'gave up waiting after %d seconds' % timeout)
+                raise RuntimeError('filter jobs did not finish within %d seconds' % timeout)
+            for job_id in job_ids:
+                if job_id in results:
+                    continue
+                job = jobs.get_job(job_id)
+                if job is None:
+                    raise RuntimeError('filter job %s disappeared' % job_id)
+                if job['status'] == jobs.FAILED:
+                    raise RuntimeError('filter job %s failed:\n%s' % (job_id, job['error']))
+                if job['status'] == jobs.DONE:
+                    results[job_id] = job['result']
+            self.report_progress(0.1 + 0.8 * len(results) / len(job_ids), 'filter')
+            if len(results) < len(job_ids):
+                time.sleep(poll)
+        return [results[job_id] for job_id in job_ids]
+
     def apply_after_filters(self, maps, posted_data, matrices):
         # for i, feature in enumerate(posted_data['matrixFeaturesOriginal']):
         #     if len(posted_data['matrixFilters'][feature]) > 0: # filters were selected
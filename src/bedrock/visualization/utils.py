@@ -1,8 +1,9 @@
+import os
 import numpy as np
 import pandas as pd
 import uuid
-from scipy.io import mmread
-from scipy.sparse import csc_matrix
+from bedrock.core import matrixcache, segments, sparse
+from bedrock.core.io import read_columnar
 from bedrock.core.utils import get_class
 
 def get_new_id():
@@ -18,6 +19,18 @@ def load_features(features_filepath):
     return features_loaded
 
 def load_dense_matrix(filepath, **kwargs):
+    rootpath, filename = os.path.split(filepath)
+    matrix = None
+    if filename == 'matrix.csv':
+        matrix = matrixcache.load_frame(rootpath, kwargs.get('names'))
+        if matrix is None:
+            matrix = read_columnar(rootpath, kwargs.get('names'))
+        if matrix is None:
+            matrix = segments.load_segments(rootpath, kwargs.get('names'))
+    if matrix is not None:
+        if 'names' not in kwargs:
+            matrix.columns = ['Feature ' + str(x + 1) for x in list(matrix.columns)]
+        return matrix
     if 'names' in kwargs:
         return pd.read_csv(filepath, names=kwargs['names'])
     else:
@@ -31,7 +44,8 @@ def load_json(filepath):
         return res.read()
 
 def load_sparse_matrix(filepath):
-    return csc_matrix(mmread(filepath))
+    """the MatrixMarket file at filepath as a csc matrix, from its memory mapped binary copy"""
+    return sparse.load_sparse(filepath, 'csc')
 
 
 def initialize(vis, options):
@@ -14,8 +14,7 @@ import traceback
 from datetime import datetime
 from multiprocessing import Process, Queue
 
-import pymongo
-from pymongo import MongoClient
+from bson.errors import InvalidId
 from bson.objectid import ObjectId
 from bson.json_util import dumps
 from flask import (Flask, Response, abort, g, jsonify, redirect, request,
@@ -26,14 +25,18 @@ from werkzeug import secure_filename
 import logging
 
 import utils
-from bedrock.CONSTANTS import MONGO_HOST, MONGO_PORT, ANALYTICS_DB_NAME, ANALYTICS_COL_NAME, ANALYTICS_OPALS
+from bedrock.CONSTANTS import ANALYTICS_DB_NAME, ANALYTICS_COL_NAME, ANALYTICS_OPALS
 from bedrock.core.db import drop_id_key, serialize_id_key, db_client
 from bedrock.CONSTANTS import RESULTS_COL_NAME, RESULTS_PATH
+from bedrock.CONSTANTS import WORKFLOW_DB_NAME, WORKFLOW_COL_NAME, WORKFLOW_RUNNERS, WORKFLOW_WORKERS, \
+    FILTER_WORKERS
+from bedrock.core.jobs import start_workers, get_job, QueueFull
+from bedrock.dataloader.utils import FILTER_QUEUE
 from bedrock.core.exceptions import asserttype, InvalidUsage
 import bedrock.client.workflow as flow
 
-flowdb = 'flows'
-flowcol = 'flows'
+flowdb = WORKFLOW_DB_NAME
+flowcol = WORKFLOW_COL_NAME
 ALLOWED_EXTENSIONS = ['py']
 
 app = Flask(__name__)
@@ -53,12 +56,6 @@ api = Api(
 )
 
 
-@app.teardown_appcontext
-def teardown_db(exception):
-    """closes the database connection"""
-    db = getattr(g, '_mongodb', None)
-    if db is not None:
-        db.close()
 ###################################################################################################
 
 def newresp(req, uid):
@@ -105,6 +102,26 @@ class Flow(Resource):
             resp['mesg'] = 'Could not create workflow %s:\n %s'%(uid, ex)
             return resp, 500
         return resp, 201
+    def put(self, uid):
+        """
+        Replace the stored workflow uid. The outputs of its last runs are kept, so the next run only
+        executes the nodes that changed and the nodes downstream of them.
+        """
+        resp = newresp(request, uid)
+        client = db_client()
+        body = request.get_json()
+        body.pop('_id', None)
+        try:
+            res = client[flowdb][flowcol].replace_one({'_id': ObjectId(uid)}, body)
+        except InvalidId:
+            return 'No such object %s'%uid, 404
+        except Exception as ex:
+            resp['mesg'] = 'Could not update workflow %s:\n %s'%(uid, ex)
+            return resp, 500
+        if res.matched_count == 0:
+            return 'No such object %s'%uid, 404
+        resp['mesg'] = 'Succesfully updated workflow'
+        return resp, 200
     def delete(self, uid):
         resp = newresp(request, uid)
         client = db_client()
@@ -112,10 +129,67 @@ class Flow(Resource):
         resp['mesg'] = 'Removing %s'%uid
         try:
             client.flows.flows.remove({'_id': ObjectId(uid)})
+            utils.delete_outputs(uid)
         except Exception as ex:
             print("exception in deletion of workflow:\n", ex)
             resp['error'] = "failed to delete %s\n%s" % (uid, ex )
             return resp, 500
         return resp, 200
-        
 
+
+@api.route('/<uid>/run')
+class Run(Resource):
+    """Runs a stored workflow on the server"""
+    def post(self, uid):
+        """
+        Start a run of the workflow uid. Nodes run as soon as the bundles they read are filled,
+        independent nodes run concurrently. Nodes whose opalclass, parameters and inputs did not
+        change since their last run reuse its outputs, pass ?force=true to run every node again.
+        Returns 202 with the run_id, the run status is at /<uid>/runs/<run_id>.
+        """
+        resp = newresp(request, uid)
+        try:
+            workflow = db_client()[flowdb][flowcol].find_one({'_id': ObjectId(uid)})
+        except InvalidId:
+            workflow = None
+        if workflow is None:
+            return 'No such object %s'%uid, 404
+        try:
+            force = request.args.get('force', 'false').lower() in ['true', '1', 'yes']
+            run = utils.start_run(uid, serialize_id_key(workflow), force=force)
+        except (ValueError, KeyError, TypeError) as ex:
+            resp['mesg'] = 'Invalid workflow %s: %s'%(uid, ex)
+            return resp, 400
+        except QueueFull as ex:
+            resp['mesg'] = str(ex)
+            return resp, 503
+        start_workers(utils.RUN_QUEUE, WORKFLOW_RUNNERS)
+        start_workers(utils.NODE_QUEUE, WORKFLOW_WORKERS)
+        start_workers(FILTER_QUEUE, FILTER_WORKERS)
+        resp['mesg'] = 'Started run %s of workflow %s'%(run['run_id'], uid)
+        resp['run'] = run
+        return resp, 202, {'Location': '%s/%s/runs/%s'%(request.script_root, uid, run['run_id'])}
+
+@api.route('/<uid>/runs')
+class Runs(Resource):
+    def get(self, uid):
+        """List the runs of the workflow uid, newest first"""
+        resp = newresp(request, uid)
+        resp['runs'] = utils.list_runs(uid)
+        return resp
+
+@api.route('/<uid>/runs/<run_id>')
+class RunStatus(Resource):
+    def get(self, uid, run_id):
+        """
+        Status of a workflow run: the state, job and outputs of every node, the bundles filled so
+        far and the fraction of nodes finished in progress.
+        """
+        run = utils.get_run(run_id)
+        if run is None or run['workflow_id'] != uid:
+            return 'No such run %s'%run_id, 404
+        job = get_job(run['job_id'])
+        run['progress'] = job['progress'] if job is not None else None
+        resp = newresp(request, uid)
+        resp['run'] = run
+        return resp
@@ -4,9 +4,23 @@ from __future__ import print_function
 import csv
 from datetime import datetime
 from importlib import import_module
+import logging
+import operator
 import os
+import shutil
+import time
+import traceback
 import uuid
+import pymongo
+from bson import json_util
 from bedrock.CONSTANTS import MONGO_HOST, MONGO_PORT, ANALYTICS_COL_NAME, ANALYTICS_DB_NAME, ANALYTICS_OPALS
+from bedrock.CONSTANTS import DATALOADER_DB_NAME, DATALOADER_COL_NAME, INGEST_COL_NAME, RESULTS_PATH, \
+    VIS_DB_NAME, VIS_COL_NAME, WORKFLOW_DB_NAME, WORKFLOW_RUNS_COL_NAME, WORKFLOW_OUTPUTS_COL_NAME, \
+    WORKFLOW_MAX_PARALLEL, WORKFLOW_QUEUE_DEPTH, JOB_POLL_INTERVAL, JOB_WAIT_TIMEOUT, MATRIX_BINARY
+from bedrock.client.workflow import fingerprints, is_bundle
+from bedrock.core import jobs
+from bedrock.core.db import db_client, find_matrix, find_source, insert_matrices
+from bedrock.core.io import write_columnar
 from bedrock.core.utils import get_class
 # import numpy as np
 # import pandas as pd
@@ -36,3 +50,506 @@ def get_metadata(analytic_id):
     metadata['outputs'] = alg.get_outputs()
     metadata['type'] = alg.get_type()
     return metadata
+
+
+###################################################################################################
+# server side execution of stored workflows
+#
+# A workflow is a list of nodes wired together through bundles. Node inputs and outputs map names
+# to indices into the bundles list, a bundle that holds a value before the run starts is an input
+# of the whole workflow. Each run is an orchestrator job on the 'workflows' queue that submits
+# every node whose inputs have landed as a job on the 'workflow_nodes' queue, at most
+# WORKFLOW_MAX_PARALLEL at a time, and records the state of every node in the runs collection.
+# Bundles and node outputs are kept there as extended JSON text since they are keyed by filenames.
+#
+# The outputs of the last successful run of every node are kept with the fingerprint of the node,
+# a later run of the same workflow reuses them when the fingerprint has not changed.
+
+RUN_QUEUE = 'workflows'
+NODE_QUEUE = 'workflow_nodes'
+
+WAITING = 'waiting'
+SKIPPED = 'skipped'
+REUSED = 'reused'
+
+# (database, collection, id key, node kind) of the registries a node opalclass is looked up in
+NODE_KINDS = [(DATALOADER_DB_NAME, INGEST_COL_NAME, 'ingest_id', 'ingest'),
+              (ANALYTICS_DB_NAME, ANALYTICS_COL_NAME, 'analytic_id', 'analytic'),
+              (VIS_DB_NAME, VIS_COL_NAME, 'vis_id', 'visualization')]
+
+# opalclass of the built in node that keeps the rows of a matrix matching a condition
+FILTER_NODE = 'filter'
+COMPARATORS = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le,
+               '==': operator.eq, '!=': operator.ne}
+
+_indexed = set()
+
+
+def runs_collection():
+    """return the workflow runs collection, creating its indexes once per process"""
+    col = db_client()[WORKFLOW_DB_NAME][WORKFLOW_RUNS_COL_NAME]
+    if WORKFLOW_RUNS_COL_NAME not in _indexed:
+        col.create_index('run_id', unique=True)
+        col.create_index('workflow_id')
+        _indexed.add(WORKFLOW_RUNS_COL_NAME)
+    return col
+
+
+def outputs_collection():
+    """return the collection of the last outputs of every workflow node, creating its indexes once per process"""
+    col = db_client()[WORKFLOW_DB_NAME][WORKFLOW_OUTPUTS_COL_NAME]
+    if WORKFLOW_OUTPUTS_COL_NAME not in _indexed:
+        col.create_index([('workflow_id', pymongo.ASCENDING), ('head', pymongo.ASCENDING)], unique=True)
+        _indexed.add(WORKFLOW_OUTPUTS_COL_NAME)
+    return col
+
+
+def save_outputs(workflow_id, head, fingerprint, outputs, run_id):
+    """remember the outputs of a node run so an unchanged node can reuse them"""
+    outputs_collection().update_one({'workflow_id': workflow_id, 'head': head}, {'$set': {
+        'fingerprint': fingerprint,
+        'outputs': json_util.dumps(outputs),
+        'run_id': run_id,
+        'finished': getCurrentTime()
+    }}, upsert=True)
+
+
+def delete_outputs(workflow_id):
+    """forget the stored node outputs of a workflow"""
+    outputs_collection().delete_many({'workflow_id': workflow_id})
+
+
+def outputs_exist(outputs):
+    """False when a matrix or result referenced by outputs has been removed from disk"""
+    if isinstance(outputs, dict):
+        if 'rootdir' in outputs and not os.path.isdir(outputs['rootdir']):
+            return False
+        return all(outputs_exist(value) for value in outputs.values())
+    if isinstance(outputs, list):
+        return all(outputs_exist(value) for value in outputs)
+    return True
+
+
+def reusable_outputs(workflow_id, workflow, deps, order, prints):
+    """the stored outputs of every node that does not need to run again, keyed by head.
+    a node is reused when its fingerprint is unchanged, its outputs still exist and every node
+    it depends on is reused as well"""
+    stored = dict((doc['head'], doc) for doc in outputs_collection().find({'workflow_id': workflow_id}))
+    nodes = dict((node['head'], node) for node in workflow['nodes'])
+    reuse = {}
+    for head in order:
+        doc = stored.get(head)
+        if doc is None or doc['fingerprint'] != prints[head]:
+            continue
+        if not all(dep in reuse for dep in deps[head]):
+            continue
+        outputs = json_util.loads(doc['outputs'])
+        if all(name in outputs for name in nodes[head]['outputs']) and outputs_exist(outputs):
+            reuse[head] = outputs
+    return reuse
+
+
+def workflow_graph(workflow):
+    """the heads of the nodes each node of workflow depends on, keyed by head.
+    raises ValueError when heads repeat, a bundle has two producers or an input can never resolve"""
+    nodes = workflow['nodes']
+    bundles = workflow.get('bundles') or []
+    heads = [node['head'] for node in nodes]
+    if len(set(heads)) != len(heads):
+        raise ValueError('node heads must be unique within a workflow')
+    producers = {}
+    for node in nodes:
+        for name, bundle in node['outputs'].items():
+            if not is_bundle(bundle, bundles):
+                raise ValueError('output %s of %s is not a bundle index' % (name, node['head']))
+            if bundle in producers:
+                raise ValueError('bundle %d is produced by both %s and %s'
+                                 % (bundle, producers[bundle], node['head']))
+            producers[bundle] = node['head']
+    deps = {}
+    for node in nodes:
+        deps[node['head']] = set()
+        for name, value in node['inputs'].items():
+            if not is_bundle(value, bundles):
+                continue
+            if value in producers:
+                deps[node['head']].add(producers[value])
+            elif not bundles[value]:
+                raise ValueError('input %s of %s reads bundle %d which no node produces'
+                                 % (name, node['head'], value))
+    return deps
+
+
+def topological_order(heads, deps):
+    """order heads so that every node comes after the nodes it depends on, ties keep list order.
+    raises ValueError when the workflow has a cycle"""
+    dependents = dict((head, []) for head in heads)
+    waiting = dict((head, len(deps[head])) for head in heads)
+    for head in heads:
+        for dep in deps[head]:
+            dependents[dep].append(head)
+    ready = [head for head in heads if not waiting[head]]
+    order = []
+    while ready:
+        head = ready.pop(0)
+        order.append(head)
+        for other in dependents[head]:
+            waiting[other] -= 1
+            if not waiting[other]:
+                ready.append(other)
+    if len(order) != len(heads):
+        raise ValueError('workflow has a cycle through %s'
+                         % ', '.join(head for head in heads if waiting[head]))
+    return order
+
+
+def resolve_inputs(node, bundles):
+    """the inputs of node with bundle indices replaced by the values that landed in them"""
+    return dict((name, bundles[value] if is_bundle(value, bundles) else value)
+                for name, value in node['inputs'].items())
+
+
+def workflow_order(workflow):
+    """the dependencies of every node and an order to run them in, raises ValueError if there is none"""
+    deps = workflow_graph(workflow)
+    return deps, topological_order([node['head'] for node in workflow['nodes']], deps)
+
+
+def start_run(workflow_id, workflow, force=False):
+    """validate a stored workflow and queue a run of it, returns the new run.
+    unchanged nodes reuse the outputs of their last run unless force is set.
+    raises ValueError for malformed workflows and jobs.QueueFull when too many runs are pending"""
+    workflow_order(workflow)
+    bundles = workflow.get('bundles') or []
+    produced = set(bundle for node in workflow['nodes'] for bundle in node['outputs'].values())
+    for node in workflow['nodes']:
+        if node_kind(node['meta']['opalclass']) == 'ingest':
+            ingest_source(node, bundles, produced)
+    prints = fingerprints(workflow)
+    run_id = getNewId()
+    run = {
+        'run_id': run_id,
+        'workflow_id': workflow_id,
+        'job_id': None,
+        'status': jobs.QUEUED,
+        'bundles': json_util.dumps(workflow.get('bundles') or []),
+        'nodes': [{'head': node['head'], 'fingerprint': prints[node['head']], 'status': WAITING,
+                   'job_id': None, 'outputs': None, 'error': None, 'started': None, 'finished': None}
+                  for node in workflow['nodes']],
+        'created': getCurrentTime(),
+        'finished': None,
+    }
+    col = runs_collection()
+    col.insert_one(dict(run))
+    try:
+        job = jobs.submit_job(RUN_QUEUE, 'bedrock.workflow.utils.run_workflow',
+                              {'run_id': run_id, 'workflow_id': workflow_id, 'workflow': workflow,
+                               'force': force},
+                              max_depth=WORKFLOW_QUEUE_DEPTH,
+                              meta={'run_id': run_id, 'workflow_id': workflow_id}, attempts=1)
+    except jobs.QueueFull:
+        col.delete_one({'run_id': run_id})
+        raise
+    col.update_one({'run_id': run_id}, {'$set': {'job_id': job['job_id']}})
+    run['job_id'] = job['job_id']
+    return decode_run(run)
+
+
+def get_run(run_id):
+    """find a run by id, None if there is no such run"""
+    return decode_run(runs_collection().find_one({'run_id': run_id}, {'_id': 0}))
+
+
+def decode_run(run):
+    """turn the stored bundles and node outputs of a run back into python values"""
+    if run is not None:
+        if run.get('bundles') is not None:
+            run['bundles'] = json_util.loads(run['bundles'])
+        for node in run['nodes']:
+            if node.get('outputs') is not None:
+                node['outputs'] = json_util.loads(node['outputs'])
+    return run
+
+
+def list_runs(workflow_id):
+    """the runs of a workflow, newest first"""
+    cur = runs_collection().find({'workflow_id': workflow_id}, {'_id': 0, 'bundles': 0})
+    return [decode_run(run) for run in cur.sort('_id', pymongo.DESCENDING)]
+
+
+def update_node(col, run_id, index, update):
+    """record the state of the node at index in the run"""
+    col.update_one({'run_id': run_id},
+                   {'$set': dict(('nodes.%d.%s' % (index, key), value) for key, value in update.items())})
+
+
+def run_workflow(progress, run_id, workflow_id, workflow, force=False,
+                 max_parallel=WORKFLOW_MAX_PARALLEL, poll=JOB_POLL_INTERVAL, timeout=JOB_WAIT_TIMEOUT):
+    """job target of a workflow run, runs independent nodes concurrently as node jobs"""
+    col = runs_collection()
+    try:
+        status, bundles = execute(progress, col, run_id, workflow_id, workflow, force, max_parallel, poll,
+                                  timeout)
+    except Exception:
+        col.update_one({'run_id': run_id}, {'$set': {
+            'status': jobs.FAILED, 'error': traceback.format_exc(), 'finished': getCurrentTime()}})
+        raise
+    col.update_one({'run_id': run_id}, {'$set': {
+        'status': status, 'bundles': json_util.dumps(bundles), 'finished': getCurrentTime()}})
+    if status == jobs.FAILED:
+        raise RuntimeError('workflow run %s had failing nodes' % run_id)
+    return {'run_id': run_id, 'status': status, 'bundles': bundles}
+
+
+def execute(progress, col, run_id, workflow_id, workflow, force, max_parallel, poll, timeout=JOB_WAIT_TIMEOUT):
+    """schedule the nodes of workflow as their inputs land, returns the final status and bundles.
+    node jobs still running after timeout seconds are failed and nothing new is started"""
+    deps, order = workflow_order(workflow)
+    prints = fingerprints(workflow)
+    index = dict((node['head'], i) for i, node in enumerate(workflow['nodes']))
+    nodes = dict((node['head'], node) for node in workflow['nodes'])
+    bundles = list(workflow.get('bundles') or [])
+    state = dict((head, WAITING) for head in order)
+    running = {}
+    col.update_one({'run_id': run_id}, {'$set': {'status': jobs.RUNNING, 'started': getCurrentTime()}})
+    reuse = {} if force else reusable_outputs(workflow_id, workflow, deps, order, prints)
+    for head in order:
+        if head in reuse:
+            for name, bundle in nodes[head]['outputs'].items():
+                bundles[bundle] = reuse[head][name]
+            state[head] = jobs.DONE
+            update_node(col, run_id, index[head], {
+                'status': REUSED, 'outputs': json_util.dumps(reuse[head]), 'finished': getCurrentTime()})
+    if reuse:
+        logging.info('run %s reuses %s', run_id, ', '.join(sorted(reuse)))
+        col.update_one({'run_id': run_id}, {'$set': {'bundles': json_util.dumps(bundles)}})
+    deadline = time.time() + timeout
+    while running or WAITING in state.values():
+        if time.time() > deadline:
+            for head in order:
+                if state[head] == WAITING:
+                    state[head] = SKIPPED
+                    update_node(col, run_id, index[head], {'status': SKIPPED})
+            for job_id in running.values():
+                jobs.fail_job(job_id, 'gave up waiting after %d seconds' % timeout)
+        # start every node whose dependencies are done, skip those behind a failure
+        for head in order:
+            if state[head] != WAITING:
+                continue
+            if any(state[dep] in (jobs.FAILED, SKIPPED) for dep in deps[head]):
+                state[head] = SKIPPED
+                update_node(col, run_id, index[head], {'status': SKIPPED})
+            elif len(running) < max_parallel and all(state[dep] == jobs.DONE for dep in deps[head]):
+                job = jobs.submit_job(NODE_QUEUE, 'bedrock.workflow.utils.node_job',
+                                      {'node': nodes[head], 'inputs': resolve_inputs(nodes[head], bundles)},
+                                      meta={'run_id': run_id, 'head': head})
+                running[head] = job['job_id']
+                state[head] = jobs.RUNNING
+                update_node(col, run_id, index[head], {
+                    'status': jobs.RUNNING, 'job_id': job['job_id'], 'started': getCurrentTime()})
+        # collect the nodes that finished and put their outputs in their bundles
+        for head, job_id in list(running.items()):
+            job = jobs.get_job(job_id)
+            if job is not None and job['status'] in jobs.PENDING:
+                continue
+            del running[head]
+            outputs = job['result'] if job is not None and job['status'] == jobs.DONE else None
+            missing = [name for name in nodes[head]['outputs'] if name not in (outputs or {})]
+            if outputs is not None and not missing:
+                for name, bundle in nodes[head]['outputs'].items():
+                    bundles[bundle] = outputs[name]
+                state[head] = jobs.DONE
+                update_node(col, run_id, index[head], {
+                    'status': jobs.DONE, 'outputs': json_util.dumps(outputs), 'finished': getCurrentTime()})
+                save_outputs(workflow_id, head, prints[head], outputs, run_id)
+                col.update_one({'run_id': run_id}, {'$set': {'bundles': json_util.dumps(bundles)}})
+            else:
+                if job is None:
+                    error = 'node job %s disappeared' % job_id
+                elif outputs is None:
+                    error = job['error']
+                else:
+                    error = '%s did not produce %s' % (head, ', '.join(missing))
+                state[head] = jobs.FAILED
+                update_node(col, run_id, index[head], {
+                    'status': jobs.FAILED, 'error': error, 'finished': getCurrentTime()})
+        finished = len([head for head in order if state[head] not in (WAITING, jobs.RUNNING)])
+        progress(float(finished) / len(order) if order else 1.0, ', '.join(sorted(running)))
+        if running:
+            time.sleep(poll)
+    status = jobs.DONE if all(value == jobs.DONE for value in state.values()) else jobs.FAILED
+    return status, bundles
+
+
+def node_kind(opalclass):
+    """which registry the opal of a node belongs to, or filter for the built in filter node"""
+    if opalclass == FILTER_NODE:
+        return 'filter'
+    client = db_client()
+    for db, col, key, kind in NODE_KINDS:
+        if client[db][col].find_one({key: opalclass}, {'_id': 1}) is not None:
+            return kind
+    raise ValueError('%s is not a registered ingest, analytic or visualization, nor %s'
+                     % (opalclass, FILTER_NODE))
+
+
+def node_job(progress, node, inputs):
+    """job target of a single workflow node, returns its outputs keyed by output name"""
+    opalclass = node['meta']['opalclass']
+    kind = node_kind(opalclass)
+    logging.info('running %s node %s (%s)', kind, node['head'], opalclass)
+    return NODE_RUNNERS[kind](progress, node, inputs)
+
+
+def ingest_source(node, bundles, produced):
+    """the source an ingest node reads, named by id or name in its src_id input or parameter.
+    None when the src_id input is the output of another node and only known once it ran.
+    raises ValueError when the node names no source or a source that does not exist"""
+    value = node['inputs'].get('src_id')
+    if is_bundle(value, bundles):
+        if value in produced:
+            return None
+        value = bundles[value]
+    parameters = node['meta'].get('parameters') or {}
+    src_id = value or (parameters.get('src_id') if isinstance(parameters, dict) else None)
+    if not src_id:
+        raise ValueError('ingest node %s needs a src_id input or parameter naming an uploaded source'
+                         % node['head'])
+    source = find_source(db_client()[DATALOADER_DB_NAME][DATALOADER_COL_NAME], src_id)
+    if source is None:
+        raise ValueError('ingest node %s reads source %s which does not exist' % (node['head'], src_id))
+    return source
+
+
+def run_ingest_node(progress, node, inputs):
+    """make matrices from a source. the meta parameters are the body of POST /dataloader/sources/<src_id>/,
+    the source comes from the src_id input or parameter, by id or name. every run makes new matrices,
+    a matrixName the source already has gets a _<n> suffix. outputs src_id, matrix_id, matrix and matrices"""
+    import bedrock.dataloader.utils
+    parameters = dict(node['meta'].get('parameters') or {})
+    name = inputs.get('src_id') or parameters.pop('src_id', None)
+    col = db_client()[DATALOADER_DB_NAME][DATALOADER_COL_NAME]
+    source = find_source(col, name) if name else None
+    if source is None:
+        raise ValueError('ingest node %s reads source %s which does not exist' % (node['head'], name))
+    src_id = source['src_id']
+    parameters['matrixName'] = bedrock.dataloader.utils.unused_matrix_name(
+        col, src_id, parameters.get('matrixName') or node['head'])
+    matrices = bedrock.dataloader.utils.matrix_job(progress, src_id, parameters)
+    if not matrices:
+        raise ValueError('source %s did not produce a matrix for node %s' % (src_id, node['head']))
+    return {'src_id': src_id, 'matrix_id': matrices[0]['id'],
+            'matrix': matrices[0], 'matrices': matrices}
+
+
+def input_matrix(inputs):
+    """the matrix a node reads, either the matrix input or the matrix_id input of source src_id"""
+    if isinstance(inputs.get('matrix'), dict):
+        return inputs['matrix']
+    col = db_client()[DATALOADER_DB_NAME][DATALOADER_COL_NAME]
+    matrix = find_matrix(col, inputs['src_id'], inputs['matrix_id'])
+    if matrix is None:
+        raise ValueError('no matrix %s in source %s' % (inputs['matrix_id'], inputs['src_id']))
+    return matrix
+
+
+def run_filter_node(progress, node, inputs):
+    """keep the rows of a matrix where colname compares to value, e.g. {'colname': 'num_neighbors',
+    'comparator': '>', 'value': 0}. the rows are stored as a new matrix of the same source with
+    the features and label mappings of the input. outputs src_id, matrix_id, matrix and matrices"""
+    import bedrock.analytics.utils
+    from bedrock.dataloader.utils import unused_matrix_name
+    parameters = node['meta'].get('parameters') or {}
+    compare = COMPARATORS.get(parameters.get('comparator'))
+    if compare is None:
+        raise ValueError('filter node %s needs a comparator out of %s' % (node['head'], ', '.join(sorted(COMPARATORS))))
+    matrix = input_matrix(inputs)
+    rootdir = matrix['rootdir']
+    progress(0.0, 'read')
+    features = []
+    for filename in ['features.txt', 'features_original.txt']:
+        path = os.path.join(rootdir, filename)
+        if os.path.exists(path):
+            with open(path) as infile:
+                features.append([line.rstrip('\n') for line in infile])
+    column = None
+    for names in features:
+        if parameters.get('colname') in names:
+            column = names.index(parameters['colname'])
+            break
+    if column is None:
+        raise ValueError('matrix %s has no feature %s' % (matrix['id'], parameters.get('colname')))
+    frame = bedrock.analytics.utils.loadMatrix(os.path.join(rootdir, 'matrix.csv'))
+    keep = compare(frame[frame.columns[column]], parameters.get('value')).values
+    progress(0.5, 'write')
+    col = db_client()[DATALOADER_DB_NAME][DATALOADER_COL_NAME]
+    mat_id = getNewId()
+    storepath = os.path.join(os.path.dirname(rootdir.rstrip('/')), mat_id) + '/'
+    os.makedirs(storepath)
+    try:
+        for filename in os.listdir(rootdir):
+            # features and label mappings, the rows are written below
+            if filename != 'matrix.csv' and os.path.isfile(os.path.join(rootdir, filename)):
+                shutil.copy(os.path.join(rootdir, filename), storepath)
+        columns = [frame[each].values[keep] for each in frame.columns]
+        bedrock.analytics.utils.writeMatrix(columns, os.path.join(storepath, 'matrix.csv'))
+        if MATRIX_BINARY:
+            write_columnar(storepath, columns, features[0] if features else None)
+        filtered = dict(matrix)
+        filtered.update({
+            'id': mat_id,
+            'name': unused_matrix_name(col, matrix['src_id'], '%s_%s' % (matrix['name'], node['head'])),
+            'rootdir': storepath,
+            'created': getCurrentTime(),
+            'filter': {'head': node['head'], 'parent': matrix['id'], 'rows': int(keep.sum()),
+                       'parameters': parameters}
+        })
+        insert_matrices(col, matrix['src_id'], [filtered])
+    except Exception:
+        shutil.rmtree(storepath, ignore_errors=True)
+        raise
+    return {'src_id': matrix['src_id'], 'matrix_id': mat_id, 'matrix': filtered, 'matrices': [filtered]}
+
+
+def run_analytic_node(progress, node, inputs):
+    """run an analytic on matrices or results. inputs map input filenames to the matrix or result
+    they are read from, like POST /analytics/<analytic_id>/, or are the matrix (or src_id and
+    matrix_id) of an ingest or filter node. outputs result, res_id and the result
+    under each of its output filenames so later nodes can wire them as inputs"""
+    import bedrock.analytics.utils
+    analytic_id = node['meta']['opalclass']
+    if not any('.' in name for name in inputs):
+        # wired to the matrix or matrix_id output of an ingest or filter node
+        matrix = input_matrix(inputs)
+        inputs = {'matrix.csv': matrix, 'features.txt': matrix}
+    datasrc = inputs.get('matrix.csv') or inputs[sorted(inputs)[0]]
+    if 'analytic_id' in datasrc:
+        mat_id = datasrc['src_id']
+        res_src = [datasrc['id']]
+    else:
+        mat_id = datasrc['id']
+        res_src = None
+    res_id = getNewId()
+    storepath = os.path.join(RESULTS_PATH, mat_id, res_id) + '/'
+    os.makedirs(storepath)
+    res = bedrock.analytics.utils.analysis_job(
+        progress, analytic_id, node['meta'].get('parameters') or [], inputs, storepath,
+        node['meta'].get('name') or node['head'], res_id, mat_id, datasrc, res_src=res_src)
+    outputs = dict((filename, res) for filename in res['outputs'])
+    outputs.update({'result': res, 'res_id': res_id})
+    return outputs
+
+
+def run_vis_node(progress, node, inputs):
+    """create a visualization from matrices or results, outputs vis"""
+    import bedrock.visualization.utils
+    progress(0.0, 'render')
+    vis = bedrock.visualization.utils.generate_vis(node['meta']['opalclass'], inputs,
+                                                   node['meta'].get('parameters') or [])
+    return {'vis': vis}
+
+
+NODE_RUNNERS = {'ingest': run_ingest_node,
+                'filter': run_filter_node,
+                'analytic': run_analytic_node,
+                'visualization': run_vis_node}
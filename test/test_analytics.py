@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+test_analytics.py: tests for the analytics helpers that run without a server.
+"""
+
+import pandas as pd
+from bedrock.analytics.utils import sweep_parameters, writeMatrix
+
+
+def test_sweep_grid():
+    base = [{'attrname': 'k', 'value': '3'}, {'attrname': 'init', 'value': 'random'}]
+    sweep = sweep_parameters(base, grid={'k': ['2', '4'], 'tol': ['0.1', '0.01']})
+    assert [overrides for overrides, _ in sweep] == [
+        {'k': '2', 'tol': '0.1'}, {'k': '2', 'tol': '0.01'},
+        {'k': '4', 'tol': '0.1'}, {'k': '4', 'tol': '0.01'}]
+    overrides, parameters = sweep[1]
+    assert parameters == [{'attrname': 'k', 'value': '2'}, {'attrname': 'init', 'value': 'random'},
+                          {'attrname': 'tol', 'value': '0.01'}]
+    # the base parameters are left alone
+    assert base[0]['value'] == '3'
+
+
+def test_sweep_runs():
+    base = [{'attrname': 'k', 'value': '3'}]
+    sweep = sweep_parameters(base, runs=[{'k': '5'}, {}])
+    assert sweep == [({'k': '5'}, [{'attrname': 'k', 'value': '5'}]),
+                     ({}, [{'attrname': 'k', 'value': '3'}])]
+    assert sweep_parameters(base) == []
+
+
+def test_write_matrix_quotes_text(tmpdir):
+    path = str(tmpdir.join('matrix.csv'))
+    writeMatrix([['1', '2', '3'], ['a,b', 'say "hi"', 'plain']], path, blocksize=2)
+    with open(path) as infile:
+        assert infile.read().splitlines() == ['1,"a,b"', '2,"say ""hi"""', '3,plain']
+    writeMatrix([['4'], ['x']], path, mode='a')
+    frame = pd.read_csv(path, header=None)
+    assert list(frame[0]) == [1, 2, 3, 4]
+    assert list(frame[1]) == ['a,b', 'say "hi"', 'plain', 'x']
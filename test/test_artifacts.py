@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+test_artifacts.py: tests for the persisted state of Model analytics, no server needed.
+"""
+
+import json
+import os
+import numpy as np
+import pytest
+from bedrock.analytics import artifacts
+
+
+def fitted_state():
+    return {
+        'coef_': np.arange(12, dtype=np.float64).reshape(3, 4),
+        'classes_': np.array(['setosa', 'versicolor', 'virginica']),
+        'intercept_': np.array([0.5, -0.5, 1.0], dtype=np.float32),
+        'n_iter_': 7,
+        'params': {'C': 1.0, 'penalty': 'l2'},
+    }
+
+
+def test_round_trip_in_memory(tmpdir):
+    path = artifacts.write_artifact(str(tmpdir), 'opals.logit.Logit', fitted_state())
+    assert path == artifacts.artifact_path(str(tmpdir))
+    manifest = artifacts.read_manifest(path)
+    assert sorted(manifest['arrays']) == ['coef_', 'intercept_']
+    # text arrays and plain attributes go to the pickle
+    assert manifest['attributes'] == ['classes_', 'n_iter_', 'params']
+    state, resident = artifacts.read_artifact(path, 'opals.logit.Logit')
+    expected = fitted_state()
+    assert sorted(state) == sorted(expected)
+    for name in ('coef_', 'intercept_', 'classes_'):
+        assert state[name].dtype == expected[name].dtype
+        assert np.array_equal(state[name], expected[name])
+        assert not isinstance(state[name], np.memmap)
+    assert state['n_iter_'] == 7 and state['params'] == expected['params']
+    assert resident == os.path.getsize(os.path.join(path, 'state.pkl')) + 12 * 8 + 3 * 4
+
+
+def test_large_arrays_are_mapped(tmpdir):
+    state = fitted_state()
+    path = artifacts.write_artifact(str(tmpdir), 'opals.logit.Logit', state)
+    coef_size = os.path.getsize(os.path.join(path, 'coef_.npy'))
+    loaded, resident = artifacts.read_artifact(path, mmap_bytes=coef_size)
+    assert isinstance(loaded['coef_'], np.memmap)
+    assert not loaded['coef_'].flags.writeable
+    assert np.array_equal(loaded['coef_'], state['coef_'])
+    assert not isinstance(loaded['intercept_'], np.memmap)
+    # mapped arrays are not counted as resident
+    assert resident == os.path.getsize(os.path.join(path, 'state.pkl')) + 3 * 4
+
+
+def test_only_pickled_state(tmpdir):
+    path = artifacts.write_artifact(str(tmpdir), 'opals.tree.Tree', {'tree': {'left': None}, 'depth': 3})
+    assert artifacts.read_manifest(path)['arrays'] == {}
+    state, _ = artifacts.read_artifact(path)
+    assert state == {'tree': {'left': None}, 'depth': 3}
+
+
+def test_rewrite_replaces_artifact(tmpdir):
+    artifacts.write_artifact(str(tmpdir), 'opals.logit.Logit', fitted_state())
+    path = artifacts.write_artifact(str(tmpdir), 'opals.logit.Logit', {'n_iter_': 9})
+    assert sorted(os.listdir(path)) == ['manifest.json', 'state.pkl']
+    assert artifacts.read_artifact(path)[0] == {'n_iter_': 9}
+
+
+def test_refuses_other_artifacts(tmpdir):
+    path = artifacts.write_artifact(str(tmpdir), 'opals.logit.Logit', fitted_state())
+    with pytest.raises(artifacts.ArtifactError):
+        artifacts.read_artifact(path, 'opals.kmeans.Kmeans')
+    with pytest.raises(artifacts.ArtifactError):
+        artifacts.read_artifact(str(tmpdir.join('missing')))
+    with open(os.path.join(path, 'manifest.json')) as infile:
+        manifest = json.load(infile)
+    manifest['version'] = artifacts.ARTIFACT_VERSION + 1
+    with open(os.path.join(path, 'manifest.json'), 'w') as outfile:
+        json.dump(manifest, outfile)
+    with pytest.raises(artifacts.ArtifactError):
+        artifacts.read_artifact(path)
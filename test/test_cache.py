@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+test_cache.py: tests for the content addressed result cache, no server needed.
+The cache entries are kept in a small in memory stand in for the mongo collection.
+"""
+
+import importlib
+import os
+import sys
+import threading
+import time
+import pytest
+from bedrock.analytics import cache
+
+OPAL = '''
+class Opal(object):
+    cacheable = %s
+'''
+
+
+class Entries(object):
+    """the parts of a pymongo collection the cache uses"""
+    def __init__(self):
+        self.docs = []
+
+    def find_one_and_update(self, query, update):
+        for doc in self.docs:
+            if doc['key'] == query['key']:
+                before = dict(doc)
+                doc.update(update['$set'])
+                for name, step in update['$inc'].items():
+                    doc[name] = doc.get(name, 0) + step
+                return before
+        return None
+
+    def insert_one(self, doc):
+        doc['_id'] = len(self.docs) + 1
+        self.docs.append(doc)
+
+    def delete_one(self, query):
+        self.docs = [doc for doc in self.docs
+                     if not all(doc.get(name) == value for name, value in query.items())]
+
+    def find(self, query, projection):
+        return self
+
+    def sort(self, field, direction):
+        return sorted(self.docs, key=lambda doc: doc[field])
+
+
+@pytest.fixture
+def opal(tmpdir, monkeypatch):
+    """an opal module written to tmpdir, returns its source path"""
+    source = tmpdir.join('cache_opal.py')
+    source.write(OPAL % True)
+    monkeypatch.syspath_prepend(str(tmpdir))
+    sys.modules.pop('cache_opal', None)
+    module = importlib.import_module('cache_opal')
+    monkeypatch.setattr(cache, 'resolve_class', lambda name: getattr(module, name.split('.')[-1]))
+    yield str(source)
+    sys.modules.pop('cache_opal', None)
+
+
+@pytest.fixture
+def entries(tmpdir, monkeypatch):
+    col = Entries()
+    monkeypatch.setattr(cache, 'cache_collection', lambda: col)
+    monkeypatch.setattr(cache, 'RESULTS_CACHE_PATH', str(tmpdir.mkdir('cache')))
+    return col
+
+
+def inputs(tmpdir, contents):
+    rootdir = tmpdir.mkdir('input')
+    rootdir.join('matrix.csv').write(contents)
+    return {'matrix.csv': {'rootdir': str(rootdir)}}
+
+
+def test_result_key(tmpdir, opal):
+    files = inputs(tmpdir, '1,2\n3,4\n')
+    parameters = [{'attrname': 'k', 'value': '3'}, {'attrname': 'init', 'value': 'random'}]
+    key = cache.result_key('cache_opal.Opal', parameters, files)
+    assert len(key) == 40
+    # parameter order does not matter, their values do
+    assert cache.result_key('cache_opal.Opal', parameters[::-1], files) == key
+    changed = [{'attrname': 'k', 'value': '4'}, parameters[1]]
+    assert cache.result_key('cache_opal.Opal', changed, files) != key
+    # so do the contents of the inputs
+    with open(os.path.join(files['matrix.csv']['rootdir'], 'matrix.csv'), 'w') as outfile:
+        outfile.write('1,2\n3,5\n')
+    assert cache.result_key('cache_opal.Opal', parameters, files) != key
+    edited = cache.result_key('cache_opal.Opal', parameters, files)
+    # and the source of the opal
+    with open(opal, 'a') as outfile:
+        outfile.write('# tuned\n')
+    assert cache.result_key('cache_opal.Opal', parameters, files) != edited
+
+
+def test_result_key_not_cacheable(tmpdir, opal, monkeypatch):
+    files = inputs(tmpdir, '1,2\n')
+    assert cache.result_key('cache_opal.Opal', [], {'missing.csv': {'rootdir': str(tmpdir)}}) is None
+    with open(opal, 'w') as outfile:
+        outfile.write(OPAL % False)
+    sys.modules.pop('cache_opal')
+    module = importlib.import_module('cache_opal')
+    monkeypatch.setattr(cache, 'resolve_class', lambda name: module.Opal)
+    assert cache.result_key('cache_opal.Opal', [], files) is None
+
+
+def result_tree(path):
+    os.makedirs(os.path.join(path, 'plots'))
+    with open(os.path.join(path, 'matrix.csv'), 'w') as outfile:
+        outfile.write('1,2\n')
+    with open(os.path.join(path, 'plots', 'fit.json'), 'w') as outfile:
+        outfile.write('{}')
+
+
+def listing(path):
+    return sorted(os.path.relpath(os.path.join(root, name), path)
+                  for root, _, files in os.walk(path) for name in files)
+
+
+def test_store_and_fetch(tmpdir, entries):
+    first = str(tmpdir.join('first'))
+    result_tree(first)
+    cache.store('ab12', first, ['matrix.csv'])
+    cachedir = os.path.join(cache.RESULTS_CACHE_PATH, 'ab12')
+    assert listing(cachedir) == ['matrix.csv', 'plots/fit.json']
+    # the cache shares the files of the run instead of copying them
+    assert os.stat(os.path.join(cachedir, 'matrix.csv')).st_ino == \
+        os.stat(os.path.join(first, 'matrix.csv')).st_ino
+    second = str(tmpdir.mkdir('second'))
+    assert cache.fetch('ab12', second) == ['matrix.csv']
+    assert listing(second) == ['matrix.csv', 'plots/fit.json']
+    assert entries.docs[0]['hits'] == 1
+    assert cache.fetch('cd34', second) is None
+
+
+def test_fetch_after_eviction(tmpdir, entries):
+    first = str(tmpdir.join('first'))
+    result_tree(first)
+    cache.store('ab12', first, ['matrix.csv'])
+    cache.evict(max_entries=0)
+    assert entries.docs == []
+    assert not os.path.exists(os.path.join(cache.RESULTS_CACHE_PATH, 'ab12'))
+    second = str(tmpdir.mkdir('second'))
+    assert cache.fetch('ab12', second) is None
+    assert listing(second) == []
+
+
+def test_eviction_waits_for_fetch(tmpdir, entries, monkeypatch):
+    first = str(tmpdir.join('first'))
+    result_tree(first)
+    cache.store('ab12', first, ['matrix.csv'])
+    linking = threading.Event()
+    release = threading.Event()
+    link_tree = cache.link_tree
+
+    def slow_link(src, dst):
+        linking.set()
+        release.wait(5)
+        return link_tree(src, dst)
+    monkeypatch.setattr(cache, 'link_tree', slow_link)
+    second = str(tmpdir.mkdir('second'))
+    fetched = []
+    fetcher = threading.Thread(target=lambda: fetched.append(cache.fetch('ab12', second)))
+    fetcher.start()
+    linking.wait(5)
+    evictor = threading.Thread(target=cache.evict, kwargs={'max_entries': 0})
+    evictor.start()
+    time.sleep(0.2)
+    # the entry is gone from the collection but its tree stays until the fetch is done
+    assert entries.docs == []
+    assert evictor.is_alive()
+    assert os.path.isdir(os.path.join(cache.RESULTS_CACHE_PATH, 'ab12'))
+    release.set()
+    fetcher.join(5)
+    evictor.join(5)
+    assert fetched == [['matrix.csv']]
+    assert listing(second) == ['matrix.csv', 'plots/fit.json']
+    assert not os.path.exists(os.path.join(cache.RESULTS_CACHE_PATH, 'ab12'))
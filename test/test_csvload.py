@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+test_csvload.py: tests for the chunked csv parser, no server needed.
+"""
+
+import numpy as np
+import pandas as pd
+from bedrock.core import csvload
+
+
+def write_csv(path, rows):
+    with open(path, 'w') as outfile:
+        outfile.write('a,b,c\n')
+        for i in range(rows):
+            outfile.write('%d,%f,x%d\n' % (i, i / 4.0, i % 7))
+    return path
+
+
+def test_line_ranges(tmpdir):
+    path = write_csv(str(tmpdir.join('data.csv')), 200)
+    with open(path, 'rb') as infile:
+        data = infile.read()
+    start = data.index(b'\n') + 1
+    ranges = csvload.line_ranges(path, start, 256)
+    assert len(ranges) > 1
+    assert ranges[0][0] == start and ranges[-1][1] == len(data)
+    for (_, end), (begin, _) in zip(ranges, ranges[1:]):
+        assert end == begin
+    for _, end in ranges[:-1]:
+        assert data[end - 1:end] == b'\n'
+
+
+def test_read_csv_chunked(tmpdir):
+    path = write_csv(str(tmpdir.join('data.csv')), 500)
+    expected = pd.read_csv(path)
+    parsed = csvload.read_csv(path, workers=4, chunk_bytes=512, parallel_bytes=0)
+    pd.testing.assert_frame_equal(parsed, expected)
+    small = csvload.read_csv(path, downcast=True, workers=4, chunk_bytes=512, parallel_bytes=0)
+    assert small['a'].dtype == np.int16
+    assert small['b'].dtype == np.float32
+    assert list(small['c']) == list(expected['c'])
+
+
+def test_align_chunks():
+    first = pd.DataFrame({'a': [1, 2], 'b': [1.5, np.nan]})
+    second = pd.DataFrame({'a': [3, 4], 'b': ['x', None]}, dtype=object)
+    second['a'] = second['a'].astype(int)
+    chunks = csvload.align_chunks([first, second])
+    assert chunks[0]['a'].dtype.kind == 'i'
+    assert chunks[0]['b'].dtype.kind == 'O'
+    assert list(chunks[0]['b'])[0] == '1.5'
+    assert pd.isnull(list(chunks[0]['b'])[1])
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+test_dataloader.py: tests for the dataloader helpers that run without a server.
+"""
+
+import numpy as np
+from bedrock.dataloader.utils import profile_records
+
+
+def test_profile_records():
+    samples = [
+        {'id': 1, 'size': '2.5', 'name': 'a', 'tag': ''},
+        {'id': 2, 'size': '', 'name': 'b', 'tag': 'x'},
+        {'id': 3, 'size': '4.5', 'name': 'a', 'extra': 7},
+        {'id': 4, 'size': 'n/a', 'name': None, 'tag': 'x'},
+    ]
+    profile, frame, missing = profile_records(samples)
+    assert list(profile.index) == ['id', 'size', 'name', 'tag', 'extra']
+    assert list(frame.columns) == list(profile.index)
+    assert missing.shape == (4, 5)
+    assert list(profile['type']) == ['Numeric', 'String', 'String', 'String', 'Numeric']
+    assert list(profile['nulls']) == [0, 0.25, 0.25, 0.5, 0.75]
+    assert list(profile['cardinality']) == [4, 3, 2, 1, 1]
+    assert (profile.loc['id', 'min'], profile.loc['id', 'max'], profile.loc['id', 'mean']) == (1, 4, 2.5)
+    assert profile.loc['extra', 'mean'] == 7
+
+
+def test_profile_records_numeric_text():
+    samples = [{'v': str(v)} for v in (3, '1e2', -1.5)] + [{'v': None}]
+    profile, _, _ = profile_records(samples)
+    assert profile.loc['v', 'type'] == 'Numeric'
+    assert profile.loc['v', 'min'] == -1.5 and profile.loc['v', 'max'] == 100
+    assert np.isclose(profile.loc['v', 'mean'], 101.5 / 3)
+
+
+def test_profile_records_limit():
+    samples = [{'v': i} for i in range(10)]
+    profile, frame, _ = profile_records(samples, limit=4)
+    assert len(frame) == 4
+    assert profile.loc['v', 'max'] == 3
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+test_db.py: tests for the database helpers that run without a server.
+"""
+
+import threading
+import time
+from bedrock.core.db import BufferedCounter
+
+
+class Counts(object):
+    """the find_one_and_update of a pymongo collection holding one counted document"""
+    def __init__(self):
+        self.doc = {'count': 0}
+        self.writes = 0
+        self.written = threading.Event()
+
+    def find_one_and_update(self, query, update, projection=None, return_document=None):
+        self.writes += 1
+        self.doc['count'] += update['$inc']['count']
+        self.written.set()
+        return dict(self.doc)
+
+
+def test_flush_at_count():
+    col = Counts()
+    counter = BufferedCounter(col, {'src_id': 'a'}, 'count', flush_count=3, flush_interval=60)
+    assert counter.add() == 1
+    assert counter.add() == 2
+    assert col.writes == 0
+    assert counter.add() == 3
+    assert col.writes == 1 and col.doc['count'] == 3
+    assert counter.add(2) == 5
+    assert counter.flush() == 5
+    assert col.writes == 2
+    # nothing pending, nothing written
+    counter.flush()
+    assert col.writes == 2
+
+
+def test_idle_counts_are_flushed():
+    col = Counts()
+    counter = BufferedCounter(col, {'src_id': 'a'}, 'count', flush_count=1000, flush_interval=0.2)
+    start = time.time()
+    counter.add()
+    counter.add(4)
+    # the stream goes idle, the timer writes what is pending
+    assert col.written.wait(5)
+    assert time.time() - start < 2
+    assert col.writes == 1 and col.doc['count'] == 5
+    assert counter.timer is None
+    time.sleep(0.3)
+    assert col.writes == 1
+
+
+def test_flush_cancels_timer():
+    col = Counts()
+    counter = BufferedCounter(col, {'src_id': 'a'}, 'count', flush_count=1000, flush_interval=0.2)
+    counter.add()
+    timer = counter.timer
+    assert timer is not None
+    counter.flush()
+    assert counter.timer is None
+    timer.join(1)
+    assert col.writes == 1
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+test_io.py: tests for the binary columnar copy of matrix.csv, no server needed.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from bedrock.analytics.utils import writeFiles
+from bedrock.core.io import read_columnar, read_columnar_header, write_columnar, columnar_path
+
+
+def iris_maps():
+    """a matrix with a float, an int and a label encoded feature"""
+    return {
+        'petal': [1.5, 0.25, 3.0, 2.0],
+        'count': [3, 1, 4, 1],
+        'species': {'values': [0, 1, 1, 2], 'indexToLabel': ['setosa', 'versicolor', 'virginica']},
+    }
+
+
+def test_columnar_matches_csv(tmpdir):
+    rootpath = str(tmpdir)
+    features = ['petal', 'count', 'species']
+    writeFiles(iris_maps(), features, features, rootpath)
+    header = read_columnar_header(rootpath)
+    assert header['shape'] == [4, 3]
+    assert header['features'] == features
+    expected = pd.read_csv(os.path.join(rootpath, 'matrix.csv'), header=None)
+    frame = read_columnar(rootpath)
+    assert [frame[col].dtype.kind for col in frame.columns] == ['f', 'i', 'i']
+    pd.testing.assert_frame_equal(frame, expected, check_dtype=False)
+    named = read_columnar(rootpath, names=features)
+    assert list(named.columns) == features
+
+
+def test_columnar_text_columns(tmpdir):
+    rootpath = str(tmpdir)
+    write_columnar(rootpath, [['1', '2', ''], ['a', 'b,c', 'd']])
+    frame = read_columnar(rootpath)
+    assert frame[0].dtype.kind == 'f' and np.isnan(frame[0][2])
+    assert list(frame[1]) == ['a', 'b,c', 'd']
+
+
+def test_columnar_goes_stale(tmpdir):
+    rootpath = str(tmpdir)
+    features = ['petal', 'count', 'species']
+    writeFiles(iris_maps(), features, features, rootpath)
+    assert read_columnar(rootpath) is not None
+    # matrix.csv written after the binary copy, e.g. by an older writer
+    header_time = os.path.getmtime(os.path.join(columnar_path(rootpath), 'header.json'))
+    csv_path = os.path.join(rootpath, 'matrix.csv')
+    os.utime(csv_path, (header_time + 10, header_time + 10))
+    assert read_columnar_header(rootpath) is None
+    assert read_columnar(rootpath) is None
+    os.utime(csv_path, (header_time - 10, header_time - 10))
+    assert read_columnar(rootpath) is not None
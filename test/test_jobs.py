@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+test_jobs.py: tests for the job queue helpers that run without a server.
+"""
+
+import pytest
+from bson import json_util
+from bedrock.core import jobs
+
+
+class Jobs(object):
+    """the update_one of a pymongo collection holding one running job"""
+    def __init__(self, job):
+        self.job = dict(job, status=jobs.RUNNING)
+
+    def update_one(self, query, update):
+        if all(self.job.get(name) == value for name, value in query.items()):
+            self.job.update(update['$set'])
+
+
+@pytest.fixture
+def job(monkeypatch):
+    job = {'job_id': 'j1', 'worker': 'host:1', 'target': 'targets.fit', 'kwargs': {'k': 3}}
+    col = Jobs(job)
+    monkeypatch.setattr(jobs, 'jobs_collection', lambda client=None: col)
+    return job, col
+
+
+def test_run_job_stores_result(job, monkeypatch):
+    job, col = job
+    monkeypatch.setattr(jobs, 'resolve_target', lambda name: lambda progress, k: {'clusters': k})
+    jobs.run_job(job)
+    assert col.job['status'] == jobs.DONE
+    assert json_util.loads(col.job['result']) == {'clusters': 3}
+
+
+def test_run_job_fails_on_unstorable_result(job, monkeypatch):
+    job, col = job
+    monkeypatch.setattr(jobs, 'resolve_target', lambda name: lambda progress, k: object())
+    jobs.run_job(job)
+    assert col.job['status'] == jobs.FAILED
+    assert 'TypeError' in col.job['error']
+    assert col.job.get('result') is None
+
+
+def test_run_job_leaves_reaped_jobs_alone(job, monkeypatch):
+    job, col = job
+    col.job['worker'] = 'host:2'
+    monkeypatch.setattr(jobs, 'resolve_target', lambda name: lambda progress, k: k)
+    jobs.run_job(job)
+    assert col.job['status'] == jobs.RUNNING
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+test_matrixcache.py: tests for the shared memory mapped matrix cache, no server needed.
+"""
+
+import os
+import numpy as np
+import pytest
+from bedrock.core import matrixcache
+
+
+def write_matrix(rootpath, values):
+    """write values (rows x features) as a headerless matrix.csv"""
+    np.savetxt(os.path.join(rootpath, 'matrix.csv'), np.asarray(values), delimiter=',', fmt='%.1f')
+
+
+def touch(path, offset):
+    """move the mtime of path offset seconds away from its current value"""
+    mtime = os.path.getmtime(path) + offset
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    matrixcache.clear()
+    yield
+    matrixcache.clear()
+
+
+def test_frames_are_copy_on_write(tmpdir):
+    rootpath = str(tmpdir)
+    write_matrix(rootpath, [[1.0, 2.0], [3.0, 4.0]])
+    frame = matrixcache.load_frame(rootpath, names=['a', 'b'])
+    assert list(frame.columns) == ['a', 'b']
+    shared = matrixcache.load_dense(rootpath)
+    assert not shared.flags.writeable
+    with open(matrixcache.dense_path(rootpath), 'rb') as infile:
+        before = infile.read()
+    frame.iloc[0, 0] = 99.0
+    frame['b'] *= 10
+    assert frame.iloc[0, 0] == 99.0 and list(frame['b']) == [20.0, 40.0]
+    # neither the file, the shared mapping nor the next caller see the writes
+    with open(matrixcache.dense_path(rootpath), 'rb') as infile:
+        assert infile.read() == before
+    assert shared[0, 0] == 1.0 and list(shared[:, 1]) == [2.0, 4.0]
+    again = matrixcache.load_frame(rootpath)
+    assert again.values.tolist() == [[1.0, 2.0], [3.0, 4.0]]
+
+
+def test_mixed_dtypes_are_not_cached(tmpdir):
+    rootpath = str(tmpdir)
+    with open(os.path.join(rootpath, 'matrix.csv'), 'w') as outfile:
+        outfile.write('1,a\n2,b\n')
+    assert matrixcache.load_frame(rootpath) is None
+
+
+def test_rebuilt_when_matrix_changes(tmpdir):
+    rootpath = str(tmpdir)
+    write_matrix(rootpath, [[1.0, 2.0], [3.0, 4.0]])
+    assert matrixcache.load_dense(rootpath).tolist() == [[1.0, 2.0], [3.0, 4.0]]
+    before = matrixcache.stats()
+    assert matrixcache.load_dense(rootpath) is not None
+    assert matrixcache.stats()['hits'] == before['hits'] + 1
+    write_matrix(rootpath, [[5.0, 6.0], [7.0, 8.0], [9.0, 10.0]])
+    touch(os.path.join(rootpath, 'matrix.csv'), 10)
+    assert matrixcache.load_dense(rootpath).tolist() == [[5.0, 6.0], [7.0, 8.0], [9.0, 10.0]]
+    after = matrixcache.stats()
+    assert after['misses'] == before['misses'] + 1
+    assert matrixcache.load_frame(rootpath).values.tolist() == [[5.0, 6.0], [7.0, 8.0], [9.0, 10.0]]
+
+
+def test_lru_byte_bound(tmpdir):
+    roots = []
+    for i in range(3):
+        rootpath = str(tmpdir.mkdir('m%d' % i))
+        write_matrix(rootpath, np.full((10, 4), float(i)))
+        roots.append(rootpath)
+    size = 10 * 4 * 8
+    budget = size * 2 + size // 2
+    matrixcache.load_dense(roots[0], budget)
+    matrixcache.load_dense(roots[1], budget)
+    # touch the first so the second is the least recently used
+    matrixcache.load_dense(roots[0], budget)
+    before = matrixcache.stats()
+    matrixcache.load_dense(roots[2], budget)
+    after = matrixcache.stats()
+    assert after['entries'] == 2
+    assert after['bytes'] == 2 * size
+    assert after['evictions'] == before['evictions'] + 1
+    assert after['evicted_bytes'] == before['evicted_bytes'] + size
+    matrixcache.load_dense(roots[0], budget)
+    assert matrixcache.stats()['hits'] == after['hits'] + 1
+    matrixcache.load_dense(roots[1], budget)
+    assert matrixcache.stats()['misses'] == after['misses'] + 1
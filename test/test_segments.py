@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+test_segments.py: tests for the append-only segments of streaming matrices, no server needed.
+"""
+
+import os
+import pandas as pd
+import pytest
+from bedrock.core.segments import reset_segments, append_segment, read_manifest, read_segments, \
+    segment_offset, segments_path, compact_segments, manifest_lock, purge_retired, write_manifest
+
+
+def make_segments(rootpath, sizes):
+    """a segmented matrix with one segment per entry of sizes, rows numbered from 0"""
+    start = 0
+    for i, size in enumerate(sizes):
+        columns = [list(range(start, start + size)), ['r%d' % j for j in range(start, start + size)]]
+        if i == 0:
+            reset_segments(rootpath, columns)
+        else:
+            append_segment(rootpath, columns, compact=False)
+        start += size
+    return read_manifest(rootpath)
+
+
+def test_segment_offset():
+    manifest = {'segments': [
+        {'id': 3, 'start': 0, 'rows': 5, 'parts': [[1, 2], [2, 4], [3, 5]]},
+        {'id': 4, 'start': 5, 'rows': 3, 'parts': []},
+    ]}
+    assert segment_offset(manifest, 4) == 8
+    assert segment_offset(manifest, 3) == 5
+    # parts merged into segment 3 still resolve to where they ended
+    assert segment_offset(manifest, 1) == 2
+    assert segment_offset(manifest, 2) == 4
+    assert segment_offset(manifest, 0) == 0
+    with pytest.raises(KeyError):
+        segment_offset(manifest, 9)
+
+
+def test_read_segments_since(tmpdir):
+    rootpath = str(tmpdir)
+    manifest = make_segments(rootpath, [4, 2, 3])
+    frame, last = read_segments(rootpath)
+    assert last == manifest['segments'][-1]['id']
+    assert list(frame[0]) == list(range(9))
+    frame, last = read_segments(rootpath, since=1)
+    assert list(frame[0]) == [6, 7, 8]
+    assert list(frame[1]) == ['r6', 'r7', 'r8']
+    frame, _ = read_segments(rootpath, since=last)
+    assert len(frame) == 0
+
+
+def test_compaction_keeps_offsets(tmpdir):
+    rootpath = str(tmpdir)
+    make_segments(rootpath, [50, 2, 2, 2, 50])
+    before = read_segments(rootpath)[0]
+    assert compact_segments(rootpath, min_rows=10, max_rows=100, grace=3600) == 2
+    manifest = read_manifest(rootpath)
+    assert [entry['rows'] for entry in manifest['segments']] == [50, 6, 50]
+    assert [entry['id'] for entry in manifest['segments']] == [0, 3, 4]
+    pd.testing.assert_frame_equal(read_segments(rootpath)[0], before)
+    # a reader that stopped inside the merged run resumes at the right row
+    assert list(read_segments(rootpath, since=1)[0][0])[:4] == [52, 53, 54, 55]
+    # the parts stay on disk until the grace period is over
+    retired = [name for name, _ in manifest['retired']]
+    assert len(retired) == 3
+    assert all(os.path.isdir(os.path.join(segments_path(rootpath), name)) for name in retired)
+    assert compact_segments(rootpath, min_rows=10, max_rows=100, grace=0) == 0
+    assert not any(os.path.exists(os.path.join(segments_path(rootpath), name)) for name in retired)
+    assert read_manifest(rootpath)['retired'] == []
+
+
+def test_compaction_respects_max_rows(tmpdir):
+    rootpath = str(tmpdir)
+    make_segments(rootpath, [3, 3, 3, 3, 3])
+    compact_segments(rootpath, min_rows=10, max_rows=6, grace=0)
+    manifest = read_manifest(rootpath)
+    assert [entry['rows'] for entry in manifest['segments']] == [6, 6, 3]
+    assert list(read_segments(rootpath)[0][0]) == list(range(15))
+
+
+def retire_parts(rootpath, age):
+    """compact a matrix with a run of small segments, its parts retired age seconds ago"""
+    make_segments(rootpath, [50, 2, 2, 50])
+    compact_segments(rootpath, min_rows=10, max_rows=100, grace=3600)
+    manifest = read_manifest(rootpath)
+    manifest['retired'] = [[name, when - age] for name, when in manifest['retired']]
+    write_manifest(rootpath, manifest)
+    return [os.path.join(segments_path(rootpath), name) for name, _ in manifest['retired']]
+
+
+def test_purge_retired(tmpdir):
+    rootpath = str(tmpdir)
+    retired = retire_parts(rootpath, 10)
+    assert purge_retired(rootpath, grace=3600) == 0
+    assert all(os.path.isdir(path) for path in retired)
+    assert purge_retired(rootpath, grace=5) == 2
+    assert not any(os.path.exists(path) for path in retired)
+    assert read_manifest(rootpath)['retired'] == []
+    assert list(read_segments(rootpath)[0][0]) == list(range(104))
+    assert purge_retired(str(tmpdir.join('missing'))) == 0
+
+
+def test_readers_purge_expired_parts(tmpdir):
+    rootpath = str(tmpdir)
+    retired = retire_parts(rootpath, 3600 * 24)
+    # nothing appends any more, the next reader deletes the parts
+    assert list(read_segments(rootpath)[0][0]) == list(range(104))
+    assert not any(os.path.exists(path) for path in retired)
+    assert read_manifest(rootpath)['retired'] == []
+
+
+def test_readers_do_not_wait_to_purge(tmpdir):
+    rootpath = str(tmpdir)
+    retired = retire_parts(rootpath, 3600 * 24)
+    with manifest_lock(rootpath):
+        assert list(read_segments(rootpath)[0][0]) == list(range(104))
+    assert all(os.path.isdir(path) for path in retired)
+    assert len(read_manifest(rootpath)['retired']) == 2
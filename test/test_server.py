@@ -254,6 +254,8 @@ def check_make_matrix(api, source_id, matbody):
     # echo $matbody |  http post http://192.168.33.102:81/dataloader/sources/$src_id/
     # postdata = json.loads(matbody)
     resp = api.post("dataloader", "sources/%s/" % source_id, json=matbody)
+    if resp.status_code == 202:
+        resp = api.wait_job("dataloader", resp.json()['job_id'], timeout=600)
     # assert resp.status_code == 201, "Failed to create matrix: %d: %s" % (resp.status_code,
     #                                                                      resp.text)
     output = resp.json()
@@ -277,7 +279,10 @@ def check_analysis(api, analytic_id, source_id, postdata):
     '''
     print("INFO: creating analytic at analytics/%s/" % source_id)
     resp = api.post("analytics", "analytics/%s" % analytic_id, json=postdata)
-    assert resp.status_code == 201, "Failed to run the analytic: %d: %s: %s" % (
+    assert resp.status_code == 202, "Failed to queue the analytic: %d: %s: %s" % (
+        resp.status_code, resp.text, analytic_id)
+    resp = api.wait_job("analytics", resp.json()['job_id'], timeout=600)
+    assert resp.status_code == 200, "Failed to run the analytic: %d: %s: %s" % (
         resp.status_code, resp.text, analytic_id)
     result_mtx = resp.json()
     print(resp.json())
@@ -368,9 +373,11 @@ def test_workflow_iris_pca():
     url = bedrockapi.endpoint("dataloader", "sources/%s" % (source_id))
     print("INFO: Posting matrix to:%s" % url)
     resp = requests.post(url, json=matbody)
-    log_failure(bedrockapi, "posting matrix %s" % matbody, resp, 201)
+    log_failure(bedrockapi, "posting matrix %s" % matbody, resp, 202)
+    resp = bedrockapi.wait_job("dataloader", resp.json()['job_id'], timeout=600)
+    log_failure(bedrockapi, "generating matrix %s" % matbody, resp, 200)
 
-    mtx_res = unpack_singleton_list(check_make_matrix(bedrockapi, source_id, matbody))
+    mtx_res = unpack_singleton_list(resp.json())
     print("INFO: received matrix post response")
     pprint(mtx_res)
 
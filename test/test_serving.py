@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+test_serving.py: tests for the model serving pool, no server needed.
+"""
+
+import threading
+import time
+import pytest
+from bedrock.analytics import serving, utils
+from bedrock.analytics.serving import Batcher
+
+
+class Doubler(object):
+    """a model that doubles its inputs and remembers every batch it classified"""
+    def __init__(self, gate=None):
+        self.calls = []
+        self.gate = gate
+
+    def classify(self, rows):
+        self.calls.append(list(rows))
+        if self.gate is not None and len(self.calls) == 1:
+            self.gate.wait(5)
+        return [row * 2 for row in rows]
+
+
+def test_batcher_single_call():
+    model = Doubler()
+    batcher = Batcher(model, threading.Lock(), wait=5, max_rows=100)
+    start = time.time()
+    assert batcher.classify([1, 2, 3]) == [2, 4, 6]
+    # nothing else is running so a lone caller is not held back by the window
+    assert time.time() - start < 1
+    assert model.calls == [[1, 2, 3]]
+
+
+def test_batcher_coalesces_waiting_calls():
+    gate = threading.Event()
+    model = Doubler(gate)
+    batcher = Batcher(model, threading.Lock(), wait=5, max_rows=3)
+    results = {}
+
+    def call(value):
+        results[value] = batcher.classify([value])
+
+    first = threading.Thread(target=call, args=(0,))
+    first.start()
+    while not model.calls:
+        time.sleep(0.01)
+    # the first batch is busy in the model, the next callers queue up behind it
+    others = [threading.Thread(target=call, args=(value,)) for value in (1, 2, 3)]
+    for thread in others:
+        thread.start()
+    while batcher.pending:
+        time.sleep(0.01)
+    gate.set()
+    for thread in [first] + others:
+        thread.join(10)
+    assert results == {0: [0], 1: [2], 2: [4], 3: [6]}
+    assert len(model.calls) == 2
+    assert sorted(model.calls[1]) == [1, 2, 3]
+
+
+def test_batcher_errors_reach_every_caller():
+    class Short(object):
+        def classify(self, rows):
+            return rows[1:]
+    batcher = Batcher(Short(), threading.Lock(), wait=0, max_rows=10)
+    with pytest.raises(ValueError):
+        batcher.classify([1, 2])
+
+
+class Scaler(object):
+    """a model that multiplies its inputs by factor"""
+    built = 0
+
+    def __init__(self):
+        self.factor = 1
+        self.parameters_spec = [{'name': 'Factor', 'attrname': 'factor', 'value': 3, 'type': 'input'}]
+
+    def check_parameters(self):
+        return True
+
+    def classify(self, rows):
+        return [row * self.factor for row in rows]
+
+
+@pytest.fixture
+def scaler(monkeypatch):
+    monkeypatch.setattr(utils, 'resolve_class', lambda name: Scaler)
+
+    def build(name):
+        Scaler.built += 1
+        return Scaler()
+    monkeypatch.setattr(utils, 'get_class', build)
+    serving.clear()
+    Scaler.built = 0
+    yield 'opals.scaler.Scaler'
+    serving.clear()
+
+
+def test_preload_serves_default_requests(scaler):
+    assert utils.preload_model(scaler, release='1')
+    built = Scaler.built
+    # leaving the parameters out or sending the defaults hits the preloaded instance
+    assert utils.classify(scaler, [], [1, 2], release='1') == [3, 6]
+    assert utils.classify(scaler, [{'attrname': 'factor', 'value': 3}], [1], release='1') == [3]
+    assert Scaler.built == built
+    assert utils.classify(scaler, [{'attrname': 'factor', 'value': 2}], [1], release='1') == [2]
+    assert Scaler.built == built + 1
+
+
+def test_new_release_replaces_instance(scaler):
+    utils.classify(scaler, [], [1], release='1')
+    before = serving.get_model(scaler, utils.model_parameters(scaler, []), None, (Scaler, None, '1'))[0]
+    built = Scaler.built
+    # the model was published again through another worker, this one rebuilds on its next request
+    assert utils.classify(scaler, [], [1], release='2') == [3]
+    assert Scaler.built == built + 1
+    after = serving.get_model(scaler, utils.model_parameters(scaler, []), None, (Scaler, None, '2'))[0]
+    assert after is not before
+    assert utils.unload_model(scaler) == 1
+    assert serving.stats()['models'] == []
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+test_sparse.py: tests for the binary copies of MatrixMarket files, no server needed.
+"""
+
+import mmap
+import os
+import numpy as np
+import pytest
+import scipy.io
+from scipy.sparse import coo_matrix, random as sparse_random
+from bedrock.core import sparse
+
+
+def write_mtx(path, matrix, **kwargs):
+    scipy.io.mmwrite(path, matrix, comment='written by test_sparse', **kwargs)
+    return path
+
+
+def assert_same(matrix, expected):
+    assert matrix.shape == expected.shape
+    assert matrix.dtype == expected.dtype
+    assert (matrix != expected).nnz == 0
+
+
+def mapped(arr):
+    """True when arr is a view of a memory mapped file"""
+    while arr is not None:
+        if isinstance(arr, (np.memmap, mmap.mmap)):
+            return True
+        arr = getattr(arr, 'base', None)
+    return False
+
+
+@pytest.fixture
+def general(tmpdir):
+    matrix = sparse_random(40, 25, density=0.1, format='coo', random_state=7)
+    return write_mtx(str(tmpdir.join('general.mtx')), matrix, symmetry='general')
+
+
+@pytest.fixture
+def spy(monkeypatch):
+    """count the files read_mtx hands to scipy's parser"""
+    calls = []
+    def mmread(filepath):
+        calls.append(filepath)
+        return scipy.io.mmread(filepath)
+    monkeypatch.setattr(sparse, 'mmread', mmread)
+    return calls
+
+
+@pytest.mark.parametrize('fmt', ['csc', 'csr'])
+def test_load_sparse_matches_mmread(general, fmt):
+    expected = scipy.io.mmread(general)
+    matrix = sparse.load_sparse(general, fmt)
+    assert matrix.format == fmt
+    assert_same(matrix, expected)
+    assert os.path.isdir(sparse.sparse_path(general, fmt))
+    # the second load maps the binary copy
+    again = sparse.load_sparse(general, fmt)
+    assert all(mapped(arr) for arr in (again.data, again.indices, again.indptr))
+    assert_same(again, expected)
+
+
+def test_other_format_built_from_binary(general, spy):
+    sparse.load_sparse(general, 'csc')
+    csr = sparse.load_sparse(general, 'csr')
+    assert_same(csr, scipy.io.mmread(general))
+    assert spy == []
+
+
+def test_stale_copy_is_rebuilt(general, tmpdir):
+    sparse.load_sparse(general, 'csc')
+    replacement = coo_matrix(([1.0, 2.0], ([0, 3], [1, 2])), shape=(5, 4))
+    write_mtx(general, replacement, symmetry='general')
+    header = os.path.join(sparse.sparse_path(general, 'csc'), 'header.json')
+    mtime = os.path.getmtime(header) + 10
+    os.utime(general, (mtime, mtime))
+    assert_same(sparse.load_sparse(general, 'csc'), scipy.io.mmread(general))
+
+
+def test_read_mtx_fast_path(tmpdir, spy):
+    integer = coo_matrix(([3, 1, 4, 1], ([0, 2, 2, 4], [1, 0, 3, 3])), shape=(5, 4))
+    path = write_mtx(str(tmpdir.join('integer.mtx')), integer, field='integer', symmetry='general')
+    parsed = sparse.read_mtx(path)
+    assert parsed.dtype == np.int64
+    assert_same(parsed.tocsc(), scipy.io.mmread(path).tocsc().astype(np.int64))
+    pattern = str(tmpdir.join('pattern.mtx'))
+    with open(pattern, 'w') as outfile:
+        outfile.write('%%MatrixMarket matrix coordinate pattern general\n% a comment\n3 3 2\n1 2\n3 1\n')
+    assert sparse.read_mtx(pattern).toarray().tolist() == [[0, 1, 0], [0, 0, 0], [1, 0, 0]]
+    assert spy == []
+
+
+def test_read_mtx_falls_back_to_mmread(tmpdir, spy):
+    matrix = coo_matrix(([1.0, 2.0, 5.0], ([0, 2, 1], [0, 1, 1])), shape=(3, 3))
+    symmetric = write_mtx(str(tmpdir.join('symmetric.mtx')), matrix + matrix.T, symmetry='symmetric')
+    dense = write_mtx(str(tmpdir.join('array.mtx')), matrix.toarray())
+    for path in (symmetric, dense):
+        expected = scipy.io.mmread(path)
+        parsed = sparse.read_mtx(path)
+        assert_same(coo_matrix(parsed), coo_matrix(expected))
+        assert_same(sparse.load_sparse(path, 'csr'), coo_matrix(expected).tocsr())
+    assert spy.count(symmetric) == 2 and spy.count(dense) == 2
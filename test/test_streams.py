@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+test_streams.py: tests for the stream supervisor, no server needed.
+The stream processes are not spawned, their spawn only marks them running.
+"""
+
+import threading
+import time
+import pytest
+from bedrock.dataloader import streams
+
+
+@pytest.fixture
+def supervisor(monkeypatch):
+    spawned = []
+
+    def spawn(stream):
+        # slow enough for a concurrent toggle to see the stream before it is running
+        time.sleep(0.1)
+        spawned.append(stream.src_id)
+        stream.status = streams.RUNNING
+    monkeypatch.setattr(streams.Stream, 'spawn', spawn)
+    monkeypatch.setattr(streams, 'set_source_status', lambda src_id, streaming: None)
+    return streams.Supervisor(max_streams=2), spawned
+
+
+def test_toggle(supervisor):
+    supervisor, spawned = supervisor
+    assert supervisor.toggle('a', 'opals.ingest.Stream', '/tmp/a')['status'] == streams.RUNNING
+    assert supervisor.toggle('a', 'opals.ingest.Stream', '/tmp/a')['status'] == streams.STOPPING
+    # a stopping stream is not started again
+    assert supervisor.toggle('a', 'opals.ingest.Stream', '/tmp/a')['status'] == streams.STOPPING
+    assert spawned == ['a']
+
+
+def test_concurrent_toggles(supervisor):
+    supervisor, spawned = supervisor
+    results = []
+    toggles = [threading.Thread(target=lambda: results.append(
+        supervisor.toggle('a', 'opals.ingest.Stream', '/tmp/a')['status'])) for _ in range(2)]
+    for thread in toggles:
+        thread.start()
+    for thread in toggles:
+        thread.join(5)
+    # one toggle started the stream and the other stopped it
+    assert sorted(results) == [streams.RUNNING, streams.STOPPING]
+    assert spawned == ['a']
+    assert supervisor.status('a')['status'] == streams.STOPPING
+
+
+def test_max_streams(supervisor):
+    supervisor, _ = supervisor
+    supervisor.toggle('a', 'opals.ingest.Stream', '/tmp/a')
+    supervisor.toggle('b', 'opals.ingest.Stream', '/tmp/b')
+    with pytest.raises(streams.StreamError):
+        supervisor.toggle('c', 'opals.ingest.Stream', '/tmp/c')
+
+
+def test_stopped_streams_purge_their_segments(supervisor, monkeypatch):
+    supervisor, _ = supervisor
+    purged = []
+    monkeypatch.setattr(streams, 'purge_later', purged.append)
+    monkeypatch.setattr(streams, 'save_streams', lambda infos: None)
+    monkeypatch.setattr(streams.Stream, 'alive', lambda stream: False)
+    supervisor.toggle('a', 'opals.ingest.Stream', '/tmp/a')
+    supervisor.toggle('a', 'opals.ingest.Stream', '/tmp/a')
+    supervisor.check()
+    assert supervisor.status('a')['status'] == streams.STOPPED
+    assert purged == ['a']
+    supervisor.check()
+    assert purged == ['a']
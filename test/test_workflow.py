@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+test_workflow.py: tests for the workflow dependency graph and node fingerprints, no server needed.
+"""
+
+import copy
+import pytest
+from bedrock.client.workflow import fingerprints
+from bedrock.workflow import utils
+from bedrock.workflow.utils import topological_order, workflow_graph
+
+
+def node(head, inputs, outputs, parameters=None):
+    return {'head': head, 'inputs': inputs, 'outputs': outputs,
+            'meta': {'opalclass': 'opals.%s.%s' % (head, head), 'parameters': parameters or []}}
+
+
+def diamond():
+    """load feeds clean and stats, which both feed report. bundle 0 is a literal input"""
+    return {
+        'bundles': ['iris.csv', None, None, None, None],
+        'nodes': [
+            node('report', {'a': 2, 'b': 3}, {'out': 4}),
+            node('stats', {'src': 1}, {'out': 3}),
+            node('clean', {'src': 1, 'mode': 'strict'}, {'out': 2}),
+            node('load', {'path': 0}, {'matrix': 1}, [{'attrname': 'sep', 'value': ','}]),
+        ],
+    }
+
+
+def test_workflow_graph():
+    deps = workflow_graph(diamond())
+    assert deps == {'load': set(), 'clean': set(['load']), 'stats': set(['load']),
+                    'report': set(['clean', 'stats'])}
+
+
+def test_workflow_graph_rejects_bad_wiring():
+    workflow = diamond()
+    workflow['nodes'][1]['outputs'] = {'out': 2}
+    with pytest.raises(ValueError):
+        workflow_graph(workflow)
+    workflow = diamond()
+    workflow['nodes'][3]['outputs'] = {}
+    with pytest.raises(ValueError):
+        workflow_graph(workflow)
+
+
+def test_topological_order():
+    workflow = diamond()
+    heads = [each['head'] for each in workflow['nodes']]
+    # ties keep the order of the node list
+    assert topological_order(heads, workflow_graph(workflow)) == ['load', 'stats', 'clean', 'report']
+    with pytest.raises(ValueError):
+        topological_order(['a', 'b', 'c'], {'a': set(), 'b': set(['c']), 'c': set(['b'])})
+
+
+def test_fingerprints_follow_upstream_changes():
+    workflow = diamond()
+    prints = fingerprints(workflow)
+    assert prints == fingerprints(copy.deepcopy(workflow))
+    assert len(set(prints.values())) == 4
+    # a new output value of an upstream node does not matter, its configuration does
+    changed = copy.deepcopy(workflow)
+    changed['bundles'][2] = 'somewhere/else'
+    assert fingerprints(changed) == prints
+    changed['nodes'][2]['inputs']['mode'] = 'lenient'
+    after = fingerprints(changed)
+    assert set(head for head in prints if after[head] != prints[head]) == set(['report', 'clean'])
+    changed = copy.deepcopy(workflow)
+    changed['nodes'][3]['meta']['parameters'][0]['value'] = ';'
+    after = fingerprints(changed)
+    assert all(after[head] != prints[head] for head in prints)
+    changed = copy.deepcopy(workflow)
+    changed['bundles'][0] = 'other.csv'
+    assert fingerprints(changed)['load'] != prints['load']
+
+
+def test_fingerprints_reject_cycles():
+    workflow = diamond()
+    workflow['nodes'][3]['inputs']['path'] = 4
+    with pytest.raises(ValueError):
+        fingerprints(workflow)
+
+
+@pytest.fixture
+def sources(monkeypatch):
+    """one uploaded source, found by id or name like find_source does"""
+    source = {'src_id': 'a1b2', 'name': 'Rand2011'}
+    monkeypatch.setattr(utils, 'db_client', lambda: {utils.DATALOADER_DB_NAME: {utils.DATALOADER_COL_NAME: None}})
+    monkeypatch.setattr(utils, 'find_source',
+                        lambda col, src_id: source if src_id in (source['src_id'], source['name']) else None)
+    return source
+
+
+def test_ingest_source(sources):
+    bundles = ['a1b2', None, 'missing']
+    ingest = node('load', {}, {'matrix': 1}, {'src_id': 'Rand2011'})
+    assert utils.ingest_source(ingest, bundles, set([1])) == sources
+    ingest['inputs']['src_id'] = 0
+    assert utils.ingest_source(ingest, bundles, set([1])) == sources
+    # a source produced by another node is only known once that node ran
+    ingest['inputs']['src_id'] = 1
+    assert utils.ingest_source(ingest, bundles, set([1])) is None
+
+
+def test_ingest_source_missing(sources):
+    bundles = ['', None, 'missing']
+    with pytest.raises(ValueError):
+        utils.ingest_source(node('load', {}, {'matrix': 1}, []), bundles, set([1]))
+    with pytest.raises(ValueError):
+        utils.ingest_source(node('load', {'src_id': 0}, {'matrix': 1}), bundles, set([1]))
+    with pytest.raises(ValueError):
+        utils.ingest_source(node('load', {'src_id': 2}, {'matrix': 1}), bundles, set([1]))